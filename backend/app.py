@@ -4,20 +4,20 @@ def get_current_user_unified():
 
 def get_user_credits_unified(user):
     """统一的积分获取函数"""
-    return user.get('credits', 0) if user else 0
+    return user.credits if user else 0
 
 def get_user_id_unified(user):
     """统一的用户ID获取函数"""
-    return user.get('user_id') if user else None
+    return user.user_id if user else None
 
 def update_user_credits_unified(user_id, credits_change, action_type="manual"):
     """统一的积分更新函数，只使用Supabase"""
     return update_user_credits_supabase(user_id, credits_change, action_type)
 # backend/app.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_cors import CORS # 用于处理跨域请求
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
-from flask_compress import Compress
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import time
 from datetime import timedelta
@@ -30,22 +30,75 @@ load_dotenv()
 from config import get_config
 
 # 从我们创建的 services 模块中导入函数
-from services.claude_service import call_claude_api, DEFAULT_SYSTEM_PROMPT, generate_completed_essay
+from services.claude_service import (
+    call_claude_api, DEFAULT_SYSTEM_PROMPT, generate_completed_essay, essay_cache, essay_cache_key
+)
 
 # Supabase服务导入
 from services.supabase_auth_service import (
     register_user_supabase, login_user_supabase, get_current_user_supabase, 
-    get_user_profile_supabase, update_user_credits_supabase
+    get_user_profile_supabase, get_user_for_billing, update_user_credits_supabase,
+    reserve_credits_supabase, settle_credits_supabase, release_credits_supabase
 )
 from services.supabase_redemption_service import (
     create_redemption_code_supabase, redeem_code_supabase, 
     get_user_redemption_history_supabase, validate_redemption_code_supabase, 
-    get_usage_statistics_supabase
+    get_usage_statistics_supabase, register_redemption_jobs, recently_failed_code, failed_codes
 )
 
 # 导入缓存工具
 from utils.cache_utils import cache_user_data, cache_api_response, invalidate_user_cache, get_cache_stats
 
+# 数据记录类型
+from services.records import User, UsageLog, decode_rows
+
+# JSON编解码
+from utils.json_utils import FastJSONProvider, JSON_BACKEND
+
+# HTTP条件请求（ETag）和客户端IP
+from utils.http_utils import conditional_response, get_client_ip, json_body, reject_oversized_request
+
+# 令牌桶限流
+from utils.rate_limit import rate_limiter, rate_limit, rate_limited_response
+
+# LLM回复缓存
+from utils.response_cache import response_cache
+from utils.validators import history_validator
+
+# 后台任务队列（作文生成）
+from utils.job_queue import job_queue
+from utils.json_utils import dumps
+from services.essay_job_service import (
+    ESSAY_JOB_KIND, submit_essay_job, register_essay_jobs, essay_cache_payers
+)
+
+# 请求截止时间
+from utils.deadline import start_request_deadline, clear_request_deadline, request_deadline
+
+# 上游熔断器
+from services.supabase_client import supabase_breaker
+from services.claude_service import llm_router, hedge_budget
+
+# 按路由的压缩策略
+from utils.compression import PolicyCompress, compression_policy, POLICY_OFF, POLICY_FAST, POLICY_CACHED
+
+# 依赖健康探测
+from services.health_probe import create_default_prober
+
+# Prometheus指标
+from utils.metrics import REQUEST_LATENCY, render_metrics
+
+# 请求链路追踪
+from utils.tracing import tracer, parse_traceparent
+
+# LLM接口准入控制
+from utils.admission import llm_admission, admission_required
+
+# /api/chat 响应格式版本
+# 2: 只返回 reply 和 credits_remaining（默认）
+# 1: 旧格式，额外返回包含本轮对话的完整 history
+CHAT_RESPONSE_VERSION = 2
+
 # 强制使用Supabase，不再支持SQLite
 USE_SUPABASE = True
 print("系统配置: 使用Supabase作为唯一数据源")
@@ -57,13 +110,96 @@ app = Flask(__name__)
 config_class = get_config()
 app.config.from_object(config_class)
 
+# 只信任最近 TRUSTED_PROXY_COUNT 层代理追加的 X-Forwarded-For（客户端自带的值可以伪造），
+# request.remote_addr 即为真实客户端IP，限流和注册IP记录都以它为准
+trusted_proxies = app.config.get('TRUSTED_PROXY_COUNT', 0)
+if trusted_proxies > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
+# 使用更快的JSON提供者（不转义中文，优先使用orjson）
+app.json = FastJSONProvider(app)
+print(f"JSON后端: {JSON_BACKEND}")
+
+# 超过 MAX_CONTENT_LENGTH 的请求在读取请求体之前拒绝（最先执行的 before_request）
+app.before_request(reject_oversized_request)
+
 # 初始化扩展（移除SQLite相关）
 jwt = JWTManager(app)
-compress = Compress(app)
+compress = PolicyCompress(app)
 
 # 配置CORS (Cross-Origin Resource Sharing)
 CORS(app, origins=app.config.get('CORS_ORIGINS', ['*']))
 
+# 后台依赖探测器（每个worker进程在首个请求时启动）
+dependency_prober = create_default_prober(app.config)
+
+# 后台作文生成任务队列（SQLite持久化，每个worker进程启动 JOB_QUEUE_WORKERS 个线程）
+job_queue.configure(app.config)
+register_essay_jobs(timeout=app.config.get('ESSAY_JOB_TIMEOUT', 120))
+register_redemption_jobs(sweep_interval=app.config.get('REDEMPTION_EXPIRY_SWEEP_INTERVAL', 3600))
+
+@app.before_request
+def start_dependency_prober():
+    dependency_prober.ensure_started()
+    job_queue.ensure_started(app)
+
+# 请求链路追踪
+tracer.configure(app.config)
+
+# LLM接口准入控制（每个worker进程独立计数）
+llm_admission.configure(app.config)
+
+# 限流策略和共享存储
+rate_limiter.configure(app.config)
+
+# 首轮/短历史对话的LLM回复缓存
+response_cache.configure(app.config)
+
+# 对话历史校验规则（角色、长度、条数）
+history_validator.configure(app.config)
+
+# 作文生成结果缓存（SQLite持久化，worker之间共享）
+essay_cache.configure(
+    enabled=app.config.get('ESSAY_CACHE_ENABLED', True),
+    path=app.config.get('ESSAY_CACHE_PATH'),
+    max_entries=app.config.get('ESSAY_CACHE_MAX_ENTRIES')
+)
+
+# 请求延迟指标（按路由模板汇总，避免路径参数导致标签膨胀）
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+    start_request_deadline(app.config, g.request_start_time)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    tracer.start_trace(
+        f"{request.method} {route}",
+        trace_id=parse_traceparent(request.headers.get('traceparent')),
+        route=route, method=request.method
+    )
+
+@app.after_request
+def record_request_latency(response):
+    start_time = g.pop('request_start_time', None)
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if start_time is not None:
+        REQUEST_LATENCY.labels(
+            route=route, method=request.method, status=str(response.status_code)
+        ).observe(time.perf_counter() - start_time)
+
+    trace_id = tracer.current_trace_id()
+    if trace_id:
+        response.headers['X-Trace-Id'] = trace_id
+    tracer.finish_trace(status=response.status_code)
+    return response
+
+@app.teardown_request
+def clear_deadline(exc):
+    clear_request_deadline()
+
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return jsonify({"error": "请求体过大"}), 413
+
 # JWT错误处理
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
@@ -83,9 +219,9 @@ def is_admin_user(user):
     if not user:
         return False
 
-    # Supabase格式 (字典)
-    if isinstance(user, dict):
-        return user.get('username') == 'admin'
+    # Supabase用户记录
+    if isinstance(user, User):
+        return user.is_admin
 
     return False
 
@@ -99,6 +235,46 @@ def sanitize_input(text):
         return ""
     return text.strip()[:1000]  # 限制最大长度
 
+def validate_chat_body(data):
+    """校验 /api/chat 请求体，返回 (success, error_message, body)"""
+    user_message_content = data.get('message') # 用户当前发送的消息内容
+    if not user_message_content or not isinstance(user_message_content, str):
+        return False, "请求中必须包含 'message' 字段", None
+
+    # 输入验证和清理
+    user_message_content = sanitize_input(user_message_content)
+    if not validate_input_length(user_message_content):
+        return False, "消息内容过长或为空", None
+
+    # 对话历史，期望格式为 [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
+    valid, history_error, conversation_history = history_validator.validate(data.get('history', []))
+    if not valid:
+        return False, history_error, None
+
+    return True, "", {
+        "message": user_message_content,
+        "history": conversation_history,
+        "include_history": data.get('include_history') is True or data.get('response_version') == 1
+    }
+
+def validate_essay_body(data):
+    """校验 /api/complete_essay 请求体中的对话历史，返回 (success, error_message, body)"""
+    conversation_history = data.get('history') # 前端发送的是完整的对话历史
+    if not isinstance(conversation_history, list):
+        # 注意：允许空列表，因为 generate_completed_essay 内部会处理历史为空的情况
+        # 但通常前端 script.js 中已做了非空判断
+        return False, "请求中必须包含 'history' 字段，且其值必须是一个列表", None
+    valid, history_error, conversation_history = history_validator.validate(conversation_history)
+    if not valid:
+        return False, history_error, None
+    return True, "", {"history": conversation_history}
+
+def validate_essay_job_body(data):
+    """校验 /api/essay_jobs 请求体：对话历史不能为空"""
+    if not data.get('history'):
+        return False, "请求中必须包含 'history' 字段，且其值必须是一个非空列表", None
+    return validate_essay_body(data)
+
 # 根路由
 @app.route('/')
 def index():
@@ -106,6 +282,7 @@ def index():
 
 # 用户认证相关路由
 @app.route('/api/register', methods=['POST'])
+@rate_limit('register')
 def register():
     """用户注册 - 使用Supabase"""
     try:
@@ -121,9 +298,7 @@ def register():
             return jsonify({"error": "用户名、邮箱和密码都是必填项"}), 400
 
         # 获取客户端IP
-        ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        if ip_address and ',' in ip_address:
-            ip_address = ip_address.split(',')[0].strip()
+        ip_address = get_client_ip()
 
         # 使用Supabase注册
         success, message, user_data = register_user_supabase(username, email, password, ip_address)
@@ -131,7 +306,7 @@ def register():
         if success:
             return jsonify({
                 "message": message,
-                "user": user_data,
+                "user": user_data.to_dict() if user_data else None,
                 "database": "Supabase"
             }), 201
         else:
@@ -142,6 +317,7 @@ def register():
         return jsonify({"error": "服务器内部错误"}), 500
 
 @app.route('/api/login', methods=['POST'])
+@rate_limit('login')
 def login():
     """用户登录 - 使用Supabase"""
     try:
@@ -156,9 +332,7 @@ def login():
             return jsonify({"error": "用户名和密码都是必填项"}), 400
 
         # 获取客户端IP
-        ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        if ip_address and ',' in ip_address:
-            ip_address = ip_address.split(',')[0].strip()
+        ip_address = get_client_ip()
 
         # 使用Supabase登录
         success, message, login_data = login_user_supabase(username, password, ip_address)
@@ -167,7 +341,7 @@ def login():
             return jsonify({
                 "message": message,
                 "access_token": login_data['access_token'],
-                "user": login_data['user'],
+                "user": login_data['user'].to_dict(),
                 "database": "Supabase"
             }), 200
         else:
@@ -179,7 +353,7 @@ def login():
 
 @app.route('/api/user/profile', methods=['GET'])
 @jwt_required()
-@cache_user_data(ttl=600)  # 缓存10分钟
+@conditional_response()
 def get_profile():
     """获取用户资料"""
     try:
@@ -189,7 +363,7 @@ def get_profile():
         if success:
             return jsonify({
                 "message": message,
-                "user": user_data
+                "user": user_data.to_dict()
             }), 200
         else:
             return jsonify({"error": message}), 404
@@ -200,6 +374,7 @@ def get_profile():
 
 @app.route('/api/redeem', methods=['POST'])
 @jwt_required()
+@rate_limit('redeem')
 def redeem():
     """兑换积分"""
     try:
@@ -211,6 +386,13 @@ def redeem():
         if not code:
             return jsonify({"error": "兑换码不能为空"}), 400
 
+        # 重复提交最近查询不到的兑换码：仍然查询数据库（布隆过滤器可能误判），但额外计入更严格的限流
+        if recently_failed_code(code):
+            retry_after = rate_limiter.hit('redeem_retry')
+            if retry_after is not None:
+                app.logger.warning(f"重复提交无效兑换码被限流: ip={get_client_ip()}")
+                return rate_limited_response(retry_after)
+
         current_user_id = get_jwt_identity()
         success, message, credits_gained = redeem_code_supabase(code, current_user_id)
 
@@ -227,7 +409,9 @@ def redeem():
         return jsonify({"error": "服务器内部错误"}), 500
 
 @app.route('/api/user/redemption-history', methods=['GET'])
+@compression_policy(POLICY_CACHED)
 @jwt_required()
+@conditional_response()
 def get_redemption_history():
     """获取用户兑换记录"""
     try:
@@ -237,7 +421,7 @@ def get_redemption_history():
         if success:
             return jsonify({
                 "message": message,
-                "history": history
+                "history": [code.to_dict() for code in history]
             }), 200
         else:
             return jsonify({"error": message}), 400
@@ -247,7 +431,9 @@ def get_redemption_history():
         return jsonify({"error": "服务器内部错误"}), 500
 
 @app.route('/api/user/usage-history', methods=['GET'])
+@compression_policy(POLICY_CACHED)
 @jwt_required()
+@conditional_response()
 def get_usage_history():
     """获取用户使用记录"""
     try:
@@ -270,7 +456,7 @@ def get_usage_history():
         if success:
             return jsonify({
                 "message": "获取成功",
-                "history": usage_logs
+                "history": [log.to_dict() for log in decode_rows(UsageLog, usage_logs)]
             }), 200
         else:
             return jsonify({"error": "获取使用记录失败"}), 500
@@ -288,12 +474,9 @@ def get_credits():
         current_user = get_current_user_supabase()
 
         if current_user:
-            credits = current_user.get('credits', 0)
-            user_id = current_user.get('user_id')
-                
             return jsonify({
-                "credits": credits,
-                "user_id": user_id
+                "credits": current_user.credits,
+                "user_id": current_user.user_id
             }), 200
         else:
             return jsonify({"error": "用户不存在"}), 404
@@ -329,7 +512,7 @@ def admin_generate_code():
         if success:
             return jsonify({
                 "message": message,
-                "code": code_data
+                "code": code_data.to_dict()
             }), 201
         else:
             return jsonify({"error": message}), 400
@@ -339,7 +522,9 @@ def admin_generate_code():
         return jsonify({"error": "服务器内部错误"}), 500
 
 @app.route('/api/admin/statistics', methods=['GET'])
+@compression_policy(POLICY_CACHED)
 @jwt_required()
+@conditional_response()
 def admin_get_statistics():
     """管理员获取使用统计"""
     try:
@@ -403,7 +588,7 @@ def admin_get_users():
             
             return jsonify({
                 "message": "获取成功",
-                "users": users_data,
+                "users": [user.to_dict() for user in decode_rows(User, users_data)],
                 "pagination": {
                     "page": page,
                     "per_page": per_page,
@@ -436,10 +621,10 @@ def admin_get_user(user_id):
         if not success or not users:
             return jsonify({"error": "用户不存在"}), 404
 
-        user = users[0]
+        user = User.from_row(users[0])
         return jsonify({
             "message": "获取成功",
-            "user": user
+            "user": user.to_dict()
         }), 200
 
     except Exception as e:
@@ -463,7 +648,7 @@ def admin_update_user(user_id):
         if not success or not users:
             return jsonify({"error": "用户不存在"}), 404
 
-        user = users[0]
+        user = User.from_row(users[0])
         data = request.get_json()
         if not data:
             return jsonify({"error": "请求体不能为空"}), 400
@@ -479,7 +664,7 @@ def admin_update_user(user_id):
         # 更新邮箱
         if 'email' in data:
             email = data.get('email')
-            if email and email != user.get('email'):
+            if email and email != user.email:
                 # 检查邮箱是否已被其他用户使用
                 success, existing_user = supabase.get_user_by_email(email)
                 if success and existing_user and existing_user[0]['user_id'] != user_id:
@@ -497,18 +682,20 @@ def admin_update_user(user_id):
             if not success:
                 return jsonify({"error": "用户信息更新失败"}), 500
 
+            invalidate_user_cache(user_id)
+
             # 获取更新后的用户信息
             success, updated_users = supabase.get_user_by_id(user_id)
-            updated_user = updated_users[0] if success and updated_users else user
+            updated_user = User.from_row(updated_users[0]) if success and updated_users else user
 
             return jsonify({
                 "message": "用户信息更新成功",
-                "user": updated_user
+                "user": updated_user.to_dict()
             }), 200
         else:
             return jsonify({
                 "message": "没有需要更新的信息",
-                "user": user
+                "user": user.to_dict()
             }), 200
 
     except Exception as e:
@@ -521,142 +708,325 @@ def user_change_password():
     """用户修改密码 - 暂时禁用，需要通过Supabase实现"""
     return jsonify({"error": "密码修改功能暂时不可用，请联系管理员"}), 501
 
+def billing_lookup_error(message):
+    """扣费接口读取用户失败：用户确实不存在时返回404，数据库故障（含熔断）时返回503"""
+    if message == "用户不存在":
+        return jsonify({"error": "用户不存在"}), 404
+    response = jsonify({"error": "服务暂时不可用，请稍后再试", "retry_after": 5})
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
 @app.route('/api/chat', methods=['POST'])
+@compression_policy(POLICY_FAST)
 @jwt_required()  # 添加JWT保护
+@request_deadline('chat')
+@json_body(validate_chat_body)
+@rate_limit('chat')
+@admission_required()
 def chat_handler():
     """
     处理来自前端的聊天请求。
     接收用户消息和对话历史，调用Claude API，并返回AI的回复。
     现在需要消耗1积分。
+
+    默认只返回 reply 和 credits_remaining；请求体中设置 "include_history": true
+    或 "response_version": 1 时，额外返回更新后的完整 history（旧格式）。
+
+    检查顺序：请求体大小 -> JSON解析和校验 -> 限流/准入 -> 缓存的积分 -> 预扣积分 -> LLM
     """
     try:
-        # 检查用户积分
-        current_user = get_current_user_supabase()
-        if not current_user:
-            return jsonify({"error": "用户不存在"}), 404
-
-        user_credits = get_user_credits_unified(current_user)
-        if user_credits < 1:
+        body = g.request_body
+        user_message_content = body["message"]
+        conversation_history = body["history"]
+
+        # 检查用户积分（使用缓存的用户资料）
+        user_id = get_jwt_identity()
+        found, lookup_message, current_user = get_user_for_billing(user_id, 1)
+        if not found:
+            return billing_lookup_error(lookup_message)
+        if get_user_credits_unified(current_user) < 1:
             return jsonify({"error": "积分不足，请先充值"}), 402
 
-        data = request.get_json() # 获取前端发送的JSON数据
-        if not data:
-            return jsonify({"error": "请求体不能为空，且必须是JSON格式"}), 400
-
-        user_message_content = data.get('message') # 用户当前发送的消息内容
-        # 对话历史，期望格式为 [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
-        conversation_history = data.get('history', [])
-
-        if not user_message_content:
-            return jsonify({"error": "请求中必须包含 'message' 字段"}), 400
-
-        # 输入验证和清理
-        user_message_content = sanitize_input(user_message_content)
-        if not validate_input_length(user_message_content):
-            return jsonify({"error": "消息内容过长或为空"}), 400
-
-        if not isinstance(conversation_history, list):
-            return jsonify({"error": "'history' 字段必须是一个列表"}), 400
-        for msg in conversation_history:
-            if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
-                return jsonify({"error": "历史记录中的每条消息都必须包含 'role' 和 'content' 字段"}), 400
-
-        # 构建发送给Claude的消息历史
-        messages_to_send = conversation_history + [
-            {"role": "user", "content": user_message_content}
-        ]
+        # 预扣积分：并发请求可能同时通过上面的余额检查，以数据库中的扣减结果为准
+        reserved, reserve_message, new_credits = reserve_credits_supabase(user_id, 1)
+        if not reserved:
+            if reserve_message == "积分不足":
+                return jsonify({"error": "积分不足，请先充值"}), 402
+            app.logger.error(f"预扣积分失败: {reserve_message}")
+            return jsonify({"error": "积分扣除失败"}), 500
+
+        # 预扣之后的任何失败（包括异常）都在 finally 中退还积分；
+        # 结算失败时 settle_credits_supabase 已自行退还，不再重复
+        settled = False
+        try:
+            # 调用Claude API（首轮/短历史对话可能直接命中回复缓存）
+            success, response_content, _ = response_cache.get_or_call(
+                "chat", DEFAULT_SYSTEM_PROMPT, conversation_history, user_message_content,
+                lambda: call_claude_api(
+                    conversation_history, new_messages=({"role": "user", "content": user_message_content},)
+                )
+            )
 
-        # 调用Claude API
-        success, response_content = call_claude_api(messages_to_send)
+            if not success:
+                # AI调用失败，返回错误信息（response_content 在失败时是错误消息字符串）
+                return jsonify({"error": response_content}), 500
 
-        if success:
-            # AI成功回复，扣除积分
-            user_id = get_user_id_unified(current_user)
-            credits_success, credits_message, new_credits = update_user_credits_unified(
-                user_id, -1, "chat"
-            )
+            # AI成功回复，结算预扣的积分
+            credits_success, credits_message, _ = settle_credits_supabase(user_id, 1, "chat")
+            settled = True
 
             if not credits_success:
                 app.logger.error(f"扣除积分失败: {credits_message}")
                 return jsonify({"error": "积分扣除失败"}), 500
+        finally:
+            if not settled:
+                release_credits_supabase(user_id, 1)
+
+        response_data = {
+            "reply": response_content,
+            "credits_remaining": new_credits,  # 返回剩余积分
+            "response_version": CHAT_RESPONSE_VERSION
+        }
 
-            # 更新后的历史应包含AI的这条新回复
-            updated_history = conversation_history + [
-                {"role": "user", "content": user_message_content}, # 用户的消息
+        # 仅在客户端明确要求时返回完整历史，避免响应体随对话长度增长
+        if body["include_history"]:
+            response_data["history"] = conversation_history + [
+                {"role": "user", "content": user_message_content},
                 {"role": "assistant", "content": response_content} # AI的回复
             ]
-            return jsonify({
-                "reply": response_content,
-                "history": updated_history, # 将更新后的完整历史返回给前端
-                "credits_remaining": new_credits  # 返回剩余积分
-            }), 200
-        else:
-            # AI调用失败，返回错误信息
-            # response_content 在失败时是错误消息字符串
-            return jsonify({"error": response_content}), 500
+            response_data["response_version"] = 1
+
+        return jsonify(response_data), 200
 
     except Exception as e:
         app.logger.error(f"处理 /api/chat 请求时发生意外错误: {e}") # 记录更详细的服务器端错误日志
         return jsonify({"error": "服务器内部发生未知错误，请稍后再试。"}), 500
 
 @app.route('/api/complete_essay', methods=['POST'])
+@compression_policy(POLICY_FAST)
 @jwt_required()  # 添加JWT保护
+@request_deadline('essay')
+@json_body(validate_essay_body)
+@rate_limit('essay')
+@admission_required()
 def complete_essay_handler():
     """
     处理来自前端的"完成作文"请求。
     接收对话历史，调用服务生成完整作文，并返回结果。
     现在需要消耗5积分。
+
+    相同的对话历史命中作文缓存时直接返回（响应中 "cached": true）；
+    同一用户重复提交未变化的对话不再重复扣费。
     """
     try:
-        # 检查用户积分
-        current_user = get_current_user_unified()
-        if not current_user:
-            return jsonify({"error": "用户不存在"}), 404
+        conversation_history = g.request_body["history"]
+
+        # 使用缓存的用户资料；缓存的积分不足5时重新读取
+        user_id = get_jwt_identity()
+        found, lookup_message, current_user = get_user_for_billing(user_id, 5)
+        if not found:
+            return billing_lookup_error(lookup_message)
 
         user_credits = get_user_credits_unified(current_user)
+        cache_key = essay_cache_key(conversation_history) if conversation_history else None
+        cached = essay_cache.get(cache_key) if cache_key else None
+        if cached is not None and user_id in cached.get("paid_by", []):
+            # 重复点击或浏览器重试：返回已生成的作文，不再扣费
+            # （积分未变化，缓存的用户记录可能已过期，因此不返回 credits_remaining）
+            return jsonify({
+                "completed_essay": cached["essay"],
+                "cached": True
+            }), 200
+
+        # 检查用户积分
         if user_credits < 5:
             return jsonify({"error": "积分不足，完成作文需要5积分"}), 402
 
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "请求体不能为空，且必须是JSON格式"}), 400
-
-        conversation_history = data.get('history') # 前端发送的是完整的对话历史
-
-        if conversation_history is None or not isinstance(conversation_history, list):
-            # 注意：允许空列表，因为 generate_completed_essay 内部会处理历史为空的情况
-            # 但通常前端 script.js 中已做了非空判断
-            return jsonify({"error": "请求中必须包含 'history' 字段，且其值必须是一个列表"}), 400
+        # 预扣积分，生成失败时退还
+        reserved, reserve_message, new_credits = reserve_credits_supabase(user_id, 5)
+        if not reserved:
+            if reserve_message == "积分不足":
+                return jsonify({"error": "积分不足，完成作文需要5积分"}), 402
+            app.logger.error(f"预扣积分失败: {reserve_message}")
+            return jsonify({"error": "积分扣除失败"}), 500
+
+        # 预扣之后的任何失败（包括异常）都在 finally 中退还积分；
+        # 结算失败时 settle_credits_supabase 已自行退还，不再重复
+        settled = False
+        try:
+            # 其他用户已用相同的对话生成过作文时直接复用（仍正常扣费）
+            if cached is not None:
+                success, essay_or_error = True, cached["essay"]
+            else:
+                success, essay_or_error = generate_completed_essay(conversation_history)
 
-        # 调用新的服务函数来生成完整作文
-        success, essay_or_error = generate_completed_essay(conversation_history)
+            if not success:
+                # essay_or_error 在失败时是错误消息字符串
+                app.logger.error(f"生成完整作文失败: {essay_or_error}") # 记录服务器端错误
+                return jsonify({"error": essay_or_error}), 500
 
-        if success:
-            # 生成成功，扣除积分
-            user_id = get_user_id_unified(current_user)
-            credits_success, credits_message, new_credits = update_user_credits_unified(
-                user_id, -5, "complete_essay"
-            )
-            
+            # 生成成功，结算预扣的积分
+            credits_success, credits_message, _ = settle_credits_supabase(user_id, 5, "complete_essay")
+            settled = True
 
             if not credits_success:
                 app.logger.error(f"扣除积分失败: {credits_message}")
                 return jsonify({"error": "积分扣除失败"}), 500
+        finally:
+            if not settled:
+                release_credits_supabase(user_id, 5)
 
-            return jsonify({
-                "completed_essay": essay_or_error,
-                "credits_remaining": new_credits  # 返回剩余积分
-            }), 200
-        else:
-            # essay_or_error 在失败时是错误消息字符串
-            app.logger.error(f"生成完整作文失败: {essay_or_error}") # 记录服务器端错误
-            return jsonify({"error": essay_or_error}), 500
+        # 扣费成功后才缓存，记录已付费的用户，其重复提交时免费返回；
+        # 缓存写入失败不影响已扣费的结果
+        try:
+            essay_cache.set(cache_key, {"essay": essay_or_error, "paid_by": essay_cache_payers(cached, user_id)})
+        except Exception as e:
+            app.logger.warning(f"作文缓存写入失败: {e}")
+
+        return jsonify({
+            "completed_essay": essay_or_error,
+            "credits_remaining": new_credits,  # 返回剩余积分
+            "cached": cached is not None
+        }), 200
 
     except Exception as e:
         app.logger.error(f"处理 /api/complete_essay 请求时发生意外错误: {e}")
         return jsonify({"error": "服务器内部在生成作文时发生未知错误。"}), 500
 
+@app.route('/api/essay_jobs', methods=['POST'])
+@jwt_required()
+@json_body(validate_essay_job_body)
+@rate_limit('essay')
+def submit_essay_job_handler():
+    """
+    提交后台作文生成任务，立即返回任务ID（202）
+    预扣5积分，任务完成时结算，失败时退还；结果通过
+    GET /api/essay_jobs/<job_id> 轮询或 GET /api/essay_jobs/<job_id>/events（SSE）获取
+    """
+    try:
+        conversation_history = g.request_body["history"]
+
+        user_id = get_jwt_identity()
+        max_pending = app.config.get('ESSAY_JOB_MAX_PENDING_PER_USER', 2)
+        if job_queue.count_pending(user_id, ESSAY_JOB_KIND) >= max_pending:
+            response = jsonify({"error": "您有作文正在生成中，请等待完成后再试", "retry_after": 5})
+            response.headers['Retry-After'] = '5'
+            return response, 429
+
+        found, lookup_message, current_user = get_user_for_billing(user_id, 5)
+        if not found:
+            return billing_lookup_error(lookup_message)
+
+        success, message, job = submit_essay_job(
+            user_id, get_user_credits_unified(current_user), conversation_history
+        )
+        if not success:
+            if message == "积分不足":
+                return jsonify({"error": "积分不足，完成作文需要5积分"}), 402
+            app.logger.error(f"提交作文任务失败: {message}")
+            return jsonify({"error": message}), 500
+
+        body = job.to_dict()
+        body["status_url"] = f"/api/essay_jobs/{job.id}"
+        body["events_url"] = f"/api/essay_jobs/{job.id}/events"
+        return jsonify(body), 200 if job.finished else 202
+
+    except Exception as e:
+        app.logger.error(f"处理 /api/essay_jobs 请求时发生意外错误: {e}")
+        return jsonify({"error": "服务器内部错误"}), 500
+
+def _get_own_job(job_id):
+    """只返回当前用户自己的任务"""
+    job = job_queue.get(job_id)
+    if job is None or job.user_id != get_jwt_identity():
+        return None
+    return job
+
+@app.route('/api/essay_jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_essay_job_handler(job_id):
+    """查询作文任务状态；?wait=秒 时长轮询，状态变化或超时后返回"""
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+
+    wait = min(request.args.get('wait', 0, type=float), app.config.get('ESSAY_JOB_SSE_TIMEOUT', 60))
+    if wait > 0 and not job.finished:
+        job = job_queue.wait(job_id, job.status, wait) or job
+    return jsonify(job.to_dict()), 200, {"Cache-Control": "no-store"}
+
+@app.route('/api/essay_jobs/<job_id>/events', methods=['GET'])
+@compression_policy(POLICY_OFF)
+@jwt_required()
+def essay_job_events_handler(job_id):
+    """
+    以SSE推送作文任务状态（event: status），任务结束或超过 ESSAY_JOB_SSE_TIMEOUT 秒后关闭，
+    客户端可重新连接继续等待
+    """
+    job = _get_own_job(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在"}), 404
+
+    stream_timeout = app.config.get('ESSAY_JOB_SSE_TIMEOUT', 60)
+
+    def generate(job):
+        deadline = time.monotonic() + stream_timeout
+        yield "retry: 3000\n\n"
+        while True:
+            yield f"event: status\ndata: {dumps(job.to_dict())}\n\n"
+            remaining = deadline - time.monotonic()
+            if job.finished or remaining <= 0:
+                return
+            # 每15秒至少发送一次，避免代理断开空闲连接
+            current = job_queue.wait(job.id, job.status, min(15, remaining))
+            if current is None:
+                return
+            job = current
+
+    return Response(generate(job), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no"
+    })
+
+@app.route('/livez', methods=['GET'])
+@compression_policy(POLICY_OFF)
+def livez():
+    """存活检查 - 不做任何I/O，进程能处理请求即返回200"""
+    return "ok", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"}
+
+@app.route('/readyz', methods=['GET'])
+@compression_policy(POLICY_OFF)
+def readyz():
+    """就绪检查 - 返回后台探测器缓存的依赖状态，不在请求中访问依赖"""
+    dependencies = dependency_prober.snapshot()
+    ready = dependency_prober.is_ready()
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "timestamp": int(time.time()),
+        "dependencies": dependencies
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+@compression_policy(POLICY_OFF)
+def metrics():
+    """Prometheus指标（gunicorn多进程下汇总所有worker）"""
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        # 未配置令牌时仅调试模式开放，生产环境默认关闭
+        if not app.debug:
+            return jsonify({"error": "未配置METRICS_TOKEN，指标接口已关闭"}), 403
+    elif request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({"error": "权限不足"}), 403
+
+    rendered = render_metrics()
+    if rendered is None:
+        return jsonify({"error": "未安装 prometheus_client，指标不可用"}), 501
+
+    body, content_type = rendered
+    return body, 200, {"Content-Type": content_type}
+
 @app.route('/api/health', methods=['GET'])
+@compression_policy(POLICY_OFF)
 def health_check():
     """健康检查端点 - 用于Render等平台监控"""
     try:
@@ -669,17 +1039,17 @@ def health_check():
             "environment": os.environ.get('FLASK_ENV', 'production')
         }
         
-        # 可选：检查数据库连接
+        # 数据库状态来自后台探测器的缓存结果
         if USE_SUPABASE:
-            try:
-                # 简单的Supabase连接测试
-                from services.supabase_client import SupabaseClient
-                supabase = SupabaseClient()
-                success, result = supabase._make_request('GET', 'users', params={'limit': 1})
-                health_data["database"] = "connected" if success else "failed"
-            except Exception as e:
-                health_data["database"] = f"error: {str(e)}"
+            database = dependency_prober.snapshot()['supabase']
+            if database['status'] == 'up':
+                health_data["database"] = "connected"
+            elif database['status'] == 'down':
+                health_data["database"] = "failed"
                 health_data["status"] = "degraded"
+            else:
+                health_data["database"] = "unknown"
+            health_data["database_checked_seconds_ago"] = database['age_seconds']
         
         return jsonify(health_data), 200
         
@@ -692,6 +1062,7 @@ def health_check():
         }), 500
 
 @app.route('/api/database/status', methods=['GET'])
+@compression_policy(POLICY_OFF)
 def database_status():
     """获取数据库状态信息"""
     try:
@@ -702,17 +1073,13 @@ def database_status():
             "timestamp": datetime.utcnow().isoformat()
         }
 
-        # 检查Supabase数据库连接
-        try:
-            from services.supabase_client import SupabaseClient
-            supabase = SupabaseClient()
-            # 简单的连接测试
-            success, result = supabase._make_request('GET', 'users', params={'limit': 1})
-            status["connection_status"] = "connected" if success else "failed"
-            status["connection_error"] = result.get("error") if not success else None
-        except Exception as e:
-            status["connection_status"] = "failed"
-            status["connection_error"] = str(e)
+        # Supabase连接状态来自后台探测器的缓存结果
+        database = dependency_prober.snapshot()['supabase']
+        status["connection_status"] = {
+            'up': "connected", 'down': "failed"
+        }.get(database['status'], "unknown")
+        status["connection_error"] = database.get('error')
+        status["checked_seconds_ago"] = database['age_seconds']
 
         return jsonify(status), 200
 
@@ -721,13 +1088,30 @@ def database_status():
         return jsonify({"error": "获取数据库状态失败"}), 500
 
 @app.route('/api/cache/stats', methods=['GET'])
+@jwt_required()
 def cache_stats():
-    """获取缓存统计信息"""
+    """获取缓存统计信息（需要管理员权限）"""
     try:
+        current_user = get_current_user_unified()
+        if not is_admin_user(current_user):
+            return jsonify({"error": "权限不足"}), 403
+
         stats = get_cache_stats()
         return jsonify({
             "message": "缓存统计获取成功",
-            "stats": stats
+            "stats": stats,
+            "compression": compress.get_stats(),
+            "admission": llm_admission.get_stats(),
+            "rate_limit": rate_limiter.get_stats(),
+            "response_cache": response_cache.get_stats(),
+            "essay_cache": essay_cache.get_stats(),
+            "job_queue": job_queue.get_stats(),
+            "circuit_breakers": {
+                "supabase": supabase_breaker.get_stats()
+            },
+            "llm_backends": llm_router.get_stats(),
+            "llm_hedge": hedge_budget.get_stats(),
+            "redemption_failed_codes": failed_codes.get_stats()
         }), 200
     except Exception as e:
         app.logger.error(f"获取缓存统计失败: {e}")
@@ -744,6 +1128,7 @@ def clear_cache():
 
         from utils.cache_utils import clear_all_cache
         clear_all_cache()
+        failed_codes.clear()
 
         return jsonify({"message": "缓存清除成功"}), 200
     except Exception as e:
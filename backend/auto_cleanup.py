@@ -2,10 +2,20 @@
 """
 自动数据库清理脚本
 直接执行清理操作，无需交互确认
+
+- 按主键分批（keyset）用过滤条件批量删除：每批只查询第 --batch-size 行的主键作为上界，
+  再删除 主键<=上界 的行，URL长度与批大小无关，不逐行发请求
+- --dry-run 只统计将被删除的行数，不做任何修改
+- --usage-log-days / --code-days 设置保留天数，只删除更早的记录（默认0表示全部删除）
+- 删除用户前先删除其使用记录并解除兑换码关联，保留 --keep-users 指定的账号
+
+用法: python auto_cleanup.py [--dry-run] [--usage-log-days 30] [--tables usage_logs,users]
 """
 
+import argparse
 import sys
 import os
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -15,7 +25,12 @@ load_dotenv()
 sys.path.append(os.path.dirname(__file__))
 
 from services.supabase_client import SupabaseClient
-from datetime import datetime
+from datetime import datetime, timedelta
+
+TABLES = ('usage_logs', 'redemption_codes', 'users')
+
+# in.(...) 过滤中每个请求最多的ID数（UUID约40字节/个，100个约4KB，低于网关的请求行长度限制）
+ID_CHUNK_SIZE = 100
 
 def print_separator(title):
     """打印分隔符"""
@@ -23,55 +38,164 @@ def print_separator(title):
     print(f" {title} ")
     print("="*60)
 
-def cleanup_data():
-    """清理数据库数据"""
-    print_separator("执行数据库清理")
-    
+def _in_list(values):
+    """PostgREST in.(...) 的值列表（加双引号，值中含逗号或括号时也能正确解析）"""
+    return '(' + ','.join('"' + str(value).replace('"', '\\"') + '"' for value in values) + ')'
+
+def count_rows(client, table, filters):
+    """统计满足条件的行数，失败时返回 None"""
+    success, result = client._make_request('GET', table, params={**filters, 'select': 'count'})
+    if success and result:
+        return result[0]['count']
+    return None
+
+def _key_bound(client, table, key, filters, batch_size):
+    """满足 filters 的行中按 key 排序的第 batch_size 行的主键；不足一批时返回 None"""
+    success, rows = client._make_request('GET', table, params={
+        **filters, 'select': key, 'order': f'{key}.asc', 'offset': str(batch_size - 1), 'limit': '1'
+    })
+    if not success:
+        return False, rows
+    return True, rows[0][key] if rows else None
+
+def delete_in_batches(client, table, key, filters, batch_size, before_delete=None):
+    """
+    按主键 key 分批删除满足 filters 的行，打印进度
+    before_delete(batch_filters) 在删除每批之前调用（如删除依赖这些行的记录），返回 (success, error)
+    返回: (success: bool, deleted_count: int)
+    """
+    total = count_rows(client, table, filters)
+    deleted = 0
+    started = time.monotonic()
+    while True:
+        success, bound = _key_bound(client, table, key, filters, batch_size)
+        if not success:
+            print(f"   ❌ 查询 {table} 失败: {bound}")
+            return False, deleted
+        # 剩余不足一批时按原过滤条件删除全部剩余行
+        batch_filters = {**filters, key: f'lte.{bound}'} if bound is not None else filters
+
+        if before_delete is not None:
+            success, error = before_delete(batch_filters)
+            if not success:
+                print(f"   ❌ 清理 {table} 的关联数据失败: {error}")
+                return False, deleted
+
+        success, result = client._make_request('DELETE', table, params=batch_filters)
+        if not success:
+            print(f"   ❌ 删除 {table} 失败: {result}")
+            return False, deleted
+        batch_deleted = len(result) if isinstance(result, list) else 0
+        deleted += batch_deleted
+
+        if batch_deleted:
+            elapsed = time.monotonic() - started
+            progress = f"{deleted}/{total}" if total is not None else str(deleted)
+            print(f"   ... 已删除 {progress} 行 ({elapsed:.1f}s)")
+        if bound is None:
+            return True, deleted
+
+def _cutoff(days):
+    """保留天数对应的截止时间（days <= 0 表示不保留）"""
+    if days <= 0:
+        return None
+    return (datetime.utcnow() - timedelta(days=days)).isoformat()
+
+def build_plan(usage_log_days=0, code_days=0, keep_users=('admin', 'pan')):
+    """
+    每个表的 (主键, 过滤条件, 说明)
+    过滤条件与删除条件一致，dry-run 和实际删除使用同一份
+    """
+    plan = {}
+
+    usage_log_cutoff = _cutoff(usage_log_days)
+    if usage_log_cutoff:
+        plan['usage_logs'] = ('log_id', {'timestamp': f'lt.{usage_log_cutoff}'}, f"{usage_log_days}天前的使用记录")
+    else:
+        plan['usage_logs'] = ('log_id', {'log_id': 'not.is.null'}, "全部使用记录")
+
+    code_cutoff = _cutoff(code_days)
+    if code_cutoff:
+        # 只删除已无法兑换的兑换码（已使用或已被过期清理任务标记），未使用的兑换码不受保留天数影响
+        plan['redemption_codes'] = ('code_id', {
+            'created_at': f'lt.{code_cutoff}',
+            'or': '(is_used.is.true,expired_at.not.is.null)'
+        }, f"{code_days}天前创建且已使用或已过期的兑换码")
+    else:
+        plan['redemption_codes'] = ('code_id', {'code_id': 'not.is.null'}, "全部兑换码")
+
+    filters = {'username': f'not.in.{_in_list(keep_users)}'} if keep_users else {'user_id': 'not.is.null'}
+    kept = '、'.join(keep_users) if keep_users else '无'
+    plan['users'] = ('user_id', filters, f"除 {kept} 外的全部用户")
+    return plan
+
+def _detach_users(client):
+    """
+    删除用户前：删除这些用户的使用记录，解除其已使用兑换码的关联（外键约束）
+    关联表只能按 user_id 列表过滤，每个请求最多 ID_CHUNK_SIZE 个ID，避免URL过长
+    """
+    def before_delete(batch_filters):
+        success, users = client._make_request('GET', 'users', params={**batch_filters, 'select': 'user_id'})
+        if not success:
+            return False, users
+        user_ids = [user['user_id'] for user in users]
+        for start in range(0, len(user_ids), ID_CHUNK_SIZE):
+            ids = _in_list(user_ids[start:start + ID_CHUNK_SIZE])
+            success, result = client._make_request('DELETE', 'usage_logs', params={'user_id': f'in.{ids}'})
+            if not success:
+                return False, result
+            success, result = client._make_request('PATCH', 'redemption_codes',
+                params={'used_by_user_id': f'in.{ids}'},
+                data={'used_by_user_id': None}
+            )
+            if not success:
+                return False, result
+        return True, None
+    return before_delete
+
+def cleanup_data(tables=TABLES, dry_run=False, batch_size=500, usage_log_days=0, code_days=0,
+                 keep_users=('admin', 'pan')):
+    """
+    清理数据库数据
+    返回: {表名: 删除（dry-run 时为将删除）的行数，失败时为 None}
+    """
+    print_separator("统计将被清理的数据（dry-run）" if dry_run else "执行数据库清理")
+    results = {}
+
     try:
         client = SupabaseClient()
-        
-        # 1. 清理usage_logs表的所有数据
-        print("🗑️ 清理使用记录表 (usage_logs)...")
-        # 使用不同的方式清理 - 直接删除所有记录
-        success, result = client._make_request('DELETE', 'usage_logs', params={'log_id': 'not.is.null'})
-        if success:
-            print("   ✅ 使用记录表清理完成")
-        else:
-            print(f"   ❌ 清理使用记录表失败: {result}")
-        
-        # 2. 清理redemption_codes表的所有数据
-        print("\n🗑️ 清理兑换码表 (redemption_codes)...")
-        success, result = client._make_request('DELETE', 'redemption_codes', params={'code_id': 'not.is.null'})
-        if success:
-            print("   ✅ 兑换码表清理完成")
-        else:
-            print(f"   ❌ 清理兑换码表失败: {result}")
-        
-        # 3. 删除除了admin和pan之外的所有用户
-        print("\n🗑️ 清理用户表 (users) - 保留admin和pan...")
-        
-        # 首先获取所有用户
-        success, users = client._make_request('GET', 'users')
-        if success and users:
-            deleted_count = 0
-            for user in users:
-                username = user.get('username', '')
-                if username not in ['admin', 'pan']:
-                    user_id = user.get('user_id')
-                    success, result = client._make_request('DELETE', 'users', params={'user_id': f'eq.{user_id}'})
-                    if success:
-                        print(f"   ✅ 删除用户: {username}")
-                        deleted_count += 1
-                    else:
-                        print(f"   ❌ 删除用户 {username} 失败: {result}")
-            
-            print(f"\n   📊 共删除 {deleted_count} 个用户账号")
-        
-        print("\n🎉 数据库清理完成！")
-        
+        plan = build_plan(usage_log_days, code_days, keep_users)
+
+        for table in TABLES:
+            if table not in tables:
+                continue
+            key, filters, description = plan[table]
+            print(f"\n🗑️ {table}: {description}")
+
+            if dry_run:
+                count = count_rows(client, table, filters)
+                results[table] = count
+                if count is None:
+                    print("   ❌ 统计失败")
+                else:
+                    print(f"   📊 将删除 {count} 行")
+                continue
+
+            before_delete = _detach_users(client) if table == 'users' else None
+            success, deleted = delete_in_batches(client, table, key, filters, batch_size, before_delete)
+            results[table] = deleted if success else None
+            if success:
+                print(f"   ✅ {table} 清理完成，共删除 {deleted} 行")
+            else:
+                print(f"   ⚠️ {table} 清理中断，已删除 {deleted} 行，可重新运行继续")
+
+        print("\n🎉 统计完成（未修改任何数据）" if dry_run else "\n🎉 数据库清理完成！")
+
     except Exception as e:
         print(f"❌ 清理数据时发生错误: {e}")
 
+    return results
+
 def get_remaining_data():
     """获取清理后的剩余数据"""
     print_separator("清理后的数据库状态")
@@ -79,10 +203,12 @@ def get_remaining_data():
     try:
         client = SupabaseClient()
         
-        # 获取剩余用户数据
+        # 获取剩余用户数据（只列出前20个）
         print("\n👥 剩余用户:")
-        success, users = client._make_request('GET', 'users', params={'order': 'created_at.asc'})
+        total_users = count_rows(client, 'users', {})
+        success, users = client._make_request('GET', 'users', params={'order': 'created_at.asc', 'limit': '20'})
         if success and users:
+            print(f"  用户总数: {total_users}")
             for i, user in enumerate(users, 1):
                 print(f"  {i}. 用户名: {user.get('username', 'N/A')}")
                 print(f"     邮箱: {user.get('email', 'N/A')}")
@@ -94,31 +220,35 @@ def get_remaining_data():
         
         # 检查兑换码表
         print("\n🎟️ 兑换码表状态:")
-        success, codes = client._make_request('GET', 'redemption_codes')
-        if success and codes:
-            print(f"  剩余兑换码数量: {len(codes)}")
+        codes = count_rows(client, 'redemption_codes', {})
+        if codes is None:
+            print("  查询失败")
+        elif codes:
+            print(f"  剩余兑换码数量: {codes}")
         else:
             print("  兑换码表已清空")
         
         # 检查使用记录表
         print("\n📊 使用记录表状态:")
-        success, logs = client._make_request('GET', 'usage_logs')
-        if success and logs:
-            print(f"  剩余记录数量: {len(logs)}")
+        logs = count_rows(client, 'usage_logs', {})
+        if logs is None:
+            print("  查询失败")
+        elif logs:
+            print(f"  剩余记录数量: {logs}")
         else:
             print("  使用记录表已清空")
             
     except Exception as e:
         print(f"❌ 获取数据时发生错误: {e}")
 
-def get_admin_info():
-    """获取admin和pan账号的详细信息"""
+def get_admin_info(usernames=('admin', 'pan')):
+    """获取保留的管理员账号（默认admin和pan）的详细信息"""
     print_separator("管理员账号信息")
     
     try:
         client = SupabaseClient()
         
-        for username in ['admin', 'pan']:
+        for username in usernames:
             print(f"\n🔑 用户: {username}")
             success, users = client._make_request('GET', 'users', params={'username': f'eq.{username}'})
             
@@ -144,26 +274,57 @@ def get_admin_info():
     except Exception as e:
         print(f"❌ 获取管理员信息时发生错误: {e}")
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Supabase 数据库清理工具')
+    parser.add_argument('--dry-run', action='store_true', help='只统计将被删除的行数，不修改数据')
+    parser.add_argument('--tables', default=','.join(TABLES),
+                        help=f'要清理的表，逗号分隔（默认: {",".join(TABLES)}）')
+    parser.add_argument('--batch-size', type=int, default=int(os.environ.get('CLEANUP_BATCH_SIZE', 500)),
+                        help='每批删除的行数')
+    parser.add_argument('--usage-log-days', type=int,
+                        default=int(os.environ.get('CLEANUP_USAGE_LOG_DAYS', 0)),
+                        help='保留最近N天的使用记录（0表示全部删除）')
+    parser.add_argument('--code-days', type=int, default=int(os.environ.get('CLEANUP_CODE_DAYS', 0)),
+                        help='只删除N天前创建且已使用或已过期的兑换码（0表示全部删除）')
+    parser.add_argument('--keep-users', default='admin,pan', help='保留的用户名，逗号分隔')
+    args = parser.parse_args(argv)
+
+    args.tables = [table.strip() for table in args.tables.split(',') if table.strip()]
+    unknown = [table for table in args.tables if table not in TABLES]
+    if unknown:
+        parser.error(f"未知的表: {', '.join(unknown)}")
+    if args.batch_size <= 0:
+        parser.error("--batch-size 必须大于0")
+    args.keep_users = tuple(name.strip() for name in args.keep_users.split(',') if name.strip())
+    return args
+
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
     print_separator("Supabase 数据库自动清理工具")
-    print("正在执行数据库清理操作...")
+    print("正在统计将被清理的数据..." if args.dry_run else "正在执行数据库清理操作...")
     
     # 执行清理
-    cleanup_data()
+    results = cleanup_data(
+        tables=args.tables, dry_run=args.dry_run, batch_size=args.batch_size,
+        usage_log_days=args.usage_log_days, code_days=args.code_days, keep_users=args.keep_users
+    )
     
+    if args.dry_run:
+        return 0 if all(count is not None for count in results.values()) else 1
+
     # 显示清理后的状态
     get_remaining_data()
     
     # 显示管理员信息
-    get_admin_info()
+    get_admin_info(args.keep_users)
     
     print_separator("清理操作完成")
     print("📝 总结:")
-    print("   • 已删除除admin和pan外的所有用户")
-    print("   • 已清空所有兑换码记录")
-    print("   • 已清空所有使用记录")
-    print("   • 保留了admin和pan两个管理员账号")
+    for table, deleted in results.items():
+        print(f"   • {table}: " + (f"删除 {deleted} 行" if deleted is not None else "清理失败"))
+    print(f"   • 保留了 {'、'.join(args.keep_users) or '无'} 账号")
+    return 0 if all(deleted is not None for deleted in results.values()) else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# backend/benchmarks/bench_history.py
+"""
+对话历史校验微基准（200条消息）
+比较：
+- 旧版 /api/chat 的逐条 isinstance 检查（不检查角色和长度）
+- 逐条调用校验函数并构造新列表的直接实现（与 HistoryValidator 规则相同）
+- HistoryValidator 单次反向遍历（不复制列表）
+
+运行: python -m benchmarks.bench_history
+"""
+import timeit
+
+from benchmarks.bench_json import STUDENT_TURN, TUTOR_TURN
+from utils.validators import HistoryValidator
+
+ALLOWED_ROLES = ('user', 'assistant')
+
+
+def build_history(messages=200):
+    return [
+        {"role": "user", "content": STUDENT_TURN} if i % 2 == 0 else {"role": "assistant", "content": TUTOR_TURN}
+        for i in range(messages)
+    ]
+
+
+def legacy_check(history):
+    if not isinstance(history, list):
+        return False
+    for msg in history:
+        if not isinstance(msg, dict) or "role" not in msg or "content" not in msg:
+            return False
+    return True
+
+
+def _check_message(msg, max_chars):
+    if not isinstance(msg, dict):
+        return False
+    if msg.get("role") not in ALLOWED_ROLES:
+        return False
+    content = msg.get("content")
+    return isinstance(content, str) and len(content) <= max_chars
+
+
+def naive_validate(history, max_messages=200, max_chars=4000, max_total=60000):
+    if not isinstance(history, list):
+        return False, None
+    if not all(_check_message(msg, max_chars) for msg in history):
+        return False, None
+    kept = list(history[-max_messages:])
+    total = sum(len(msg["content"]) for msg in kept)
+    while total > max_total:
+        total -= len(kept.pop(0)["content"])
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return True, kept
+
+
+def _bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call_us = seconds / number * 1e6
+    print(f"  {label:<28} {per_call_us:10.1f} us/次")
+    return per_call_us
+
+
+def main():
+    history = build_history()
+    validator = HistoryValidator()
+    assert validator.validate(history)[2] is history
+
+    print("对话历史校验 (200条消息，全部保留):")
+    legacy = _bench("旧版 isinstance 循环", lambda: legacy_check(history), 5000)
+    base = _bench("逐条校验 + 复制", lambda: naive_validate(history), 5000)
+    fast = _bench("HistoryValidator", lambda: validator.validate(history), 5000)
+    print(f"  加速比(同等规则): {base / fast:.2f}x")
+    print(f"  相对旧版循环: {fast / legacy:.2f}x 耗时（旧版不检查角色、类型和长度）")
+
+    # 总长度超限，需要截掉最早的消息
+    tight = HistoryValidator(max_total_chars=3000)
+    assert naive_validate(history, max_total=3000)[1] == tight.validate(history)[2]
+    print("\n对话历史校验 (200条消息，总长度限制3000字，截断):")
+    base = _bench("逐条校验 + 复制", lambda: naive_validate(history, max_total=3000), 500)
+    fast = _bench("HistoryValidator", lambda: tight.validate(history), 5000)
+    print(f"  加速比: {base / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
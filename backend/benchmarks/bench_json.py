@@ -0,0 +1,84 @@
+# backend/benchmarks/bench_json.py
+"""
+JSON编解码微基准
+比较Flask默认JSON提供者（标准库、转义中文、排序键）与 FastJSONProvider 在
+真实聊天负载上的编码耗时和响应体积，以及PostgREST行的解码耗时。
+
+运行: python -m benchmarks.bench_json
+"""
+import json
+import timeit
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from utils.json_utils import FastJSONProvider, JSON_BACKEND, loads
+
+STUDENT_TURN = "我想写一篇关于夏天的作文，夏天的时候我和爸爸妈妈去海边玩，看到了很多贝壳，还堆了沙堡。"
+TUTOR_TURN = (
+    "听起来是一次很棒的旅行！你能描述一下第一眼看到大海时的感受吗？"
+    "比如海水的颜色、海浪的声音，或者海风吹在脸上的感觉。试着用一个比喻来形容它。"
+)
+
+
+def build_chat_payload(turns=30):
+    """构造一个带完整历史的聊天响应（与 /api/chat 旧版响应结构一致）"""
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": STUDENT_TURN})
+        history.append({"role": "assistant", "content": TUTOR_TURN})
+    return {"reply": TUTOR_TURN, "history": history, "credits_remaining": 42}
+
+
+def build_user_rows(count=50):
+    """构造PostgREST返回的用户行"""
+    return json.dumps([
+        {
+            "user_id": f"00000000-0000-0000-0000-{i:012d}",
+            "username": f"student_{i}",
+            "email": f"student_{i}@example.com",
+            "password_hash": "$2b$12$" + "x" * 53,
+            "credits": i,
+            "is_active": True,
+            "registration_ip": "10.0.0.1",
+            "created_at": "2025-01-01T00:00:00+00:00",
+            "last_login": None,
+        }
+        for i in range(count)
+    ]).encode("utf-8")
+
+
+def _bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call_us = seconds / number * 1e6
+    print(f"  {label:<28} {per_call_us:10.1f} us/次")
+    return per_call_us
+
+
+def main():
+    app = Flask(__name__)
+    default_provider = DefaultJSONProvider(app)
+    fast_provider = FastJSONProvider(app)
+    payload = build_chat_payload()
+    rows = build_user_rows()
+
+    print(f"JSON后端: {JSON_BACKEND}")
+
+    with app.app_context():
+        default_body = default_provider.response(payload).get_data()
+        fast_body = fast_provider.response(payload).get_data()
+        print("\n聊天响应编码 (30轮历史):")
+        base = _bench("Flask默认 jsonify", lambda: default_provider.response(payload), 2000)
+        fast = _bench("FastJSONProvider", lambda: fast_provider.response(payload), 2000)
+        print(f"  加速比: {base / fast:.2f}x")
+        print(f"  响应体积: {len(default_body)} -> {len(fast_body)} 字节 "
+              f"({(1 - len(fast_body) / len(default_body)) * 100:.1f}% 更小)")
+
+    print("\nPostgREST行解码 (50个用户):")
+    base = _bench("json.loads", lambda: json.loads(rows), 2000)
+    fast = _bench("json_utils.loads", lambda: loads(rows), 2000)
+    print(f"  加速比: {base / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
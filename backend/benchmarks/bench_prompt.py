@@ -0,0 +1,72 @@
+# backend/benchmarks/bench_prompt.py
+"""
+LLM请求体组装微基准
+比较聊天请求的旧版组装方式（复制历史列表、扫描 system 消息、整体序列化字典）与 PromptPayload
+（预序列化的系统提示 + 字节拼接）在50轮对话上的每次调用耗时，以及故障转移/对冲时
+复用已序列化 messages 的耗时。作文请求按普通方式组装，不在此比较。
+
+运行: python -m benchmarks.bench_prompt
+"""
+import timeit
+
+from benchmarks.bench_json import STUDENT_TURN, TUTOR_TURN
+from services.claude_service import DEFAULT_SYSTEM_PROMPT
+from services.prompt_builder import PromptPayload
+from utils.json_utils import JSON_BACKEND, dumps_bytes, loads
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+
+def build_history(turns=50):
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": STUDENT_TURN})
+        history.append({"role": "assistant", "content": TUTOR_TURN})
+    return history
+
+
+def legacy_chat_body(history, message):
+    """旧版 /api/chat 路径：app 复制历史追加新消息，call_claude_api 再扫描并复制一次"""
+    messages_to_send = history + [{"role": "user", "content": message}]
+    final_messages = []
+    if not any(msg.get("role") == "system" for msg in messages_to_send):
+        final_messages.append({"role": "system", "content": DEFAULT_SYSTEM_PROMPT})
+    final_messages.extend(messages_to_send)
+    return dumps_bytes({"temperature": 0.7, "messages": final_messages, "model": MODEL, "stream": False})
+
+
+def builder_chat_body(history, message):
+    prompt = PromptPayload(history, DEFAULT_SYSTEM_PROMPT, ({"role": "user", "content": message},))
+    return prompt.body(MODEL, 0.7)
+
+
+def _bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    per_call_us = seconds / number * 1e6
+    print(f"  {label:<28} {per_call_us:10.1f} us/次")
+    return per_call_us
+
+
+def main():
+    history = build_history()
+    message = "我觉得海水是蓝色的，像一块很大的宝石。"
+
+    # 两种方式生成的请求内容必须一致
+    assert loads(legacy_chat_body(history, message)) == loads(builder_chat_body(history, message))
+
+    print(f"JSON后端: {JSON_BACKEND}")
+    print(f"\n聊天请求体 (50轮历史, {len(builder_chat_body(history, message))} 字节):")
+    base = _bench("旧版组装", lambda: legacy_chat_body(history, message), 2000)
+    fast = _bench("PromptPayload", lambda: builder_chat_body(history, message), 2000)
+    print(f"  加速比: {base / fast:.2f}x")
+
+    print("\n故障转移/对冲时重新生成请求体:")
+    prompt = PromptPayload(history, DEFAULT_SYSTEM_PROMPT, ({"role": "user", "content": message},))
+    prompt.body(MODEL, 0.7)
+    base = _bench("旧版（重新序列化）", lambda: legacy_chat_body(history, message), 2000)
+    fast = _bench("复用 messages", lambda: prompt.body("claude-3-5-haiku-20241022", 0.7), 2000)
+    print(f"  加速比: {base / fast:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
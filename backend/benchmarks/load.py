@@ -0,0 +1,534 @@
+# backend/benchmarks/load.py
+"""
+离线负载测试
+启动模拟PostgREST（benchmarks.mock_postgrest）和模拟LLM（benchmarks.mock_llm），
+写入测试数据后按场景并发发送请求，输出每个接口的吞吐量和 p50/p95/p99 延迟。
+
+场景:
+- login_storm:      大量用户同时登录（主要开销是bcrypt）
+- chat_session:     登录后连续多轮聊天，对话历史逐轮增长
+- essay_completion: 提交10轮对话生成作文，随后查询积分和使用记录；每次提交不同的对话（未命中
+                    作文缓存），每第4次重新提交上一篇对话，命中缓存的延迟单独统计为 "(cache hit)"
+- admin_dashboard:  管理员轮询统计、用户列表和缓存状态
+
+默认在进程内用多线程WSGI服务器运行应用；--target 可压测单独启动的实例
+（实例的 SUPABASE_URL / CLAUDE_API_HOST 需指向本脚本启动的模拟服务，启动时会打印所需环境变量）。
+
+运行:
+  python -m benchmarks.load
+  python -m benchmarks.load --scenario chat_session --concurrency 50 --duration 30
+  python -m benchmarks.load --save baseline.json
+  python -m benchmarks.load --compare baseline.json --max-regression 0.2
+  python -m benchmarks.load --target http://127.0.0.1:5001 --postgrest-port 54321 --llm-port 8089
+
+比较gunicorn worker类型（与 start.py 相同的参数，在子进程中启动）:
+  python -m benchmarks.load --scenario chat_session --concurrency 200 --gunicorn sync
+  python -m benchmarks.load --scenario chat_session --concurrency 200 --gunicorn gthread
+"""
+import argparse
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bcrypt
+import requests
+
+from benchmarks.mock_llm import MockLLMServer
+from benchmarks.mock_postgrest import MockPostgRESTServer
+from utils.json_utils import dumps, loads
+
+BENCH_PASSWORD = 'benchpass1'
+BENCH_API_KEY = 'bench.anon.key'
+BENCH_SERVICE_KEY = 'bench.service.key'
+BENCH_CREDITS = 1_000_000
+
+STUDENT_TURN = "我想写一篇关于夏天的作文，夏天的时候我和爸爸妈妈去海边玩，看到了很多贝壳，还堆了沙堡。"
+TUTOR_TURN = "听起来是一次很棒的旅行！你能描述一下第一眼看到大海时的感受吗？"
+
+
+# ----- 统计 -----
+
+class Recorder:
+    """收集每个请求的 (接口, 耗时, 状态码)"""
+
+    def __init__(self):
+        self.samples: List[Tuple[str, float, int]] = []
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, label: str, seconds: float, status: int) -> None:
+        # list.append 在CPython中是线程安全的
+        self.samples.append((label, seconds, status))
+
+    def stop(self) -> None:
+        self.finished = time.perf_counter()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        by_label: Dict[str, List[Tuple[float, int]]] = {}
+        for label, seconds, status in self.samples:
+            by_label.setdefault(label, []).append((seconds, status))
+
+        result = {}
+        for label, entries in sorted(by_label.items()):
+            latencies = sorted(seconds for seconds, _ in entries)
+            error_statuses: Dict[str, int] = {}
+            for _, status in entries:
+                if status == 0 or status >= 400:
+                    error_statuses[str(status)] = error_statuses.get(str(status), 0) + 1
+            errors = sum(error_statuses.values())
+            result[label] = {
+                'count': len(entries),
+                'errors': errors,
+                'rps': round(len(entries) / elapsed, 2) if elapsed else 0,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'error_statuses': error_statuses,
+            }
+        return result
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近秩法百分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class BenchClient:
+    """每个虚拟用户一个连接会话，自动记录请求耗时"""
+
+    def __init__(self, base_url: str, recorder: Recorder):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.token: Optional[str] = None
+
+    def request(self, label: str, method: str, path: str, json=None, record: bool = True):
+        headers = {'Accept-Encoding': 'gzip, br'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        data = None
+        if json is not None:
+            data = dumps(json).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, data=data, headers=headers, timeout=120)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        if record:
+            self.recorder.record(label, time.perf_counter() - start, status)
+        return response
+
+    def login(self, username: str) -> bool:
+        response = self.request('POST /api/login', 'POST', '/api/login',
+                                json={'username': username, 'password': BENCH_PASSWORD}, record=False)
+        if response is None or response.status_code != 200:
+            return False
+        self.token = loads(response.content)['access_token']
+        return True
+
+
+# ----- 测试数据 -----
+
+def seed_data(postgrest_url: str, users: int, codes: int) -> Dict[str, List[str]]:
+    """通过模拟PostgREST的HTTP接口写入用户、兑换码和使用记录"""
+    session = requests.Session()
+    headers = {
+        'apikey': BENCH_API_KEY,
+        'Authorization': f'Bearer {BENCH_SERVICE_KEY}',
+        'Content-Type': 'application/json',
+        'Prefer': 'return=representation'
+    }
+
+    def insert(table: str, rows: List[Dict]) -> None:
+        for start in range(0, len(rows), 500):
+            response = session.post(f'{postgrest_url}/rest/v1/{table}', headers=headers,
+                                    data=dumps(rows[start:start + 500]).encode('utf-8'))
+            if response.status_code != 201:
+                raise RuntimeError(f'写入 {table} 失败: {response.status_code} {response.text[:200]}')
+
+    # 与生产相同的bcrypt成本；所有测试用户共用一个哈希
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    now = datetime.utcnow()
+
+    user_rows = [{
+        'user_id': str(uuid.uuid4()),
+        'username': 'admin',
+        'email': 'admin@bench.local',
+        'password_hash': password_hash,
+        'credits': BENCH_CREDITS,
+        'created_at': now.isoformat()
+    }]
+    for i in range(users):
+        user_rows.append({
+            'user_id': str(uuid.uuid4()),
+            'username': f'bench_user_{i}',
+            'email': f'bench_user_{i}@bench.local',
+            'password_hash': password_hash,
+            'credits': BENCH_CREDITS,
+            'created_at': (now - timedelta(minutes=i)).isoformat()
+        })
+    insert('users', user_rows)
+
+    code_rows = []
+    for i in range(codes):
+        used_by = random.choice(user_rows)['user_id'] if i % 3 == 0 else None
+        code_rows.append({
+            'code': f'BENCH{i:07d}',
+            'credits_value': random.choice([10, 50, 100]),
+            'is_used': used_by is not None,
+            'used_by_user_id': used_by,
+            'used_at': now.isoformat() if used_by else None,
+            'expires_at': (now + timedelta(days=30 if i % 5 else -1)).isoformat(),
+            'created_at': now.isoformat()
+        })
+    insert('redemption_codes', code_rows)
+
+    log_rows = []
+    for row in user_rows:
+        for j in range(5):
+            log_rows.append({
+                'user_id': row['user_id'],
+                'action_type': 'chat',
+                'credits_used': 1,
+                'timestamp': (now - timedelta(hours=j)).isoformat()
+            })
+    insert('usage_logs', log_rows)
+
+    return {
+        'usernames': [row['username'] for row in user_rows[1:]],
+        'user_ids': [row['user_id'] for row in user_rows[1:]]
+    }
+
+
+# ----- 场景 -----
+
+def _history(turns: int) -> List[Dict[str, str]]:
+    history = []
+    for _ in range(turns):
+        history.append({'role': 'user', 'content': STUDENT_TURN})
+        history.append({'role': 'assistant', 'content': TUTOR_TURN})
+    return history
+
+
+def login_storm_setup(client: BenchClient, vu: int, data: Dict) -> Dict:
+    return {}
+
+
+def login_storm_step(client: BenchClient, state: Dict, data: Dict) -> None:
+    username = random.choice(data['usernames'])
+    client.request('POST /api/login', 'POST', '/api/login',
+                   json={'username': username, 'password': BENCH_PASSWORD})
+
+
+def user_setup(client: BenchClient, vu: int, data: Dict) -> Dict:
+    usernames = data['usernames']
+    client.login(usernames[vu % len(usernames)])
+    return {'history': [], 'turn': 0}
+
+
+def chat_session_step(client: BenchClient, state: Dict, data: Dict) -> None:
+    if state['turn'] == 0:
+        client.request('GET /api/user/profile', 'GET', '/api/user/profile')
+
+    message = f"{STUDENT_TURN}（第{state['turn'] + 1}轮）"
+    response = client.request('POST /api/chat', 'POST', '/api/chat',
+                              json={'message': message, 'history': state['history']})
+    reply = TUTOR_TURN
+    if response is not None and response.status_code == 200:
+        reply = loads(response.content).get('reply', TUTOR_TURN)
+    state['history'] += [{'role': 'user', 'content': message}, {'role': 'assistant', 'content': reply}]
+    state['turn'] += 1
+
+    if state['turn'] % 5 == 0:
+        client.request('GET /api/user/credits', 'GET', '/api/user/credits')
+    # 每20轮开始一次新对话
+    if state['turn'] >= 20:
+        state['history'], state['turn'] = [], 0
+
+
+def _unique_history(turns: int) -> List[Dict[str, str]]:
+    """内容各不相同的对话（第一条学生消息带随机标记），不会命中作文缓存"""
+    history = _history(turns)
+    history[0] = {'role': 'user', 'content': f"{STUDENT_TURN}（{uuid.uuid4().hex[:8]}）"}
+    return history
+
+
+def essay_completion_step(client: BenchClient, state: Dict, data: Dict) -> None:
+    state['turn'] += 1
+    if state['history'] and state['turn'] % 4 == 0:
+        # 重复提交同一篇对话：命中作文缓存，与生成路径分开统计
+        client.request('POST /api/complete_essay (cache hit)', 'POST', '/api/complete_essay',
+                       json={'history': state['history']})
+    else:
+        state['history'] = _unique_history(10)
+        client.request('POST /api/complete_essay', 'POST', '/api/complete_essay', json={'history': state['history']})
+    client.request('GET /api/user/credits', 'GET', '/api/user/credits')
+    client.request('GET /api/user/usage-history', 'GET', '/api/user/usage-history')
+
+
+def admin_setup(client: BenchClient, vu: int, data: Dict) -> Dict:
+    client.login('admin')
+    return {'page': 1}
+
+
+def admin_dashboard_step(client: BenchClient, state: Dict, data: Dict) -> None:
+    client.request('GET /api/admin/statistics', 'GET', '/api/admin/statistics')
+    client.request('GET /api/admin/users', 'GET', f"/api/admin/users?page={state['page']}&per_page=20")
+    client.request('GET /api/admin/users/<user_id>', 'GET',
+                   f"/api/admin/users/{random.choice(data['user_ids'])}")
+    client.request('GET /api/cache/stats', 'GET', '/api/cache/stats')
+    state['page'] = state['page'] % 5 + 1
+
+
+SCENARIOS: Dict[str, Tuple[Callable, Callable]] = {
+    'login_storm': (login_storm_setup, login_storm_step),
+    'chat_session': (user_setup, chat_session_step),
+    'essay_completion': (user_setup, essay_completion_step),
+    'admin_dashboard': (admin_setup, admin_dashboard_step),
+}
+
+
+def run_scenario(name: str, base_url: str, data: Dict, concurrency: int, duration: float) -> Recorder:
+    """以 concurrency 个虚拟用户运行场景 duration 秒"""
+    setup, step = SCENARIOS[name]
+    recorder = Recorder()
+    ready = threading.Barrier(concurrency + 1)
+    go = threading.Event()
+    deadline = [0.0]
+
+    def virtual_user(vu: int) -> None:
+        client = BenchClient(base_url, recorder)
+        state = setup(client, vu, data)
+        # 等待其他虚拟用户期间服务端可能已关闭空闲连接（keep-alive超时），开始前丢弃
+        client.session.close()
+        ready.wait()
+        go.wait()
+        while time.perf_counter() < deadline[0]:
+            step(client, state, data)
+
+    threads = [threading.Thread(target=virtual_user, args=(vu,), daemon=True) for vu in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    recorder.started = time.perf_counter()
+    deadline[0] = recorder.started + duration
+    go.set()
+    for thread in threads:
+        thread.join()
+    recorder.stop()
+    return recorder
+
+
+# ----- 输出 -----
+
+def print_report(name: str, summary: Dict[str, Dict[str, float]], extra: str = '') -> None:
+    print(f"\n=== {name} {extra}")
+    print(f"{'接口':<36}{'请求数':>8}{'错误':>7}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for label, row in summary.items():
+        print(f"{label:<36}{row['count']:>8}{row['errors']:>7}{row['rps']:>9.1f}"
+              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+        if row['errors']:
+            # 状态码0表示连接失败或超时
+            details = ', '.join(f'{status}×{count}' for status, count in sorted(row['error_statuses'].items()))
+            print(f"{'':<36}错误状态码: {details}")
+
+
+def compare_with_baseline(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """p95 超过基线 (1 + max_regression) 倍或出现新错误的接口"""
+    regressions = []
+    for scenario, summary in results.items():
+        for label, row in summary.items():
+            base = baseline.get(scenario, {}).get(label)
+            if not base:
+                continue
+            if base['p95_ms'] and row['p95_ms'] > base['p95_ms'] * (1 + max_regression):
+                regressions.append(
+                    f"{scenario} {label}: p95 {base['p95_ms']}ms -> {row['p95_ms']}ms"
+                )
+            if row['errors'] and not base['errors']:
+                regressions.append(f"{scenario} {label}: 出现 {row['errors']} 个错误")
+    return regressions
+
+
+# ----- 启动 -----
+
+def configure_environment(postgrest_url: str, llm_host: str) -> Dict[str, str]:
+    """让应用指向模拟服务（需在导入 app 之前调用）"""
+    env = {
+        'SUPABASE_URL': postgrest_url,
+        'SUPABASE_ANON_KEY': BENCH_API_KEY,
+        'SUPABASE_SERVICE_KEY': BENCH_SERVICE_KEY,
+        'CLAUDE_API_KEY': 'bench-llm-key',
+        'CLAUDE_API_HOST': llm_host,
+        'CLAUDE_API_SCHEME': 'http',
+        'USE_SUPABASE': 'true',
+        # 所有虚拟用户来自同一个IP，压测时关闭限流
+        'RATE_LIMIT_ENABLED': 'false',
+    }
+    os.environ.update(env)
+    return env
+
+
+def start_inprocess_app() -> str:
+    """在后台线程中用多线程WSGI服务器运行应用，返回base URL"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    import logging
+    from app import app
+    app.logger.setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def start_gunicorn(worker_class: str, workers: int, threads: int) -> Tuple[str, subprocess.Popen]:
+    """在子进程中以指定worker类型启动gunicorn（参数与 start.py 一致），返回 (base URL, 进程)"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    cmd = [
+        sys.executable, '-m', 'gunicorn',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(workers),
+        '--timeout', '30',
+        '--keep-alive', '2',
+        '--worker-class', worker_class,
+        '--log-level', 'warning',
+    ]
+    if worker_class == 'gthread':
+        cmd += ['--threads', str(threads)]
+    elif worker_class == 'gevent':
+        cmd += ['--worker-connections', str(max(threads, 500))]
+    if worker_class != 'gevent':
+        cmd.append('--preload')
+    cmd.append('app:app')
+
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(cmd, cwd=backend_dir, env=dict(os.environ), stdout=subprocess.DEVNULL)
+    return f'http://127.0.0.1:{port}', process
+
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{url}/livez', timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'{url} 在 {timeout} 秒内未就绪')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='离线负载测试（模拟Supabase和LLM）')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='要运行的场景，可重复指定；默认全部')
+    parser.add_argument('--concurrency', type=int, default=20, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=15, help='每个场景的持续时间（秒）')
+    parser.add_argument('--users', type=int, default=200, help='测试用户数')
+    parser.add_argument('--codes', type=int, default=1000, help='测试兑换码数')
+    parser.add_argument('--target', help='压测外部实例的base URL（默认在进程内运行应用）')
+    parser.add_argument('--gunicorn', choices=['sync', 'gthread', 'gevent'],
+                        help='在子进程中用指定worker类型的gunicorn运行应用')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker数（WEB_CONCURRENCY）')
+    parser.add_argument('--threads', type=int, default=100, help='gthread每个worker的线程数')
+    parser.add_argument('--postgrest-port', type=int, default=0)
+    parser.add_argument('--postgrest-latency-ms', type=float, default=5, help='模拟数据库往返延迟')
+    parser.add_argument('--llm-port', type=int, default=0)
+    parser.add_argument('--llm-ttfb', type=float, default=0.3, help='模拟LLM首字节延迟（秒）')
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--llm-output-chars', type=int, default=120)
+    parser.add_argument('--llm-chars-per-sec', type=float, default=150.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--save', help='把结果保存为JSON（可作为基线）')
+    parser.add_argument('--compare', help='与基线JSON比较，p95退化超过阈值时返回非0')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='允许的p95退化比例')
+    args = parser.parse_args(argv)
+
+    postgrest = MockPostgRESTServer(port=args.postgrest_port, latency=args.postgrest_latency_ms / 1000).start()
+    llm = MockLLMServer(
+        port=args.llm_port, ttfb=args.llm_ttfb, jitter=args.llm_jitter, output_chars=args.llm_output_chars,
+        chars_per_sec=args.llm_chars_per_sec, error_rate=args.llm_error_rate
+    ).start()
+    env = configure_environment(postgrest.url, llm.host)
+
+    gunicorn = None
+    if args.target:
+        print("被测实例需使用以下环境变量启动:")
+        print(' '.join(f'{key}={value}' for key, value in env.items()))
+        base_url = args.target.rstrip('/')
+        wait_for(base_url)
+    elif args.gunicorn:
+        base_url, gunicorn = start_gunicorn(args.gunicorn, args.workers, args.threads)
+        print(f"gunicorn: {args.workers} 个 {args.gunicorn} worker")
+        wait_for(base_url)
+    else:
+        base_url = start_inprocess_app()
+
+    try:
+        return _run(args, base_url, postgrest, llm)
+    finally:
+        if gunicorn is not None:
+            gunicorn.terminate()
+            gunicorn.wait(timeout=30)
+
+
+def _run(args, base_url: str, postgrest: MockPostgRESTServer, llm: MockLLMServer) -> int:
+    """写入测试数据、依次运行场景并输出/保存/比较结果"""
+    print(f"写入测试数据: {args.users} 个用户, {args.codes} 个兑换码 ...")
+    data = seed_data(postgrest.url, args.users, args.codes)
+
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        llm.peak_in_flight = 0
+        db_requests_before = postgrest.store.request_count
+        recorder = run_scenario(name, base_url, data, args.concurrency, args.duration)
+        summary = recorder.summary()
+        results[name] = summary
+        print_report(name, summary, (
+            f"(并发 {args.concurrency}, {args.duration:.0f}s, LLM并发峰值 {llm.peak_in_flight}, "
+            f"数据库请求 {postgrest.store.request_count - db_requests_before})"
+        ))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            f.write(dumps({'concurrency': args.concurrency, 'duration': args.duration, 'results': results}))
+        print(f"\n结果已保存到 {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = loads(f.read())['results']
+        regressions = compare_with_baseline(results, baseline, args.max_regression)
+        if regressions:
+            print("\n性能退化:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\n与基线相比没有性能退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
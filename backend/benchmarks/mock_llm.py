@@ -0,0 +1,196 @@
+# backend/benchmarks/mock_llm.py
+"""
+本地模拟 OpenAI 兼容的 /v1/chat/completions 服务
+响应耗时 = 首字节延迟（含随机抖动）+ 输出字数 / 生成速度，可以模拟上游变慢或出错：
+- ttfb:          首字节延迟（秒）
+- jitter:        首字节延迟的随机抖动上限（秒）
+- output_chars:  每次回复的字数
+- chars_per_sec: 生成速度；stream=true 时按此速度分块发送SSE
+- error_rate:    返回 500 的概率
+
+运行: python -m benchmarks.mock_llm --port 8089 --ttfb 0.3
+然后设置 CLAUDE_API_HOST=127.0.0.1:8089 CLAUDE_API_SCHEME=http
+"""
+import argparse
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from utils.json_utils import dumps_bytes, loads
+
+REPLY_TEXT = (
+    "你写得很好！能再具体说说那天海边的景色吗？比如海浪的声音、沙滩的颜色，"
+    "或者你当时心里的感受。试着用一个比喻来描述你看到的画面，这样读者会更有身临其境的感觉。"
+)
+
+
+def _build_reply(length: int) -> str:
+    repeats = length // len(REPLY_TEXT) + 1
+    return (REPLY_TEXT * repeats)[:length]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockLLMServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = dumps_bytes(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        if self.path != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'not found', 'type': 'invalid_request_error'}})
+            return
+        if not (self.headers.get('Authorization') or '').startswith('Bearer '):
+            self._send_json(401, {'error': {'message': 'missing api key', 'type': 'authentication_error'}})
+            return
+        try:
+            request = loads(body)
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'invalid json', 'type': 'invalid_request_error'}})
+            return
+
+        server.begin_request()
+        try:
+            time.sleep(server.ttfb + random.uniform(0, server.jitter))
+            if random.random() < server.error_rate:
+                self._send_json(500, {'error': {'message': 'upstream overloaded', 'type': 'server_error'}})
+                return
+
+            reply = _build_reply(server.output_chars)
+            model = request.get('model', 'mock-model')
+            if request.get('stream'):
+                self._stream(reply, model)
+            else:
+                time.sleep(len(reply) / server.chars_per_sec)
+                prompt_chars = sum(len(m.get('content') or '') for m in request.get('messages', []))
+                self._send_json(200, {
+                    'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+                    'object': 'chat.completion',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{
+                        'index': 0,
+                        'message': {'role': 'assistant', 'content': reply},
+                        'finish_reason': 'stop'
+                    }],
+                    'usage': {
+                        'prompt_tokens': prompt_chars,
+                        'completion_tokens': len(reply),
+                        'total_tokens': prompt_chars + len(reply)
+                    }
+                })
+        finally:
+            server.end_request()
+
+    def _stream(self, reply: str, model: str) -> None:
+        """按生成速度分块发送SSE（chunked编码）"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        chunk_chars = 8
+        completion_id = f'chatcmpl-{uuid.uuid4().hex[:12]}'
+        for start in range(0, len(reply), chunk_chars):
+            piece = reply[start:start + chunk_chars]
+            event = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+            }
+            self._write_chunk(b'data: ' + dumps_bytes(event) + b'\n\n')
+            time.sleep(len(piece) / self.server.chars_per_sec)
+        self._write_chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """在后台线程中运行的模拟LLM服务，记录并发峰值"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, ttfb: float = 0.3, jitter: float = 0.0,
+                 output_chars: int = 120, chars_per_sec: float = 150.0, error_rate: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.ttfb = ttfb
+        self.jitter = jitter
+        self.output_chars = output_chars
+        self.chars_per_sec = chars_per_sec
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._counter_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        """CLAUDE_API_HOST 格式的 host:port"""
+        host, port = self.server_address[:2]
+        return f'{host}:{port}'
+
+    def begin_request(self) -> None:
+        with self._counter_lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end_request(self) -> None:
+        with self._counter_lock:
+            self.in_flight -= 1
+
+    def start(self) -> 'MockLLMServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟OpenAI兼容LLM服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--ttfb', type=float, default=0.3, help='首字节延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='首字节延迟随机抖动上限（秒）')
+    parser.add_argument('--output-chars', type=int, default=120, help='每次回复的字数')
+    parser.add_argument('--chars-per-sec', type=float, default=150.0, help='生成速度（字/秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回500的概率')
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.host, args.port, ttfb=args.ttfb, jitter=args.jitter, output_chars=args.output_chars,
+        chars_per_sec=args.chars_per_sec, error_rate=args.error_rate
+    )
+    print(f"模拟LLM服务已启动: {server.host}（CLAUDE_API_HOST，CLAUDE_API_SCHEME=http）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+# backend/benchmarks/mock_postgrest.py
+"""
+本地模拟 PostgREST 服务
+实现 SupabaseClient 和 supabase-py 用到的 users、redemption_codes、usage_logs 三个表，
+数据保存在内存中。支持的查询语法：
+- 过滤: eq/neq/lt/lte/gt/gte/like/ilike/is/in，以及 not. 前缀和 or=(...)
+- select=count（聚合计数）和 select=列1,列2（列投影）
+- order=列.asc|desc、limit、offset
+- POST（插入，唯一键冲突返回409）、PATCH（更新）、DELETE（删除）
+
+运行: python -m benchmarks.mock_postgrest --port 54321
+然后设置 SUPABASE_URL=http://127.0.0.1:54321
+"""
+import argparse
+import fnmatch
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from utils.json_utils import dumps_bytes, loads
+
+# 每个表的主键、唯一列和插入默认值
+TABLES = {
+    'users': {
+        'primary_key': 'user_id',
+        'unique': ('user_id', 'username', 'email'),
+        'defaults': lambda: {
+            'user_id': str(uuid.uuid4()),
+            'credits': 10,
+            'is_active': True,
+            'registration_ip': None,
+            'created_at': datetime.utcnow().isoformat(),
+            'last_login': None,
+        },
+    },
+    'redemption_codes': {
+        'primary_key': 'code_id',
+        'unique': ('code_id', 'code'),
+        'defaults': lambda: {
+            'is_used': False,
+            'used_by_user_id': None,
+            'used_at': None,
+            'expires_at': None,
+            'expired_at': None,
+            'created_by': None,
+            'created_at': datetime.utcnow().isoformat(),
+        },
+    },
+    'usage_logs': {
+        'primary_key': 'log_id',
+        'unique': ('log_id',),
+        'defaults': lambda: {
+            'timestamp': datetime.utcnow().isoformat(),
+        },
+    },
+}
+
+# 不属于过滤条件的查询参数
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'or', 'on_conflict', 'columns'}
+
+
+class PostgRESTError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def _coerce(value: str, sample: Any) -> Any:
+    """按列中已有值的类型转换过滤值"""
+    if isinstance(sample, bool):
+        return value.lower() == 'true'
+    if isinstance(sample, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(sample, float):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def _matches(row: Dict[str, Any], column: str, expression: str) -> bool:
+    """判断一行是否满足 "op.value" 形式的过滤条件"""
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition('.')
+    actual = row.get(column)
+
+    if op == 'is':
+        lowered = raw.lower()
+        if lowered == 'null':
+            result = actual is None
+        elif lowered in ('true', 'false'):
+            result = actual is (lowered == 'true')
+        else:
+            raise PostgRESTError(400, 'PGRST100', f'无效的 is 过滤值: {raw}')
+    elif op == 'in':
+        options = [item.strip().strip('"') for item in raw.strip('()').split(',')]
+        result = actual is not None and actual in [_coerce(item, actual) for item in options]
+    elif op in ('like', 'ilike'):
+        pattern = raw.replace('%', '*')
+        if actual is None:
+            result = False
+        elif op == 'ilike':
+            result = fnmatch.fnmatchcase(str(actual).lower(), pattern.lower())
+        else:
+            result = fnmatch.fnmatchcase(str(actual), pattern)
+    else:
+        if actual is None:
+            result = False
+        else:
+            expected = _coerce(raw, actual)
+            if op == 'eq':
+                result = actual == expected
+            elif op == 'neq':
+                result = actual != expected
+            elif op == 'lt':
+                result = actual < expected
+            elif op == 'lte':
+                result = actual <= expected
+            elif op == 'gt':
+                result = actual > expected
+            elif op == 'gte':
+                result = actual >= expected
+            else:
+                raise PostgRESTError(400, 'PGRST100', f'不支持的操作符: {op}')
+    return not result if negate else result
+
+
+def _parse_or(expression: str) -> List[Tuple[str, str]]:
+    """解析 or=(a.eq.1,b.ilike.*x*)，也容忍缺少括号的写法"""
+    body = expression.strip()
+    if body.startswith('(') and body.endswith(')'):
+        body = body[1:-1]
+    conditions = []
+    for part in body.split(','):
+        column, _, condition = part.partition('.')
+        conditions.append((column, condition))
+    return conditions
+
+
+class MockPostgRESTStore:
+    """内存表和查询执行"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables: Dict[str, List[Dict[str, Any]]] = {name: [] for name in TABLES}
+        self._ids = itertools.count(1)
+        self.request_count = 0
+
+    def _table(self, name: str) -> List[Dict[str, Any]]:
+        if name not in self._tables:
+            raise PostgRESTError(404, '42P01', f'relation "public.{name}" does not exist')
+        return self._tables[name]
+
+    @staticmethod
+    def _filter(rows: List[Dict[str, Any]], params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        filters = [(key, value) for key, value in params if key not in RESERVED_PARAMS]
+        or_groups = [_parse_or(value) for key, value in params if key == 'or']
+        result = []
+        for row in rows:
+            if not all(_matches(row, column, expression) for column, expression in filters):
+                continue
+            if not all(any(_matches(row, column, expression) for column, expression in group)
+                       for group in or_groups):
+                continue
+            result.append(row)
+        return result
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        query = dict(params)
+        with self._lock:
+            rows = self._filter(self._table(table), params)
+
+            select = query.get('select', '*')
+            if select.replace(' ', '') == 'count':
+                return [{'count': len(rows)}]
+
+            for clause in reversed([c for c in query.get('order', '').split(',') if c]):
+                column, _, direction = clause.partition('.')
+                descending = direction.startswith('desc')
+                present = [row for row in rows if row.get(column) is not None]
+                missing = [row for row in rows if row.get(column) is None]
+                present.sort(key=lambda row: row[column], reverse=descending)
+                # PostgreSQL默认：升序时NULL在后，降序时NULL在前
+                rows = missing + present if descending else present + missing
+
+            offset = int(query.get('offset', 0))
+            limit = query.get('limit')
+            rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+
+            if select == '*':
+                return [dict(row) for row in rows]
+            columns = [column.strip() for column in select.split(',')]
+            return [{column: row.get(column) for column in columns} for row in rows]
+
+    def insert(self, table: str, payload: Any) -> List[Dict[str, Any]]:
+        spec = TABLES.get(table)
+        new_rows = payload if isinstance(payload, list) else [payload]
+        with self._lock:
+            rows = self._table(table)
+            inserted = []
+            for data in new_rows:
+                row = spec['defaults']()
+                row.update(data)
+                if row.get(spec['primary_key']) is None:
+                    row[spec['primary_key']] = next(self._ids)
+                for column in spec['unique']:
+                    value = row.get(column)
+                    if value is not None and any(existing.get(column) == value for existing in rows):
+                        raise PostgRESTError(
+                            409, '23505',
+                            f'duplicate key value violates unique constraint "{table}_{column}_key"'
+                        )
+                rows.append(row)
+                inserted.append(dict(row))
+            return inserted
+
+    def update(self, table: str, params: List[Tuple[str, str]], changes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._filter(self._table(table), params)
+            for row in rows:
+                row.update(changes)
+            return [dict(row) for row in rows]
+
+    def delete(self, table: str, params: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._table(table)
+            doomed = self._filter(rows, params)
+            doomed_ids = {id(row) for row in doomed}
+            self._tables[table] = [row for row in rows if id(row) not in doomed_ids]
+            return doomed
+
+    def count(self, table: str) -> int:
+        with self._lock:
+            return len(self._table(table))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'MockPostgRESTServer'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Any = None) -> None:
+        payload = dumps_bytes(body) if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self) -> Any:
+        length = int(self.headers.get('Content-Length') or 0)
+        return loads(self.rfile.read(length)) if length else {}
+
+    def _handle(self, method: str) -> None:
+        store = self.server.store
+        store.request_count += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        parts = urlsplit(self.path)
+        if not parts.path.startswith('/rest/v1/'):
+            self._send(404, {'message': 'not found'})
+            return
+        if not self.headers.get('apikey'):
+            self._send(401, {'message': 'No API key found in request'})
+            return
+
+        table = parts.path[len('/rest/v1/'):].strip('/')
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        want_rows = 'return=representation' in (self.headers.get('Prefer') or '')
+        try:
+            if method == 'GET':
+                self._send(200, store.select(table, params))
+            elif method == 'POST':
+                rows = store.insert(table, self._read_json())
+                self._send(201, rows if want_rows else None)
+            elif method == 'PATCH':
+                rows = store.update(table, params, self._read_json())
+                self._send(200 if want_rows else 204, rows if want_rows else None)
+            elif method == 'DELETE':
+                rows = store.delete(table, params)
+                self._send(200 if want_rows else 204, rows if want_rows else None)
+        except PostgRESTError as e:
+            self._send(e.status, {'code': e.code, 'message': e.message, 'details': None, 'hint': None})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_HEAD(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class MockPostgRESTServer(ThreadingHTTPServer):
+    """在后台线程中运行的模拟PostgREST服务"""
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 store: Optional[MockPostgRESTStore] = None):
+        super().__init__((host, port), _Handler)
+        self.store = store or MockPostgRESTStore()
+        self.latency = latency
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'MockPostgRESTServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-postgrest', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟PostgREST服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=54321)
+    parser.add_argument('--latency-ms', type=float, default=0, help='每个请求附加的模拟网络延迟')
+    args = parser.parse_args()
+
+    server = MockPostgRESTServer(args.host, args.port, latency=args.latency_ms / 1000)
+    print(f"模拟PostgREST已启动: {server.url}（SUPABASE_URL）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
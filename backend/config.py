@@ -5,6 +5,15 @@
 import os
 from datetime import timedelta
 
+# backend 目录：SQLite 数据文件的相对路径按此解析，不随启动时的工作目录变化
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _data_path(path):
+    """相对路径按 backend 目录解析；空字符串保持为空（表示不使用文件）"""
+    if path and not os.path.isabs(path):
+        return os.path.join(BASE_DIR, path)
+    return path
+
 class Config:
     """基础配置"""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -20,6 +29,98 @@ class Config:
     
     # CORS配置
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
+    
+    # 依赖健康探测（秒）
+    HEALTH_PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 30))
+    HEALTH_PROBE_MAX_BACKOFF = float(os.environ.get('HEALTH_PROBE_MAX_BACKOFF', 300))
+    HEALTH_PROBE_TIMEOUT = float(os.environ.get('HEALTH_PROBE_TIMEOUT', 3))
+    
+    # /metrics 访问令牌（为空时仅DEBUG模式开放，生产环境拒绝访问）
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # LLM接口准入控制（每个worker进程）
+    LLM_MAX_INFLIGHT_PER_USER = int(os.environ.get('LLM_MAX_INFLIGHT_PER_USER', 2))
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 64))
+    LLM_QUEUE_SIZE = int(os.environ.get('LLM_QUEUE_SIZE', 32))
+    LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 5))
+    
+    # 令牌桶限流，格式 "key:容量/周期秒"，key 为 ip 或 user（见 utils/rate_limit.py）
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    # redis://... 时所有worker共享限流状态，未设置时每个worker独立计数
+    RATE_LIMIT_STORAGE_URL = os.environ.get('RATE_LIMIT_STORAGE_URL')
+    RATE_LIMIT_LOGIN = os.environ.get('RATE_LIMIT_LOGIN', 'ip:10/60')
+    RATE_LIMIT_REGISTER = os.environ.get('RATE_LIMIT_REGISTER', 'ip:5/3600')
+    RATE_LIMIT_REDEEM = os.environ.get('RATE_LIMIT_REDEEM', 'user:5/300,ip:20/300')
+    # 重复提交最近查询不到的兑换码时额外消耗的令牌（仍会查询数据库，见 recently_failed_code）
+    RATE_LIMIT_REDEEM_RETRY = os.environ.get('RATE_LIMIT_REDEEM_RETRY', 'user:2/600,ip:10/600')
+    RATE_LIMIT_CHAT = os.environ.get('RATE_LIMIT_CHAT', 'user:20/60')
+    RATE_LIMIT_ESSAY = os.environ.get('RATE_LIMIT_ESSAY', 'user:5/60')
+    
+    # 请求截止时间（秒，从请求开始计算），应小于 gunicorn 的 --timeout
+    # 路由用 @request_deadline('chat') 读取 REQUEST_DEADLINE_CHAT，其余路由使用默认值
+    REQUEST_DEADLINE_DEFAULT = float(os.environ.get('REQUEST_DEADLINE_DEFAULT', 10))
+    REQUEST_DEADLINE_CHAT = float(os.environ.get('REQUEST_DEADLINE_CHAT', 27))
+    REQUEST_DEADLINE_ESSAY = float(os.environ.get('REQUEST_DEADLINE_ESSAY', 27))
+    
+    # 应用前面可信的反向代理层数（如 Render 的负载均衡为1），客户端IP取 X-Forwarded-For 中
+    # 由这些代理追加的地址；0表示不信任 X-Forwarded-For，直接使用连接的对端地址
+    TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    
+    # 请求体大小上限（字节），声明的 Content-Length 超过时在读取请求体之前返回413
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 1024 * 1024))
+    
+    # 对话历史校验（见 utils/validators.py HistoryValidator）
+    HISTORY_ALLOWED_ROLES = os.environ.get('HISTORY_ALLOWED_ROLES', 'user,assistant')
+    HISTORY_MAX_MESSAGES = int(os.environ.get('HISTORY_MAX_MESSAGES', 200))
+    HISTORY_MAX_MESSAGE_CHARS = int(os.environ.get('HISTORY_MAX_MESSAGE_CHARS', 4000))
+    HISTORY_MAX_TOTAL_CHARS = int(os.environ.get('HISTORY_MAX_TOTAL_CHARS', 60000))
+    # 超出条数或总长度时：trim 截掉最早的消息，reject 返回400
+    HISTORY_OVERFLOW = os.environ.get('HISTORY_OVERFLOW', 'trim')
+    
+    # 首轮/短历史对话的LLM回复缓存（见 utils/response_cache.py）
+    RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() == 'true'
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    # 历史消息数不超过该值的对话才会缓存
+    RESPONSE_CACHE_MAX_HISTORY = int(os.environ.get('RESPONSE_CACHE_MAX_HISTORY', 2))
+    RESPONSE_CACHE_MAX_MESSAGE_CHARS = int(os.environ.get('RESPONSE_CACHE_MAX_MESSAGE_CHARS', 200))
+    # 近似匹配的字符 bigram Jaccard 相似度阈值
+    RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', 0.85))
+    # 每个问题保存的回复变体数，命中时随机返回其中一个
+    RESPONSE_CACHE_VARIANTS = int(os.environ.get('RESPONSE_CACHE_VARIANTS', 3))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+    
+    # 作文生成结果缓存（SQLite文件，所有worker共享；为空时只缓存在进程内存中）
+    ESSAY_CACHE_ENABLED = os.environ.get('ESSAY_CACHE_ENABLED', 'true').lower() == 'true'
+    ESSAY_CACHE_PATH = _data_path(os.environ.get('ESSAY_CACHE_PATH', 'essay_cache.sqlite3'))
+    ESSAY_CACHE_MAX_ENTRIES = int(os.environ.get('ESSAY_CACHE_MAX_ENTRIES', 5000))
+    
+    # 后台任务队列（SQLite文件，所有worker共享；首次使用时才创建）
+    JOB_QUEUE_PATH = _data_path(os.environ.get('JOB_QUEUE_PATH', 'jobs.sqlite3'))
+    # 每个worker进程的任务执行线程数
+    JOB_QUEUE_WORKERS = int(os.environ.get('JOB_QUEUE_WORKERS', 2))
+    # 执行中任务的租约（秒），进程崩溃后过期的任务重新入队，最多执行 JOB_MAX_ATTEMPTS 次
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 300))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 2))
+    # 已完成任务的保留时间（秒）
+    JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', 86400))
+    # 后台作文任务：上游调用截止时间、每个用户未完成任务上限、SSE/长轮询的最长等待
+    ESSAY_JOB_TIMEOUT = float(os.environ.get('ESSAY_JOB_TIMEOUT', 120))
+    ESSAY_JOB_MAX_PENDING_PER_USER = int(os.environ.get('ESSAY_JOB_MAX_PENDING_PER_USER', 2))
+    ESSAY_JOB_SSE_TIMEOUT = float(os.environ.get('ESSAY_JOB_SSE_TIMEOUT', 60))
+    # 过期兑换码清理任务：执行间隔（秒，0表示不执行）、每批标记的数量、每次最多处理的批数
+    REDEMPTION_EXPIRY_SWEEP_INTERVAL = float(os.environ.get('REDEMPTION_EXPIRY_SWEEP_INTERVAL', 3600))
+    REDEMPTION_EXPIRY_SWEEP_BATCH = int(os.environ.get('REDEMPTION_EXPIRY_SWEEP_BATCH', 500))
+    REDEMPTION_EXPIRY_SWEEP_MAX_BATCHES = int(os.environ.get('REDEMPTION_EXPIRY_SWEEP_MAX_BATCHES', 20))
+    
+    # 请求链路追踪
+    TRACE_ENABLED = os.environ.get('TRACE_ENABLED', 'false').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+    # 只记录耗时超过该毫秒数的请求，0表示全部记录
+    TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 0))
+    # file: 写入 TRACE_FILE（JSON lines）；otlp: 发送到 TRACE_OTLP_ENDPOINT
+    TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'file')
+    TRACE_FILE = os.environ.get('TRACE_FILE', 'traces.jsonl')
+    TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')
 
 class DevelopmentConfig(Config):
     """开发环境配置"""
@@ -58,7 +159,15 @@ class ProductionConfig(Config):
         'text/javascript', 'application/xml'
     ]
     COMPRESS_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
     COMPRESS_MIN_SIZE = 500
+    # 流式响应（SSE）不压缩，避免缓冲
+    COMPRESS_STREAMS = False
+    # fast 策略（聊天、作文）使用的压缩级别
+    COMPRESS_FAST_LEVEL = 1
+    COMPRESS_FAST_BR_LEVEL = 1
+    # cached 策略按ETag缓存的压缩响应体数量
+    COMPRESS_BODY_CACHE_SIZE = 256
 
 class TestingConfig(Config):
     """测试环境配置"""
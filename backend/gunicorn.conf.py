@@ -0,0 +1,26 @@
+# backend/gunicorn.conf.py
+"""
+Gunicorn配置钩子
+gunicorn 从工作目录自动加载此文件；命令行参数（start.py / Procfile）仍然生效。
+"""
+import os
+import shutil
+import tempfile
+
+
+def on_starting(server):
+    """master启动时准备Prometheus多进程指标目录（Procfile直接启动gunicorn时不经过start.py）"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        # start.py 已创建并清空
+        return
+    metrics_dir = os.path.join(tempfile.gettempdir(), 'little-writers-metrics')
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    # worker在此之后fork，会继承该环境变量
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir
+
+
+def child_exit(server, worker):
+    """worker退出时清理其Prometheus多进程指标文件"""
+    from utils.metrics import mark_process_dead
+    mark_process_dead(worker.pid)
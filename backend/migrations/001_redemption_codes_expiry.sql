@@ -0,0 +1,4 @@
+-- 001: 兑换码过期标记
+-- 后台清理任务（REDEMPTION_EXPIRY_SWEEP_INTERVAL）把已过期但未使用的兑换码的 expired_at
+-- 设为清理时间；expired_at 为空表示尚未过期或尚未被清理
+ALTER TABLE redemption_codes ADD COLUMN IF NOT EXISTS expired_at TIMESTAMP WITH TIME ZONE;
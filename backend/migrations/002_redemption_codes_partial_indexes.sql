@@ -0,0 +1,14 @@
+-- 002: redemption_codes 部分索引
+-- CREATE INDEX CONCURRENTLY 不能在事务中执行：在 SQL 编辑器中逐条执行，
+-- 或使用 psql 时不要加 --single-transaction
+-- 部分索引只包含满足 WHERE 条件的行，兑换码表增长到数百万行后索引仍保持较小
+-- 按兑换码查找（兑换、验证）只按 code 过滤，使用建表时已有的 idx_redemption_codes_code
+
+-- 兑换历史：按用户查询已使用的兑换码，按使用时间倒序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_redemption_codes_used_by_user
+    ON redemption_codes (used_by_user_id, used_at DESC) WHERE is_used;
+
+-- 过期清理和统计：未使用、未标记且有过期时间的兑换码，按过期时间排序
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_redemption_codes_pending_expiry
+    ON redemption_codes (expires_at)
+    WHERE is_used = false AND expired_at IS NULL AND expires_at IS NOT NULL;
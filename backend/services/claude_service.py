@@ -1,18 +1,60 @@
 # backend/services/claude_service.py
+import contextvars
+import hashlib
 import http.client
-import json
 import os
+import queue
+import socket
+import threading
+import time
+import unicodedata
 from dotenv import load_dotenv # 用于加载 .env 文件中的环境变量
+from utils.json_utils import loads
+from utils.metrics import LLM_TTFB, LLM_LATENCY, UPSTREAM_RETRIES, LLM_HEDGE_REQUESTS, LLM_HEDGE_WINS
+from utils.resilience import RetryBudget
+from utils.tracing import tracer
+from utils.deadline import MIN_UPSTREAM_TIMEOUT, upstream_timeout
+from utils.result_cache import ResultCache
+from services.model_router import TIER_FAST, TIER_STRONG, create_router_from_env
+from services.prompt_builder import PromptPayload
 
 # 在脚本的开头加载 .env 文件中的环境变量
 # 这样在本地开发时，os.environ.get 就能获取到 .env 文件中定义的变量
 # 在 Render 等部署平台上，环境变量会由平台直接设置
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env')) # 指向 backend/.env
 
-# 从环境变量中获取API密钥和API主机地址
+# 从环境变量中获取API密钥和默认的API主机地址（多后端配置见 services/model_router.py）
 CLAUDE_API_KEY = os.environ.get("CLAUDE_API_KEY")
 CLAUDE_API_HOST = os.environ.get("CLAUDE_API_HOST", "api.gptgod.online")
+# 设置为 http 可指向本地模拟服务（见 benchmarks/mock_llm.py），CLAUDE_API_HOST 可带端口
+CLAUDE_API_SCHEME = os.environ.get("CLAUDE_API_SCHEME", "https")
 CLAUDE_API_ENDPOINT = "/v1/chat/completions"
+DEFAULT_MODEL = "claude-3-7-sonnet-20250219"
+# 超时（秒），作用于连接和每次读取；实际值不超过当前请求截止时间的剩余预算
+CLAUDE_API_TIMEOUT = float(os.environ.get("CLAUDE_API_TIMEOUT", 25))
+# 在请求截止时间之前为LLM调用之后的积分结算/退还预留的秒数
+LLM_DEADLINE_RESERVE = float(os.environ.get("LLM_DEADLINE_RESERVE", 3))
+
+# 一次调用在上游失败后最多切换到其他后端的次数
+LLM_MAX_FAILOVERS = int(os.environ.get("LLM_MAX_FAILOVERS", 1))
+# 消息总字数不超过该值的对话轮次使用 fast 档位的模型
+LLM_FAST_MAX_PROMPT_CHARS = int(os.environ.get("LLM_FAST_MAX_PROMPT_CHARS", 4000))
+
+# LLM后端路由器：每个后端有自己的熔断器、并发上限和滑动窗口延迟/错误率统计
+llm_router = create_router_from_env(CLAUDE_API_HOST, DEFAULT_MODEL, CLAUDE_API_SCHEME)
+
+# 对冲请求：首个请求在 p95 首字节耗时内没有响应时，向其他（或同一）后端再发一个，先成功的返回
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", 0.95))
+# 后端样本数不足时使用 LLM_HEDGE_DEFAULT_DELAY；对冲延迟不低于 LLM_HEDGE_MIN_DELAY（秒）
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", 0.5))
+LLM_HEDGE_DEFAULT_DELAY = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", 8))
+# 对冲请求最多占正常请求的比例（令牌桶，最多累积 LLM_HEDGE_BURST 次）
+hedge_budget = RetryBudget(
+    ratio=float(os.environ.get("LLM_HEDGE_BUDGET_RATIO", 0.05)),
+    burst=float(os.environ.get("LLM_HEDGE_BURST", 5))
+)
 
 # 系统提示，用于引导Claude的行为
 DEFAULT_SYSTEM_PROMPT = """
@@ -42,7 +84,17 @@ COMPLETE_ESSAY_SYSTEM_PROMPT = """
 8.  请务必确保生成的作文内容全部为简体中文，不包含任何英文单词或句子。
 """
 
-def call_claude_api(messages_history, temperature=0.7, model="claude-3-7-sonnet-20250219"):
+def _new_connection(backend, timeout):
+    """按后端的协议创建到LLM主机的连接"""
+    if backend.scheme == "http":
+        return http.client.HTTPConnection(backend.host, timeout=timeout)
+    return http.client.HTTPSConnection(backend.host, timeout=timeout)
+
+def chat_tier(prompt):
+    """简短的苏格拉底式对话轮次使用 fast 档位，较长的对话使用 strong 档位"""
+    return TIER_FAST if prompt.prompt_chars() <= LLM_FAST_MAX_PROMPT_CHARS else TIER_STRONG
+
+def call_claude_api(messages_history, temperature=0.7, model=None, tier=None, system_prompt=None, new_messages=()):
     """
     调用 Claude API 获取回复。
 
@@ -51,10 +103,13 @@ def call_claude_api(messages_history, temperature=0.7, model="claude-3-7-sonnet-
                                  格式如 {"role": "user", "content": "你好"} 或
                                  {"role": "assistant", "content": "你好！有什么可以帮您？"}
                                  这个列表应该由调用者（如 Flask app）构建。
-                                 如果此列表的第一个消息不是 system role,
+                                 如果此列表的第一个消息不是 system role 且未指定 system_prompt,
                                  则会默认添加 DEFAULT_SYSTEM_PROMPT。
         temperature (float): 控制生成文本的随机性。
-        model (str): 使用的Claude模型名称。
+        model (str): 指定使用的Claude模型名称；为None时由路由器按档位选择后端。
+        tier (str): 模型档位（fast/strong）；为None时按对话长度选择（见 chat_tier）。
+        system_prompt (str): 系统提示；使用预先序列化的片段，不需要放进 messages_history。
+        new_messages (list): 追加在历史之后的本轮消息（避免调用方复制整个历史列表）。
 
     Returns:
         tuple: (success_boolean, response_data_or_error_message)
@@ -63,89 +118,281 @@ def call_claude_api(messages_history, temperature=0.7, model="claude-3-7-sonnet-
     """
     if not CLAUDE_API_KEY:
         # 在本地开发环境中允许无密钥以离线模式运行，避免前端报错循环
-        last_user_msg = messages_history[-1]["content"] if messages_history else "你好！"
+        last_user_msg = (new_messages or messages_history or [{"content": "你好！"}])[-1]["content"]
         placeholder_reply = f"[本地离线模式回复] 收到你的消息：{last_user_msg}"
         print("警告：未检测到 CLAUDE_API_KEY，已启用离线占位回复模式。")
         return True, placeholder_reply
 
-    final_messages = []
-    # 检查传入的 messages_history 是否已经包含 system prompt
-    # generate_completed_essay 会传入一个以 system prompt 开头的 messages_history
-    # 常规聊天则可能不包含，此时需要添加默认的
-    has_system_prompt = any(msg.get("role") == "system" for msg in messages_history)
-    
-    if not has_system_prompt:
-        final_messages.append({"role": "system", "content": DEFAULT_SYSTEM_PROMPT})
-    
-    final_messages.extend(messages_history)
-
-    payload = {
-        "temperature": temperature,
-        "messages": final_messages,
-        "model": model,
-        "stream": False
-    }
+    # 历史以 system 消息开头时按原样发送，否则使用 system_prompt 或默认的聊天系统提示
+    if system_prompt is None and not (messages_history and messages_history[0].get("role") == "system"):
+        system_prompt = DEFAULT_SYSTEM_PROMPT
+    prompt = PromptPayload(messages_history, system_prompt, new_messages)
+
+    if tier is None:
+        tier = chat_tier(prompt)
+    candidates = llm_router.candidates(tier, model)
+    if not candidates:
+        return False, f"未配置模型 {model} 的AI服务"
+
+    # 依次尝试候选后端：熔断器打开或并发已满的后端直接跳过，
+    # 上游明确失败（连接错误、429、5xx）时在剩余预算内切换到下一个后端
+    error_message = "AI服务暂时不可用，请稍后再试"
+    attempts = 0
+    for backend in candidates:
+        if attempts > LLM_MAX_FAILOVERS:
+            break
+        # 剩余预算不够时不再调用，留出时间给调用方退还预扣积分
+        timeout = upstream_timeout(CLAUDE_API_TIMEOUT, reserve=LLM_DEADLINE_RESERVE)
+        if timeout < MIN_UPSTREAM_TIMEOUT:
+            LLM_LATENCY.labels(model=backend.model, outcome='deadline_exceeded').observe(0)
+            return False, "请求处理超时，请稍后再试" if attempts == 0 else error_message
+        if not backend.try_acquire():
+            LLM_LATENCY.labels(model=backend.model, outcome='skipped').observe(0)
+            continue
+        if attempts > 0:
+            UPSTREAM_RETRIES.labels(upstream='llm').inc()
+            print(f"LLM故障转移到后端 {backend.name}（{backend.model}）")
+        attempts += 1
+        if LLM_HEDGE_ENABLED and attempts == 1:
+            hedge_budget.deposit()
+            alternates = [candidate for candidate in candidates if candidate is not backend] + [backend]
+            success, content, failover = _hedged_call(backend, alternates, prompt, temperature, timeout)
+        else:
+            try:
+                success, content, failover = _call_backend(backend, prompt, temperature, timeout)
+            finally:
+                backend.release()
+        if success or not failover:
+            return success, content
+        error_message = content
+    return False, error_message
+
+class _Attempt:
+    """一次上游请求的句柄：记录是否已收到响应，并允许从其他线程取消（关闭socket）"""
+    __slots__ = ('conn', 'cancelled', 'responded')
+
+    def __init__(self):
+        self.conn = None
+        self.cancelled = False
+        self.responded = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+        sock = self.conn.sock if self.conn is not None else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def _hedge_delay(backend):
+    """对冲延迟：后端成功请求首字节耗时的分位数"""
+    delay = backend.stats.ttfb_percentile(LLM_HEDGE_PERCENTILE, min_samples=LLM_HEDGE_MIN_SAMPLES)
+    return max(LLM_HEDGE_MIN_DELAY, delay if delay is not None else LLM_HEDGE_DEFAULT_DELAY)
+
+def _start_attempt(backend, prompt, temperature, timeout, results, label):
+    """在后台线程中执行请求（复制当前上下文，保留截止时间和追踪信息），结果放入 results"""
+    attempt = _Attempt()
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            result = context.run(_call_backend, backend, prompt, temperature, timeout, attempt)
+        except Exception as e:
+            result = (False, f"与AI服务通信时发生内部错误: {e}", False)
+        finally:
+            backend.release()
+            attempt.responded.set()
+        results.put((label, attempt, result))
+
+    threading.Thread(target=run, name=f"llm-{label}", daemon=True).start()
+    return attempt
+
+def _hedged_call(backend, alternates, prompt, temperature, timeout):
+    """
+    发送首个请求；超过对冲延迟仍未收到响应时（预算允许）向备选后端再发一个，
+    先成功的一方胜出，另一方被取消。backend 的并发名额已由调用方占用，此处负责归还。
+    返回: (success, 回复内容或错误信息, 是否可以切换到其他后端重试)
+    """
+    results = queue.Queue()
+    attempts = {"primary": _start_attempt(backend, prompt, temperature, timeout, results, "primary")}
+
+    if not attempts["primary"].responded.wait(_hedge_delay(backend)):
+        # 剩余预算太少时对冲请求也来不及返回
+        hedge_timeout = upstream_timeout(timeout, reserve=LLM_DEADLINE_RESERVE)
+        if hedge_timeout < LLM_HEDGE_MIN_DELAY:
+            LLM_HEDGE_REQUESTS.labels(result="no_budget_time").inc()
+        elif not hedge_budget.try_spend():
+            LLM_HEDGE_REQUESTS.labels(result="budget_exhausted").inc()
+        else:
+            hedge_backend = next((candidate for candidate in alternates if candidate.try_acquire()), None)
+            if hedge_backend is None:
+                LLM_HEDGE_REQUESTS.labels(result="no_backend").inc()
+            else:
+                LLM_HEDGE_REQUESTS.labels(result="sent").inc()
+                attempts["hedge"] = _start_attempt(
+                    hedge_backend, prompt, temperature, hedge_timeout, results, "hedge"
+                )
+
+    outcome = None
+    for _ in range(len(attempts)):
+        label, _, outcome = results.get()
+        if outcome[0]:
+            if len(attempts) > 1:
+                LLM_HEDGE_WINS.labels(winner=label).inc()
+                for other_label, other in attempts.items():
+                    if other_label != label:
+                        other.cancel()
+            return outcome
+    return outcome
+
+def _call_backend(backend, prompt, temperature, timeout, attempt=None):
+    """
+    向一个后端发送请求；attempt 被取消时不记录熔断，耗时作为删失样本计入统计
+    返回: (success, 回复内容或错误信息, 是否可以切换到其他后端重试)
+    """
+    model = backend.model
+    payload = prompt.body(model, temperature, backend.prompt_cache)
 
     headers = {
         'Accept': 'application/json',
-        'Authorization': f'Bearer {CLAUDE_API_KEY}',
+        'Authorization': f'Bearer {backend.api_key or CLAUDE_API_KEY}',
         'Content-Type': 'application/json'
     }
 
-    try:
-        conn = http.client.HTTPSConnection(CLAUDE_API_HOST)
-        conn.request("POST", CLAUDE_API_ENDPOINT, json.dumps(payload), headers)
-        res = conn.getresponse()
-        response_body = res.read().decode("utf-8")
-        conn.close()
-
-        if res.status >= 200 and res.status < 300:
-            data = json.loads(response_body)
-            if data.get("choices") and isinstance(data["choices"], list) and len(data["choices"]) > 0:
-                message = data["choices"][0].get("message", {})
-                content = message.get("content")
-                if content:
-                    return True, content
+    with tracer.span('llm.call', host=backend.host, model=model, messages=prompt.message_count) as span:
+        start_time = time.perf_counter()
+        ttfb = None
+        try:
+            conn = _new_connection(backend, timeout)
+            if attempt is not None:
+                attempt.conn = conn
+            conn.request("POST", CLAUDE_API_ENDPOINT, payload, headers)
+            if attempt is not None and attempt.cancelled:
+                conn.close()
+                backend.stats.record_censored(time.perf_counter() - start_time)
+                return False, "请求已取消", False
+            res = conn.getresponse()
+            if attempt is not None:
+                attempt.responded.set()
+            # 读取响应体时使用剩余的预算，而不是重新计时的完整超时
+            if conn.sock is not None:
+                conn.sock.settimeout(max(MIN_UPSTREAM_TIMEOUT, upstream_timeout(timeout, reserve=LLM_DEADLINE_RESERVE)))
+            ttfb = time.perf_counter() - start_time
+            LLM_TTFB.labels(model=model).observe(ttfb)
+            if span is not None:
+                span.set_attribute('ttfb_ms', round(ttfb * 1000, 1))
+                span.set_attribute('status_code', res.status)
+            response_body = res.read().decode("utf-8")
+            conn.close()
+            upstream_failed = res.status == 429 or res.status >= 500
+            if upstream_failed:
+                backend.breaker.record_failure()
+            else:
+                backend.breaker.record_success()
+            duration = time.perf_counter() - start_time
+            backend.stats.record(duration, 200 <= res.status < 300, ttfb)
+            LLM_LATENCY.labels(
+                model=model, outcome='ok' if 200 <= res.status < 300 else 'error'
+            ).observe(duration)
+
+            if res.status >= 200 and res.status < 300:
+                data = loads(response_body)
+                if data.get("choices") and isinstance(data["choices"], list) and len(data["choices"]) > 0:
+                    message = data["choices"][0].get("message", {})
+                    content = message.get("content")
+                    if content:
+                        return True, content, False
+                    else:
+                        print(f"Claude API响应解析错误: 'choices'内部结构不符合预期或'content'未找到。响应: {data}")
+                        return False, f"无法从AI回复中提取内容（结构不符）。响应：{str(data)[:200]}...", False
+                elif data.get("error") and data["error"].get("message"): # 检查API是否直接返回错误
+                    print(f"Claude API 返回错误: {data['error']['message']}")
+                    return False, data["error"]["message"], False
                 else:
-                    print(f"Claude API响应解析错误: 'choices'内部结构不符合预期或'content'未找到。响应: {data}")
-                    return False, f"无法从AI回复中提取内容（结构不符）。响应：{str(data)[:200]}..."
-            elif data.get("error") and data["error"].get("message"): # 检查API是否直接返回错误
-                print(f"Claude API 返回错误: {data['error']['message']}")
-                return False, data["error"]["message"]
+                    print(f"Claude API响应解析错误: 未知的成功响应结构。响应: {data}")
+                    return False, f"AI返回了未知格式的数据。请检查后端日志。响应开始：{str(data)[:200]}...", False
             else:
-                print(f"Claude API响应解析错误: 未知的成功响应结构。响应: {data}")
-                return False, f"AI返回了未知格式的数据。请检查后端日志。响应开始：{str(data)[:200]}..."
-        else:
-            error_message = f"AI服务请求失败 (状态码: {res.status})。"
-            try:
-                error_data = json.loads(response_body)
-                if error_data.get("error") and error_data["error"].get("message"):
-                    error_message = f"AI服务错误: {error_data['error']['message']} (状态码: {res.status})"
-                elif error_data.get("message"):
-                     error_message = f"AI服务错误: {error_data.get('message')} (状态码: {res.status})"
-            except json.JSONDecodeError:
-                error_message = f"AI服务请求失败 (状态码: {res.status})。响应: {response_body[:200]}..."
-            print(error_message)
-            return False, error_message
-
-    except http.client.HTTPException as e:
-        print(f"HTTP连接错误: {e}")
-        return False, f"网络连接到AI服务失败: {e}"
-    except json.JSONDecodeError as e:
-        response_body_for_error = response_body if 'response_body' in locals() else "N/A"
-        print(f"JSON解析错误: {e}. 响应体: {response_body_for_error[:200]}...")
-        return False, f"AI服务返回的数据格式无法解析。响应开始: {response_body_for_error[:200]}..."
-    except Exception as e:
-        print(f"调用Claude API时发生未知错误: {e}")
-        return False, f"与AI服务通信时发生内部错误: {e}"
-
-
-def generate_completed_essay(conversation_history):
+                error_message = f"AI服务请求失败 (状态码: {res.status})。"
+                try:
+                    error_data = loads(response_body)
+                    if error_data.get("error") and error_data["error"].get("message"):
+                        error_message = f"AI服务错误: {error_data['error']['message']} (状态码: {res.status})"
+                    elif error_data.get("message"):
+                         error_message = f"AI服务错误: {error_data.get('message')} (状态码: {res.status})"
+                except ValueError:
+                    error_message = f"AI服务请求失败 (状态码: {res.status})。响应: {response_body[:200]}..."
+                print(error_message)
+                return False, error_message, upstream_failed
+
+        except Exception as e:
+            # 对冲中落败被取消的请求不代表上游故障
+            if attempt is not None and attempt.cancelled:
+                duration = time.perf_counter() - start_time
+                backend.stats.record_censored(duration, ttfb)
+                LLM_LATENCY.labels(model=model, outcome='cancelled').observe(duration)
+                return False, "请求已取消", False
+            return _handle_backend_error(backend, e, timeout, start_time, ttfb,
+                                         locals().get('response_body'))
+
+def _handle_backend_error(backend, error, timeout, start_time, ttfb, response_body):
+    """记录失败的上游请求，返回 (False, 错误信息, 是否可以切换到其他后端重试)"""
+    model = backend.model
+    duration = time.perf_counter() - start_time
+    if isinstance(error, ValueError):
+        backend.breaker.record_failure()
+        response_body_for_error = response_body if response_body is not None else "N/A"
+        print(f"JSON解析错误: {error}. 响应体: {response_body_for_error[:200]}...")
+        return False, f"AI服务返回的数据格式无法解析。响应开始: {response_body_for_error[:200]}...", False
+
+    backend.stats.record(duration, False, ttfb)
+    if isinstance(error, socket.timeout):
+        # 因截止时间缩短的超时不代表上游故障，不计入熔断
+        if timeout >= CLAUDE_API_TIMEOUT:
+            backend.breaker.record_failure()
+        LLM_LATENCY.labels(model=model, outcome='timeout').observe(duration)
+        print(f"Claude API请求超时: {duration:.1f}s（{backend.name}）")
+        return False, "AI服务响应超时，请稍后再试", True
+
+    backend.breaker.record_failure()
+    LLM_LATENCY.labels(model=model, outcome='exception').observe(duration)
+    if isinstance(error, http.client.HTTPException):
+        print(f"HTTP连接错误: {error}")
+        return False, f"网络连接到AI服务失败: {error}", True
+    print(f"调用Claude API时发生未知错误: {error}")
+    return False, f"与AI服务通信时发生内部错误: {error}", isinstance(error, OSError)
+
+# 作文生成结果缓存：相同的对话历史直接返回已生成的作文（由 app 按配置设置存储路径）
+essay_cache = ResultCache("essay")
+
+def _normalize_message_content(content):
+    """统一Unicode形式并合并空白，避免前端格式差异导致缓存未命中"""
+    return " ".join(unicodedata.normalize("NFC", str(content or "")).split())
+
+def essay_cache_key(conversation_history, model=None):
+    """
+    作文缓存键：归一化的对话历史 + COMPLETE_ESSAY_SYSTEM_PROMPT + 模型 的SHA-256
+    提示词或模型变化后旧结果自然失效；未指定模型时使用 strong 档位的主模型
+    """
+    model = model or llm_router.primary_model(TIER_STRONG)
+    digest = hashlib.sha256()
+    for part in (model, COMPLETE_ESSAY_SYSTEM_PROMPT):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1e")
+    for msg in conversation_history:
+        digest.update(str(msg.get("role", "")).strip().lower().encode("utf-8"))
+        digest.update(b"\x1f")
+        digest.update(_normalize_message_content(msg.get("content")).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+def generate_completed_essay(conversation_history, model=None):
     """
     根据对话历史，调用 Claude API 生成一篇完整的作文。
 
     Args:
         conversation_history (list): 包含完整对话历史的列表。
+        model (str): 指定使用的Claude模型名称；为None时使用 strong 档位的后端。
 
     Returns:
         tuple: (success_boolean, essay_text_or_error_message)
@@ -157,13 +404,12 @@ def generate_completed_essay(conversation_history):
     if not conversation_history:
         return False, "对话历史为空，无法生成作文。"
 
-    messages_for_completion = [
-        {"role": "system", "content": COMPLETE_ESSAY_SYSTEM_PROMPT}
-    ]
+    # 作文每次对话只生成一次，按普通方式组装 messages（预序列化的系统提示片段只用于聊天）
+    messages_for_completion = [{"role": "system", "content": COMPLETE_ESSAY_SYSTEM_PROMPT}]
     messages_for_completion.extend(conversation_history)
-    
+
     # 调用通用的 call_claude_api 函数
-    success, response_content = call_claude_api(messages_for_completion)
+    success, response_content = call_claude_api(messages_for_completion, model=model, tier=TIER_STRONG)
 
     if success:
         return True, response_content
@@ -0,0 +1,111 @@
+# backend/services/essay_job_service.py
+"""
+后台生成作文
+提交时预扣积分并入队，后台worker调用 generate_completed_essay，完成时结算积分、失败时退还。
+"""
+from flask import current_app
+
+from services.claude_service import essay_cache, essay_cache_key, generate_completed_essay
+from services.supabase_auth_service import (
+    reserve_credits_supabase, settle_credits_supabase, release_credits_supabase
+)
+from utils.job_queue import Job, job_queue
+
+ESSAY_JOB_KIND = 'complete_essay'
+ESSAY_CREDITS = 5
+# 每条作文缓存记录保存的已付费用户数上限
+ESSAY_CACHE_MAX_PAYERS = 20
+
+
+def essay_cache_payers(cached, user_id):
+    """在缓存记录的已付费用户中加入 user_id"""
+    return (cached or {}).get("paid_by", [])[-(ESSAY_CACHE_MAX_PAYERS - 1):] + [user_id]
+
+
+def submit_essay_job(user_id, user_credits, conversation_history):
+    """
+    提交作文生成任务
+    同一用户重复提交未变化的对话时直接返回已完成的任务，不再扣费
+    返回: (success: bool, message: str, job: Job or None)
+    """
+    cache_key = essay_cache_key(conversation_history)
+    cached = essay_cache.get(cache_key)
+    if cached is not None and user_id in cached.get("paid_by", []):
+        # 积分未变化，缓存的用户记录可能已过期，因此结果中不包含 credits_remaining
+        job = job_queue.enqueue(ESSAY_JOB_KIND, user_id, {"cache_key": cache_key}, result={
+            "completed_essay": cached["essay"],
+            "cached": True
+        })
+        return True, "已从缓存返回", job
+
+    if user_credits < ESSAY_CREDITS:
+        return False, "积分不足", None
+
+    reserved, reserve_message, new_credits = reserve_credits_supabase(user_id, ESSAY_CREDITS)
+    if not reserved:
+        return False, reserve_message, None
+
+    try:
+        job = job_queue.enqueue(ESSAY_JOB_KIND, user_id, {
+            "history": conversation_history,
+            "cache_key": cache_key,
+            "credits_remaining": new_credits
+        })
+    except Exception as e:
+        release_credits_supabase(user_id, ESSAY_CREDITS)
+        current_app.logger.error(f"作文任务入队失败，已退还预扣积分: user_id={user_id}, error={e}")
+        return False, "任务提交失败", None
+    return True, "任务已提交", job
+
+
+def run_essay_job(job: Job):
+    """
+    后台worker执行作文生成；失败时退还预扣的积分
+    返回: (success, result_dict 或 错误信息)
+    """
+    user_id = job.user_id
+    cache_key = job.payload["cache_key"]
+    try:
+        # 排队期间其他请求可能已生成了相同对话的作文
+        cached = essay_cache.get(cache_key)
+        if cached is not None:
+            essay = cached["essay"]
+        else:
+            success, essay_or_error = generate_completed_essay(job.payload["history"])
+            if not success:
+                release_credits_supabase(user_id, ESSAY_CREDITS)
+                current_app.logger.error(f"后台生成作文失败: job={job.id}, {essay_or_error}")
+                return False, essay_or_error
+            essay = essay_or_error
+    except Exception as e:
+        release_credits_supabase(user_id, ESSAY_CREDITS)
+        current_app.logger.error(f"后台生成作文异常: job={job.id}, error={e}")
+        return False, "服务器内部在生成作文时发生未知错误。"
+
+    # 结算失败时 settle_credits_supabase 已退还预扣的积分
+    credits_success, credits_message, _ = settle_credits_supabase(user_id, ESSAY_CREDITS, "complete_essay")
+    if not credits_success:
+        current_app.logger.error(f"后台作文任务扣除积分失败: job={job.id}, {credits_message}")
+        return False, "积分扣除失败"
+
+    try:
+        essay_cache.set(cache_key, {"essay": essay, "paid_by": essay_cache_payers(cached, user_id)})
+    except Exception as e:
+        current_app.logger.warning(f"作文缓存写入失败: {e}")
+
+    return True, {
+        "completed_essay": essay,
+        "credits_remaining": job.payload.get("credits_remaining"),
+        "cached": cached is not None
+    }
+
+
+def abandon_essay_job(job: Job):
+    """任务多次超时被放弃时退还预扣的积分"""
+    release_credits_supabase(job.user_id, ESSAY_CREDITS)
+    current_app.logger.error(f"作文任务执行超时已放弃，退还预扣积分: job={job.id}, user_id={job.user_id}")
+
+
+def register_essay_jobs(timeout=120):
+    """注册作文生成任务的处理函数"""
+    job_queue.register(ESSAY_JOB_KIND, run_essay_job, on_abandon=abandon_essay_job, timeout=timeout)
@@ -0,0 +1,176 @@
+# backend/services/health_probe.py
+"""
+依赖健康探测
+后台线程定期检查 Supabase 和 LLM 主机的可用性，并缓存结果。
+健康检查接口只读取缓存结果，不在请求线程中产生任何I/O。
+"""
+import os
+import socket
+import ssl
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+
+
+class DependencyProber:
+    """
+    后台依赖探测器
+    每个依赖独立计时：成功后按固定间隔复查，失败后按指数退避重试。
+    """
+
+    def __init__(self, interval: float = 30.0, max_backoff: float = 300.0, timeout: float = 3.0):
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._checks: Dict[str, Callable[[], Tuple[bool, Optional[str]]]] = {}
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._next_run: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def register(self, name: str, check: Callable[[], Tuple[bool, Optional[str]]]) -> None:
+        """注册一个依赖检查函数，返回 (是否可用, 错误信息)"""
+        self._checks[name] = check
+        self._next_run[name] = 0.0
+        self._failures[name] = 0
+
+    def ensure_started(self) -> None:
+        """启动后台线程（gunicorn --preload 会在fork后丢失线程，按进程ID判断）"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='dependency-prober', daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for name in list(self._checks):
+                if now >= self._next_run[name]:
+                    self.probe(name)
+            next_due = min(self._next_run.values(), default=now + self.interval)
+            self._stop.wait(max(0.5, next_due - time.monotonic()))
+
+    def probe(self, name: str) -> Dict[str, Any]:
+        """立即执行一次指定依赖的检查并更新缓存结果"""
+        start = time.monotonic()
+        try:
+            ok, error = self._checks[name]()
+        except Exception as e:
+            ok, error = False, str(e)
+        latency = time.monotonic() - start
+
+        if ok:
+            self._failures[name] = 0
+            delay = self.interval
+        else:
+            self._failures[name] += 1
+            delay = min(self.max_backoff, self.interval * (2 ** (self._failures[name] - 1)))
+
+        result = {
+            'status': 'up' if ok else 'down',
+            'error': error,
+            'latency_ms': round(latency * 1000, 1),
+            'checked_at': time.time(),
+            'consecutive_failures': self._failures[name]
+        }
+        with self._lock:
+            self._results[name] = result
+        self._next_run[name] = time.monotonic() + delay
+        return result
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有依赖的缓存结果及其时效（秒）"""
+        now = time.time()
+        with self._lock:
+            results = dict(self._results)
+        snapshot = {}
+        for name in self._checks:
+            result = results.get(name)
+            if result is None:
+                snapshot[name] = {'status': 'unknown', 'age_seconds': None}
+            else:
+                snapshot[name] = dict(result, age_seconds=round(now - result['checked_at'], 1))
+        return snapshot
+
+    def is_ready(self) -> bool:
+        """所有依赖都已探测且可用"""
+        return all(entry['status'] == 'up' for entry in self.snapshot().values())
+
+
+_probe_client = None
+# 探测使用独立的无重试session：失败应立即记录，由探测器自己退避
+_probe_session = requests.Session()
+
+
+def _get_probe_client():
+    """探测器复用同一个 SupabaseClient 的配置"""
+    global _probe_client
+    if _probe_client is None:
+        from services.supabase_client import SupabaseClient
+        _probe_client = SupabaseClient()
+    return _probe_client
+
+
+def _check_supabase(timeout: float) -> Tuple[bool, Optional[str]]:
+    """Supabase检查：只取0行、只选主键列，不返回任何用户数据"""
+    supabase = _get_probe_client()
+    response = _probe_session.get(
+        f"{supabase.url}/rest/v1/users",
+        headers=supabase.headers,
+        params={'select': 'user_id', 'limit': 0},
+        timeout=timeout
+    )
+    if response.status_code == 200:
+        return True, None
+    return False, f"HTTP {response.status_code}"
+
+
+def _check_llm_host(host: str, timeout: float, scheme: str = 'https') -> Tuple[bool, Optional[str]]:
+    """LLM主机检查：只建立（TLS）连接，不发送任何推理请求"""
+    hostname, _, port = host.partition(':')
+    port = int(port) if port else (443 if scheme == 'https' else 80)
+    with socket.create_connection((hostname, port), timeout=timeout) as sock:
+        if scheme != 'https':
+            return True, None
+        context = ssl.create_default_context()
+        with context.wrap_socket(sock, server_hostname=hostname):
+            return True, None
+
+
+def _check_llm_hosts(hosts, timeout: float) -> Tuple[bool, Optional[str]]:
+    """任意一个LLM后端主机可连接即视为可用（路由器会故障转移到可用的后端）"""
+    errors = []
+    for scheme, host in hosts:
+        try:
+            return _check_llm_host(host, timeout, scheme)
+        except OSError as e:
+            errors.append(f"{host}: {e}")
+    return False, '; '.join(errors)
+
+
+def create_default_prober(config) -> DependencyProber:
+    """根据应用配置创建探测器并注册 Supabase 和 LLM 主机检查"""
+    from services.claude_service import llm_router
+
+    prober = DependencyProber(
+        interval=config.get('HEALTH_PROBE_INTERVAL', 30),
+        max_backoff=config.get('HEALTH_PROBE_MAX_BACKOFF', 300),
+        timeout=config.get('HEALTH_PROBE_TIMEOUT', 3)
+    )
+    prober.register('supabase', lambda: _check_supabase(prober.timeout))
+    llm_hosts = list(dict.fromkeys((backend.scheme, backend.host) for backend in llm_router.backends))
+    prober.register('llm', lambda: _check_llm_hosts(llm_hosts, prober.timeout))
+    return prober
@@ -0,0 +1,186 @@
+# backend/services/model_router.py
+"""
+LLM多后端路由
+每个后端是一组 (主机, 模型, 权重, 最大并发, 档位)，各自有熔断器和滑动窗口统计（延迟、错误率）。
+
+- 档位 fast：便宜、快速的模型，用于简短的苏格拉底式对话轮次
+- 档位 strong：能力强的模型，用于完成作文和较长的对话
+- 档位 any：两种请求都可以使用
+
+选择顺序：先在请求的档位内按 权重 ×（1 − 错误率）/（1 + p95首字节秒数）加权随机排序，
+再把其他档位的后端作为故障转移的备选。熔断器打开或达到并发上限的后端会被跳过。
+
+配置（环境变量）：
+- LLM_BACKENDS: JSON列表，例如
+  [{"name": "haiku", "host": "api.gptgod.online", "model": "claude-3-5-haiku-20241022",
+    "tier": "fast", "weight": 1, "max_concurrency": 32},
+   {"name": "sonnet", "host": "api.gptgod.online", "model": "claude-3-7-sonnet-20250219",
+    "tier": "strong", "weight": 1, "max_concurrency": 16}]
+  weight 必须大于0，max_concurrency 至少为1（否则启动时报错）；
+  host 可以带 http:// 或 https:// 前缀和端口；可选 api_key_env 指定读取密钥的环境变量；
+  可选 prompt_cache 为 true 时在系统提示上附带提示缓存标记（默认取 LLM_PROMPT_CACHE_HINTS）
+- 未设置时使用 CLAUDE_API_HOST + 默认模型作为唯一后端；设置 LLM_FAST_MODEL 时在同一主机上增加 fast 后端
+"""
+import os
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+from utils.json_utils import loads
+from utils.resilience import CircuitBreaker, RollingStats, STATE_OPEN
+
+TIER_FAST = 'fast'
+TIER_STRONG = 'strong'
+TIER_ANY = 'any'
+
+
+class LLMBackend:
+    """一个LLM后端（主机 + 模型）"""
+
+    def __init__(self, name: str, host: str, model: str, tier: str = TIER_ANY, weight: float = 1.0,
+                 max_concurrency: int = 64, scheme: str = 'https', api_key: Optional[str] = None,
+                 prompt_cache: bool = False):
+        if tier not in (TIER_FAST, TIER_STRONG, TIER_ANY):
+            raise ValueError(f"未知的模型档位: {tier}")
+        if not weight > 0:
+            raise ValueError(f"LLM后端 {name} 的权重必须大于0: {weight}")
+        if max_concurrency < 1:
+            raise ValueError(f"LLM后端 {name} 的最大并发必须至少为1: {max_concurrency}")
+        if '://' in host:
+            scheme, host = host.split('://', 1)
+        self.name = name
+        self.host = host.rstrip('/')
+        self.scheme = scheme
+        self.model = model
+        self.tier = tier
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.api_key = api_key
+        self.prompt_cache = prompt_cache
+        self.breaker = CircuitBreaker(
+            f'llm:{name}',
+            failure_threshold=int(os.environ.get('LLM_BREAKER_THRESHOLD', 5)),
+            recovery_timeout=float(os.environ.get('LLM_BREAKER_RECOVERY', 30))
+        )
+        self.stats = RollingStats()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def serves(self, tier: str) -> bool:
+        return self.tier == TIER_ANY or self.tier == tier
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def score(self) -> float:
+        """加权随机排序使用的有效权重：错误多、首字节慢的后端被选中的概率更低"""
+        p95 = self.stats.ttfb_percentile(0.95, min_samples=5) or 0.0
+        return self.weight * max(0.05, 1 - self.stats.error_rate()) / (1 + p95)
+
+    def try_acquire(self) -> bool:
+        """占用一个并发名额；并发已满或熔断器拒绝时返回False，成功后必须调用 release"""
+        with self._lock:
+            if self._in_flight >= self.max_concurrency:
+                return False
+            self._in_flight += 1
+        if not self.breaker.allow():
+            self.release()
+            return False
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(
+            self.stats.snapshot(),
+            host=self.host,
+            model=self.model,
+            tier=self.tier,
+            weight=self.weight,
+            in_flight=self._in_flight,
+            max_concurrency=self.max_concurrency,
+            prompt_cache=self.prompt_cache,
+            breaker=self.breaker.get_stats()
+        )
+
+
+def _weighted_order(backends: List[LLMBackend]) -> List[LLMBackend]:
+    """按有效权重做不放回的加权随机排序；有效权重全部不为正数时退化为均匀随机排序"""
+    remaining = list(backends)
+    ordered = []
+    while remaining:
+        scores = [backend.score() for backend in remaining]
+        if not sum(scores) > 0:
+            random.shuffle(remaining)
+            ordered.extend(remaining)
+            break
+        chosen = random.choices(range(len(remaining)), weights=scores)[0]
+        ordered.append(remaining.pop(chosen))
+    return ordered
+
+
+class ModelRouter:
+    """按档位选择LLM后端并提供故障转移顺序"""
+
+    def __init__(self, backends: List[LLMBackend]):
+        if not backends:
+            raise ValueError("至少需要配置一个LLM后端")
+        self.backends = backends
+
+    def primary_model(self, tier: str) -> str:
+        """档位内权重最高的后端的模型（用于缓存键等需要稳定模型名的场景）"""
+        candidates = [backend for backend in self.backends if backend.serves(tier)] or self.backends
+        return max(candidates, key=lambda backend: backend.weight).model
+
+    def candidates(self, tier: str, model: Optional[str] = None) -> List[LLMBackend]:
+        """
+        返回按优先级排列的后端：请求档位内的可用后端在前，其他档位作为备选，熔断器打开的排在最后
+        指定 model 时只返回使用该模型的后端
+        """
+        backends = self.backends
+        if model is not None:
+            backends = [backend for backend in backends if backend.model == model]
+        preferred = [backend for backend in backends if backend.serves(tier)]
+        fallback = [backend for backend in backends if not backend.serves(tier)]
+        ordered = _weighted_order(preferred) + _weighted_order(fallback)
+        # 打开状态的熔断器会拒绝调用，放到最后以便恢复时间到达后仍可试探
+        return [b for b in ordered if b.breaker.state != STATE_OPEN] + \
+               [b for b in ordered if b.breaker.state == STATE_OPEN]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {backend.name: backend.get_stats() for backend in self.backends}
+
+
+def create_router_from_env(default_host: str, default_model: str, default_scheme: str) -> ModelRouter:
+    """从环境变量 LLM_BACKENDS / LLM_FAST_MODEL 创建路由器"""
+    spec = os.environ.get('LLM_BACKENDS')
+    prompt_cache = os.environ.get('LLM_PROMPT_CACHE_HINTS', 'false').lower() == 'true'
+    if spec:
+        backends = []
+        for index, item in enumerate(loads(spec)):
+            api_key_env = item.get('api_key_env')
+            backends.append(LLMBackend(
+                name=item.get('name') or f"backend{index}",
+                host=item.get('host', default_host),
+                model=item.get('model', default_model),
+                tier=item.get('tier', TIER_ANY),
+                weight=float(item.get('weight', 1)),
+                max_concurrency=int(item.get('max_concurrency', 64)),
+                scheme=item.get('scheme', default_scheme),
+                api_key=os.environ.get(api_key_env) if api_key_env else None,
+                prompt_cache=bool(item.get('prompt_cache', prompt_cache))
+            ))
+        return ModelRouter(backends)
+
+    max_concurrency = int(os.environ.get('LLM_MAX_CONCURRENCY', 64))
+    fast_model = os.environ.get('LLM_FAST_MODEL')
+    strong = LLMBackend('default', default_host, default_model, TIER_STRONG if fast_model else TIER_ANY,
+                        max_concurrency=max_concurrency, scheme=default_scheme, prompt_cache=prompt_cache)
+    if not fast_model:
+        return ModelRouter([strong])
+    fast = LLMBackend('fast', default_host, fast_model, TIER_FAST,
+                      max_concurrency=max_concurrency, scheme=default_scheme, prompt_cache=prompt_cache)
+    return ModelRouter([fast, strong])
@@ -0,0 +1,89 @@
+# backend/services/prompt_builder.py
+"""
+LLM请求体组装
+- 聊天的系统提示按 (提示词, 是否带缓存提示) 序列化一次后复用，不再每次调用重新编码约1KB的提示词；
+  作文请求的系统提示直接放在历史开头，随历史一起序列化
+- 对话历史整体序列化一次，按字节拼接到系统提示之后，不复制消息列表
+- 同一次调用的故障转移和对冲请求复用已序列化的 messages，只替换模型名和温度
+- 可选的提示缓存标记（cache_control: ephemeral），由支持的上游（如Anthropic兼容代理）缓存系统提示前缀
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from utils.json_utils import dumps_bytes
+
+# 系统提示片段的缓存上限（正常情况下只有聊天提示词，带/不带缓存标记各一个）
+_MAX_SYSTEM_FRAGMENTS = 32
+_system_fragments: Dict[Tuple[str, bool], bytes] = {}
+
+
+def system_fragment(prompt: str, cache_hint: bool = False) -> bytes:
+    """返回系统提示消息序列化后的字节串；cache_hint 为True时以内容块形式附带缓存标记"""
+    key = (prompt, cache_hint)
+    fragment = _system_fragments.get(key)
+    if fragment is None:
+        if cache_hint:
+            content = [{"type": "text", "text": prompt, "cache_control": {"type": "ephemeral"}}]
+        else:
+            content = prompt
+        fragment = dumps_bytes({"role": "system", "content": content})
+        if len(_system_fragments) < _MAX_SYSTEM_FRAGMENTS:
+            _system_fragments[key] = fragment
+    return fragment
+
+
+def _array_items(messages: Sequence[dict]) -> memoryview:
+    """序列化消息列表并去掉两端的方括号（memoryview，拼接前不复制）"""
+    return memoryview(dumps_bytes(messages))[1:-1]
+
+
+class PromptPayload:
+    """
+    一次LLM调用的提示：系统提示 + 对话历史 + 本轮新增的消息
+    history 和 new_messages 不会被复制或修改
+    """
+    __slots__ = ('system_prompt', 'history', 'new_messages', '_message_parts')
+
+    def __init__(self, history: Sequence[dict], system_prompt: Optional[str] = None,
+                 new_messages: Sequence[dict] = ()):
+        self.system_prompt = system_prompt
+        self.history = history
+        self.new_messages = new_messages
+        self._message_parts: Dict[bool, List[Any]] = {}
+
+    @property
+    def message_count(self) -> int:
+        return (1 if self.system_prompt is not None else 0) + len(self.history) + len(self.new_messages)
+
+    def prompt_chars(self) -> int:
+        """历史和新消息的总字数（不含系统提示）"""
+        return sum(len(str(msg.get("content") or "")) for messages in (self.history, self.new_messages)
+                   for msg in messages)
+
+    def _parts(self, cache_hint: bool) -> List[Any]:
+        """messages 数组的各段字节（按 cache_hint 分别缓存），由 body 一次性拼接"""
+        parts = self._message_parts.get(cache_hint)
+        if parts is None:
+            parts = [b'[']
+            if self.system_prompt is not None:
+                parts.append(system_fragment(self.system_prompt, cache_hint))
+            for messages in (self.history, self.new_messages):
+                if messages:
+                    if len(parts) > 1:
+                        parts.append(b',')
+                    parts.append(_array_items(messages))
+            parts.append(b']')
+            self._message_parts[cache_hint] = parts
+        return parts
+
+    def messages_json(self, cache_hint: bool = False) -> bytes:
+        """序列化后的 messages 数组"""
+        return b''.join(self._parts(cache_hint))
+
+    def body(self, model: str, temperature: float, cache_hint: bool = False) -> bytes:
+        """完整的 /v1/chat/completions 请求体"""
+        return b''.join((
+            b'{"temperature":', dumps_bytes(temperature),
+            b',"model":', dumps_bytes(model),
+            b',"stream":false,"messages":', *self._parts(cache_hint),
+            b'}'
+        ))
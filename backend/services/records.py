@@ -0,0 +1,178 @@
+# backend/services/records.py
+"""
+轻量级数据记录类型
+将PostgREST返回的行字典解码为带 __slots__ 的数据类，供服务层和缓存内部使用。
+只有在生成API响应时才通过 to_dict() 序列化回字典。
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Type, TypeVar
+
+T = TypeVar('T')
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """将PostgREST的ISO时间字符串解析为不带时区的UTC时间"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None)
+
+
+@dataclass(slots=True)
+class User:
+    """用户记录（对应 users 表）"""
+    user_id: str
+    username: str = ''
+    email: str = ''
+    password_hash: str = ''
+    credits: int = 0
+    is_active: bool = True
+    registration_ip: Optional[str] = None
+    created_at: Optional[str] = None
+    last_login: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> 'User':
+        """从PostgREST行字典解码"""
+        get = row.get
+        is_active = get('is_active')
+        return cls(
+            row['user_id'],
+            get('username') or '',
+            get('email') or '',
+            get('password_hash') or '',
+            get('credits') or 0,
+            True if is_active is None else is_active,
+            get('registration_ip'),
+            get('created_at'),
+            get('last_login'),
+        )
+
+    @property
+    def is_admin(self) -> bool:
+        return self.username == 'admin'
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为API响应字典（不包含密码哈希）"""
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'email': self.email,
+            'credits': self.credits,
+            'is_active': self.is_active,
+            'registration_ip': self.registration_ip,
+            'created_at': self.created_at,
+            'last_login': self.last_login
+        }
+
+
+@dataclass(slots=True)
+class RedemptionCode:
+    """兑换码记录（对应 redemption_codes 表）"""
+    code: str
+    credits_value: int = 0
+    is_used: bool = False
+    code_id: Optional[str] = None
+    used_by_user_id: Optional[str] = None
+    used_at: Optional[str] = None
+    expires_at: Optional[str] = None
+    created_by_admin_id: Optional[str] = None
+    created_at: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> 'RedemptionCode':
+        """从PostgREST行字典解码"""
+        get = row.get
+        return cls(
+            row['code'],
+            get('credits_value') or 0,
+            bool(get('is_used')),
+            get('code_id'),
+            get('used_by_user_id'),
+            get('used_at'),
+            get('expires_at'),
+            get('created_by_admin_id'),
+            get('created_at'),
+        )
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        """检查是否过期（expires_at 为空表示永不过期）"""
+        expires_at = _parse_timestamp(self.expires_at)
+        if expires_at is None:
+            return False
+        return (now or datetime.utcnow()) > expires_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为API响应字典"""
+        return {
+            'code_id': self.code_id,
+            'code': self.code,
+            'credits_value': self.credits_value,
+            'is_used': self.is_used,
+            'used_by_user_id': self.used_by_user_id,
+            'used_at': self.used_at,
+            'expires_at': self.expires_at,
+            'created_by_admin_id': self.created_by_admin_id,
+            'created_at': self.created_at
+        }
+
+
+@dataclass(slots=True)
+class UsageLog:
+    """使用记录（对应 usage_logs 表）"""
+    user_id: str
+    action_type: str
+    credits_consumed: int
+    timestamp: Optional[str] = None
+    request_details: Optional[str] = None
+    log_id: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Dict[str, Any]) -> 'UsageLog':
+        """从PostgREST行字典解码"""
+        get = row.get
+        return cls(
+            row['user_id'],
+            get('action_type') or '',
+            get('credits_consumed') or 0,
+            get('timestamp'),
+            get('request_details'),
+            get('log_id'),
+        )
+
+    def to_row(self) -> Dict[str, Any]:
+        """序列化为插入 usage_logs 的请求体（省略由数据库生成的字段）"""
+        row = {
+            'user_id': self.user_id,
+            'action_type': self.action_type,
+            'credits_consumed': self.credits_consumed,
+            'timestamp': self.timestamp or datetime.utcnow().isoformat()
+        }
+        if self.request_details is not None:
+            row['request_details'] = self.request_details
+        return row
+
+    def to_dict(self) -> Dict[str, Any]:
+        """序列化为API响应字典"""
+        return {
+            'log_id': self.log_id,
+            'user_id': self.user_id,
+            'action_type': self.action_type,
+            'credits_consumed': self.credits_consumed,
+            'timestamp': self.timestamp,
+            'request_details': self.request_details
+        }
+
+
+def decode_rows(record_type: Type[T], rows: Iterable[Dict[str, Any]]) -> List[T]:
+    """批量解码PostgREST返回的行"""
+    from_row = record_type.from_row
+    return [from_row(row) for row in rows]
+
+
+def decode_first(record_type: Type[T], rows: Optional[List[Dict[str, Any]]]) -> Optional[T]:
+    """解码查询结果的第一行，没有结果时返回None"""
+    if not rows:
+        return None
+    return record_type.from_row(rows[0])
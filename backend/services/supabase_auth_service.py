@@ -1,10 +1,22 @@
 import bcrypt
+import os
 import uuid
 from datetime import datetime, timedelta
 from flask_jwt_extended import create_access_token
 from services.supabase_client import SupabaseClient
+from services.records import User, UsageLog, decode_first
+from utils.cache_utils import MemoryCache, cache_user_data, invalidate_user_cache
+from utils.metrics import timed, BCRYPT_LATENCY, CREDITS_CONSUMED
+from utils.tracing import tracer
+from utils.concurrency import run_blocking
+from utils.deadline import deadline_scope
 from utils.validators import validate_username, validate_email, validate_password
 
+# 扣费接口使用的用户积分缓存（每个进程独立，秒）：预扣/退还积分后直接更新，
+# 并作为比较并交换的预期值，省去扣费前的一次读取；不一致时回退到读取数据库
+CREDIT_CACHE_TTL = int(os.environ.get('CREDIT_CACHE_TTL', 60))
+_billing_cache = MemoryCache('billing')
+
 def register_user_supabase(username, email, password, ip_address=None):
     """使用Supabase注册用户"""
     supabase = SupabaseClient()
@@ -31,7 +43,8 @@ def register_user_supabase(username, email, password, ip_address=None):
             return False, "邮箱已被注册", None
         
         # 创建新用户
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        with tracer.span('bcrypt.hash'), timed(BCRYPT_LATENCY, operation='hash'):
+            password_hash = run_blocking(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
         
         user_data = {
             'user_id': str(uuid.uuid4()),
@@ -50,7 +63,7 @@ def register_user_supabase(username, email, password, ip_address=None):
             if ip_address:
                 record_registration_ip(ip_address)
             
-            return True, "注册成功", result[0] if result else None
+            return True, "注册成功", decode_first(User, result)
         else:
             return False, "注册失败", None
             
@@ -70,24 +83,26 @@ def login_user_supabase(username, password, ip_address=None):
             if not success or not users:
                 return False, "用户名或密码错误", None
         
-        user = users[0]
+        user = User.from_row(users[0])
         
         # 验证密码
-        if not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+        with tracer.span('bcrypt.check'), timed(BCRYPT_LATENCY, operation='check'):
+            password_ok = run_blocking(bcrypt.checkpw, password.encode('utf-8'), user.password_hash.encode('utf-8'))
+        if not password_ok:
             # 记录登录失败
-            record_login_attempt(user['user_id'], ip_address, False, "密码错误")
+            record_login_attempt(user.user_id, ip_address, False, "密码错误")
             return False, "用户名或密码错误", None
         
         # 更新最后登录时间
-        update_data = {'last_login': datetime.utcnow().isoformat()}
-        supabase.update_user(user['user_id'], update_data)
+        user.last_login = datetime.utcnow().isoformat()
+        supabase.update_user(user.user_id, {'last_login': user.last_login})
         
         # 记录登录成功
-        record_login_attempt(user['user_id'], ip_address, True)
+        record_login_attempt(user.user_id, ip_address, True)
         
         # 生成JWT token
         access_token = create_access_token(
-            identity=user['user_id'],
+            identity=user.user_id,
             expires_delta=timedelta(days=7)
         )
         
@@ -115,11 +130,12 @@ def get_current_user_supabase():
         if current_user_id:
             success, users = supabase.get_user_by_id(current_user_id)
             if success and users:
-                return users[0]  # 返回用户字典
+                return User.from_row(users[0])
         return None
     except Exception as e:
         return None
 
+@cache_user_data(ttl=600)  # 缓存10分钟
 def get_user_profile_supabase(user_id):
     """获取Supabase用户资料"""
     supabase = SupabaseClient()
@@ -127,73 +143,161 @@ def get_user_profile_supabase(user_id):
     try:
         success, users = supabase.get_user_by_id(user_id)
         if success and users:
-            return True, "获取成功", users[0]
+            return True, "获取成功", User.from_row(users[0])
         else:
             return False, "用户不存在", None
     except Exception as e:
         return False, "获取用户资料失败", None
+def get_user_for_billing(user_id, required_credits):
+    """
+    扣费接口的积分预检查：使用缓存的用户记录，避免每个请求都查询数据库
+    缓存的积分低于 required_credits 时重新读取一次（其他worker充值后本进程的缓存可能已过期）；
+    缓存偏高时由 reserve_credits_supabase 在数据库中做最终校验
+    返回: (success: bool, message: str, user: User or None)
+    """
+    user = _billing_cache.get(user_id)
+    if user is not None and user.credits >= required_credits:
+        return True, "获取成功", user
+    try:
+        success, users = SupabaseClient().get_user_by_id(user_id)
+    except Exception:
+        return False, "获取用户资料失败", None
+    if not success:
+        return False, "获取用户资料失败", None
+    if not users:
+        return False, "用户不存在", None
+    user = User.from_row(users[0])
+    _billing_cache.set(user_id, user, CREDIT_CACHE_TTL)
+    return True, "获取成功", user
+
+def _remember_credits(user_id, credits):
+    """积分修改成功后更新缓存的用户记录"""
+    user = _billing_cache.get(user_id)
+    if user is not None:
+        user.credits = credits
+
+def _cached_credits(user_id):
+    user = _billing_cache.get(user_id)
+    return user.credits if user is not None else None
+
+def _compare_and_set_credits(supabase, user_id, credits_change, max_attempts=5, expected_credits=None):
+    """
+    以乐观并发方式修改积分：只有数据库中的积分仍等于读取到的值时才写入，
+    否则重新读取后重试，避免多个请求/worker同时扣费时互相覆盖
+    expected_credits（如缓存的积分）不为None时第一次直接以它为预期值写入，不一致时再读取
+    返回: (success: bool, message: str, new_credits: int or None)
+    """
+    current_credits = expected_credits
+    for _ in range(max_attempts):
+        if current_credits is None or (credits_change < 0 and current_credits < abs(credits_change)):
+            success, users = supabase.get_user_by_id(user_id)
+            if not success or not users:
+                return False, "用户不存在", None
+
+            current_credits = User.from_row(users[0]).credits
+            if credits_change < 0 and current_credits < abs(credits_change):
+                return False, "积分不足", None
+
+        new_credits = current_credits + credits_change
+        success, rows = supabase.compare_and_set_user_credits(user_id, current_credits, new_credits)
+        if not success:
+            # 请求失败（熔断、超时等）时不重试：写入可能已生效，重试会重复修改积分
+            return False, "积分更新失败", None
+        if rows:
+            return True, "积分更新成功", new_credits
+        current_credits = None
+
+    return False, "积分更新冲突，请重试", None
+
+def reserve_credits_supabase(user_id, amount):
+    """
+    预扣积分（LLM请求被准入时调用），之后必须调用 settle 或 release
+    返回: (success: bool, message: str, new_credits: int or None)
+    """
+    from flask import current_app
+
+    try:
+        success, message, new_credits = _compare_and_set_credits(
+            SupabaseClient(), user_id, -amount, expected_credits=_cached_credits(user_id)
+        )
+        if success:
+            invalidate_user_cache(user_id)
+            _remember_credits(user_id, new_credits)
+        return success, message, new_credits
+    except Exception as e:
+        current_app.logger.error(f"预扣积分异常: user_id={user_id}, error={str(e)}")
+        return False, f"积分更新失败: {str(e)}", None
+
+def settle_credits_supabase(user_id, amount, action_type):
+    """
+    结算已预扣的积分：记录使用日志；日志写入失败时退还预扣的积分
+    返回: (success: bool, message: str, None)
+    """
+    from flask import current_app
+
+    try:
+        log = UsageLog(user_id, action_type, amount)
+        success, rows = SupabaseClient().create_usage_log(log.to_row())
+        if not success or not rows:
+            release_credits_supabase(user_id, amount)
+            current_app.logger.error(f"使用日志记录失败，已退还预扣积分: user_id={user_id}")
+            return False, "操作失败，积分未扣除", None
+
+        CREDITS_CONSUMED.labels(action_type=action_type).inc(amount)
+        current_app.logger.info(f"积分结算成功: user_id={user_id}, action={action_type}, credits={amount}")
+        return True, "积分结算成功", None
+    except Exception as e:
+        release_credits_supabase(user_id, amount)
+        current_app.logger.error(f"积分结算异常: user_id={user_id}, error={str(e)}")
+        return False, "操作失败，积分未扣除", None
+
+def release_credits_supabase(user_id, amount):
+    """
+    退还预扣的积分（LLM调用失败时调用）
+    补偿操作不受请求截止时间限制，否则超时的请求会丢失预扣的积分
+    返回: (success: bool, message: str, new_credits: int or None)
+    """
+    from flask import current_app
+
+    try:
+        with deadline_scope(None):
+            success, message, new_credits = _compare_and_set_credits(
+                SupabaseClient(), user_id, amount, expected_credits=_cached_credits(user_id)
+            )
+        if success:
+            invalidate_user_cache(user_id)
+            _remember_credits(user_id, new_credits)
+        else:
+            current_app.logger.error(f"退还预扣积分失败: user_id={user_id}, amount={amount}, {message}")
+        return success, message, new_credits
+    except Exception as e:
+        current_app.logger.error(f"退还预扣积分异常: user_id={user_id}, error={str(e)}")
+        return False, f"积分更新失败: {str(e)}", None
+
 def update_user_credits_supabase(user_id, credits_change, action_type="manual"):
     """
     更新Supabase用户积分 - 确保原子性操作
-    credits_change: 正数为增加，负数为减少
+    credits_change: 正数为增加，负数为减少（扣减时同时记录使用日志）
     返回: (success: bool, message: str, new_credits: int or None)
     """
-    from services.supabase_client import SupabaseClient
-    from datetime import datetime
     from flask import current_app
-    
-    supabase = SupabaseClient()
-    
+
+    if credits_change < 0:
+        success, message, new_credits = reserve_credits_supabase(user_id, abs(credits_change))
+        if not success:
+            return False, message, None
+        success, message, _ = settle_credits_supabase(user_id, abs(credits_change), action_type)
+        if not success:
+            return False, message, None
+        return True, "积分更新成功", new_credits
+
     try:
-        # 获取当前用户信息
-        success, users = supabase.get_user_by_id(user_id)
-        if not success or not users:
-            return False, "用户不存在", None
-        
-        user = users[0]
-        current_credits = user.get('credits', 0)
-        
-        # 检查积分是否足够
-        if credits_change < 0 and current_credits < abs(credits_change):
-            return False, "积分不足", None
-        
-        # 计算新积分
-        new_credits = current_credits + credits_change
-        
-        # 使用数据库事务确保原子性
-        client = supabase.get_client()
-        
-        # 先更新用户积分
-        user_update_result = client.table('users').update({
-            'credits': new_credits
-        }).eq('user_id', user_id).execute()
-        
-        if user_update_result.data:
-            # 积分更新成功，记录使用日志（如果是消耗积分）
-            if credits_change < 0:
-                log_data = {
-                    'user_id': user_id,
-                    'action_type': action_type,
-                    'credits_consumed': abs(credits_change),
-                    'timestamp': datetime.utcnow().isoformat()
-                }
-                
-                log_result = client.table('usage_logs').insert(log_data).execute()
-                
-                if not log_result.data:
-                    # 如果日志记录失败，回滚积分更新
-                    client.table('users').update({
-                        'credits': current_credits
-                    }).eq('user_id', user_id).execute()
-                    
-                    current_app.logger.error(f"使用日志记录失败，已回滚积分更新: user_id={user_id}")
-                    return False, "操作失败，积分未扣除", None
-            
+        success, message, new_credits = _compare_and_set_credits(SupabaseClient(), user_id, credits_change)
+        if success:
+            invalidate_user_cache(user_id)
+            _remember_credits(user_id, new_credits)
             current_app.logger.info(f"积分更新成功: user_id={user_id}, change={credits_change}, new_credits={new_credits}")
-            return True, "积分更新成功", new_credits
-        else:
-            return False, "积分更新失败", None
-        
+        return success, message, new_credits
     except Exception as e:
         current_app.logger.error(f"积分更新异常: user_id={user_id}, error={str(e)}")
         return False, f"积分更新失败: {str(e)}", None
\ No newline at end of file
@@ -1,14 +1,42 @@
 import os
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import json
+import threading
 import time
 from supabase import create_client, Client
+from utils.json_utils import dumps_bytes, loads
+from utils.metrics import SUPABASE_LATENCY, UPSTREAM_RETRIES
+from utils.tracing import tracer
+from utils.resilience import CircuitBreaker, IDEMPOTENT_METHODS, backoff_delays
+from utils.deadline import MIN_UPSTREAM_TIMEOUT, remaining_budget, upstream_timeout
+
+# 超时（秒）；实际值不超过当前请求截止时间的剩余预算
+SUPABASE_TIMEOUT = float(os.environ.get('SUPABASE_TIMEOUT', 5))
+SUPABASE_CONNECT_TIMEOUT = float(os.environ.get('SUPABASE_CONNECT_TIMEOUT', 2))
+# 幂等方法的最大重试次数；POST/PATCH 不重试
+SUPABASE_MAX_RETRIES = int(os.environ.get('SUPABASE_MAX_RETRIES', 2))
+RETRYABLE_STATUS = {429, 502, 503, 504}
+# 计入熔断失败的状态码（4xx 说明上游正常工作）
+UPSTREAM_FAILURE_STATUS = {500, 502, 503, 504}
+
+# 进程内共享的Supabase熔断器
+supabase_breaker = CircuitBreaker(
+    'supabase',
+    failure_threshold=int(os.environ.get('SUPABASE_BREAKER_THRESHOLD', 5)),
+    recovery_timeout=float(os.environ.get('SUPABASE_BREAKER_RECOVERY', 30))
+)
 
 class SupabaseClient:
+    # 每个进程共享一个session和supabase-py客户端：服务函数每次调用都会新建 SupabaseClient，
+    # 共享后并发请求（gthread/gevent）复用同一个连接池，不再每次重新建立TLS连接
+    _session: Optional[requests.Session] = None
+    _shared_client: Optional[Client] = None
+    _shared_pid: Optional[int] = None
+    _shared_lock = threading.Lock()
+
     def __init__(self):
         self.url = os.environ.get('SUPABASE_URL')
         self.anon_key = os.environ.get('SUPABASE_ANON_KEY')
@@ -24,70 +52,125 @@ class SupabaseClient:
             'Prefer': 'return=representation'
         }
 
-        # 创建优化的session
-        self.session = self._create_session()
-        
-        # 创建Supabase客户端实例
-        self._client = None
-
-    def _create_session(self) -> requests.Session:
+        # 进程内共享的session
+        self.session = self._shared_session()
+
+    @classmethod
+    def _shared_session(cls) -> requests.Session:
+        """获取当前进程的共享session（gunicorn fork后按进程ID重新创建）"""
+        if cls._session is None or cls._shared_pid != os.getpid():
+            with cls._shared_lock:
+                if cls._session is None or cls._shared_pid != os.getpid():
+                    cls._session = cls._create_session()
+                    cls._shared_client = None
+                    cls._shared_pid = os.getpid()
+        return cls._session
+
+    @staticmethod
+    def _create_session() -> requests.Session:
         """创建优化的requests session"""
         session = requests.Session()
 
-        # 配置重试策略
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "PUT", "DELETE", "OPTIONS", "TRACE", "POST"]
-        )
-
-        # 配置HTTP适配器
+        # 配置HTTP适配器（连接池大小应不小于每个worker的并发请求数）
+        # 重试由 _make_request 按方法和剩余时间预算处理，适配器本身不重试
         adapter = HTTPAdapter(
-            max_retries=retry_strategy,
+            max_retries=0,
             pool_connections=10,
-            pool_maxsize=10,
+            pool_maxsize=int(os.environ.get('SUPABASE_POOL_MAXSIZE', 100)),
             pool_block=False
         )
 
         session.mount("http://", adapter)
         session.mount("https://", adapter)
 
-        # 设置默认超时
-        session.timeout = 30
-
         return session
 
     def _make_request(self, method: str, endpoint: str, data: Dict = None, params: Dict = None) -> Tuple[bool, Dict]:
-        """发送HTTP请求到Supabase"""
+        """
+        发送HTTP请求到Supabase
+        熔断器打开时直接失败；只对幂等方法重试（带随机抖动）
+        超时不超过当前请求截止时间的剩余预算，预算用完后不再发起请求
+        """
         url = f"{self.url}/rest/v1/{endpoint}"
         start_time = time.time()
-
-        try:
-            response = self.session.request(
-                method=method,
-                url=url,
-                headers=self.headers,
-                json=data,
-                params=params,
-                timeout=30
-            )
+        table = endpoint.split('?', 1)[0]
+        body = dumps_bytes(data) if data is not None else None
+
+        with tracer.span('supabase.request', endpoint=table, method=method) as span:
+            if upstream_timeout(SUPABASE_TIMEOUT) < MIN_UPSTREAM_TIMEOUT:
+                SUPABASE_LATENCY.labels(endpoint=table, method=method, outcome='deadline_exceeded').observe(0)
+                if span is not None:
+                    span.error = 'deadline exceeded'
+                return False, {"error": "请求处理超时", "deadline_exceeded": True}
+
+            if not supabase_breaker.allow():
+                SUPABASE_LATENCY.labels(endpoint=table, method=method, outcome='circuit_open').observe(0)
+                if span is not None:
+                    span.error = 'circuit open'
+                return False, {"error": "Supabase暂时不可用，请稍后再试", "circuit_open": True}
+
+            delays = backoff_delays(SUPABASE_MAX_RETRIES if method in IDEMPOTENT_METHODS else 0)
+            while True:
+                response, error = None, None
+                read_timeout = upstream_timeout(SUPABASE_TIMEOUT)
+                try:
+                    response = self.session.request(
+                        method=method,
+                        url=url,
+                        headers=self.headers,
+                        data=body,
+                        params=params,
+                        timeout=(min(SUPABASE_CONNECT_TIMEOUT, read_timeout), read_timeout)
+                    )
+                except Exception as e:
+                    error = e
+
+                retryable = (
+                    isinstance(error, requests.RequestException)
+                    or (response is not None and response.status_code in RETRYABLE_STATUS)
+                )
+                delay = next(delays, None) if retryable else None
+                remaining = remaining_budget()
+                if delay is None or (remaining is not None and remaining < delay + SUPABASE_CONNECT_TIMEOUT):
+                    break
+                UPSTREAM_RETRIES.labels(upstream='supabase').inc()
+                time.sleep(delay)
 
             duration = time.time() - start_time
+            if error is not None:
+                supabase_breaker.record_failure()
+                SUPABASE_LATENCY.labels(
+                    endpoint=table, method=method, outcome='exception'
+                ).observe(duration)
+                if span is not None:
+                    span.error = str(error)
+                print(f"Supabase请求失败: {endpoint} 耗时 {duration:.2f}s, 错误: {str(error)}")
+                return False, {"error": str(error)}
+
+            if response.status_code in UPSTREAM_FAILURE_STATUS:
+                supabase_breaker.record_failure()
+            else:
+                supabase_breaker.record_success()
+
+            SUPABASE_LATENCY.labels(
+                endpoint=table, method=method,
+                outcome='ok' if response.status_code in [200, 201] else 'error'
+            ).observe(duration)
+
+            if span is not None:
+                span.set_attribute('status_code', response.status_code)
 
             # 记录慢查询
             if duration > 2.0:
                 print(f"慢速Supabase查询: {endpoint} 耗时 {duration:.2f}s")
 
             if response.status_code in [200, 201]:
-                return True, response.json()
+                try:
+                    return True, loads(response.content)
+                except ValueError as e:
+                    return False, {"error": f"响应解析失败: {e}"}
             else:
                 return False, {"error": response.text, "status_code": response.status_code}
-
-        except Exception as e:
-            duration = time.time() - start_time
-            print(f"Supabase请求失败: {endpoint} 耗时 {duration:.2f}s, 错误: {str(e)}")
-            return False, {"error": str(e)}
     
     # 用户相关操作
     def create_user(self, user_data: Dict) -> Tuple[bool, Dict]:
@@ -105,6 +188,11 @@ class SupabaseClient:
         params = {'user_id': f'eq.{user_id}'}
         return self._make_request('PATCH', 'users', update_data, params)
     
+    def compare_and_set_user_credits(self, user_id: str, expected_credits: int, new_credits: int) -> Tuple[bool, Dict]:
+        """只有数据库中的积分仍等于 expected_credits 时才写入；未命中时返回空列表"""
+        params = {'user_id': f'eq.{user_id}', 'credits': f'eq.{expected_credits}'}
+        return self._make_request('PATCH', 'users', {'credits': new_credits}, params)
+    
     # 兑换码相关操作
     def create_redemption_code(self, code_data: Dict) -> Tuple[bool, Dict]:
         return self._make_request('POST', 'redemption_codes', code_data)
@@ -130,7 +218,11 @@ class SupabaseClient:
         return self._make_request('GET', 'users', params=params)
     
     def get_client(self) -> Client:
-        """获取Supabase客户端实例"""
-        if self._client is None:
-            self._client = create_client(self.url, self.service_key)
-        return self._client
\ No newline at end of file
+        """获取Supabase客户端实例（进程内共享）"""
+        cls = type(self)
+        if cls._shared_client is None or cls._shared_pid != os.getpid():
+            self._shared_session()
+            with cls._shared_lock:
+                if cls._shared_client is None:
+                    cls._shared_client = create_client(self.url, self.service_key)
+        return cls._shared_client
\ No newline at end of file
@@ -4,19 +4,88 @@ Supabase兑换码服务
 处理兑换码的生成、验证和兑换功能 - 完全基于Supabase
 """
 
+import os
 import secrets
-import string
 from datetime import datetime, timedelta
 from flask import current_app
 from services.supabase_client import SupabaseClient
+from services.records import User, RedemptionCode, UsageLog, decode_first, decode_rows
+from services.supabase_auth_service import _compare_and_set_credits, _remember_credits
+from utils.bloom import RotatingBloomFilter
+from utils.cache_utils import invalidate_user_cache
+from utils.deadline import deadline_scope
+from utils.job_queue import Job, job_queue
+from utils.metrics import REDEMPTION_CODE_CHECKS
+from utils.validators import (
+    REDEMPTION_CODE_ALPHABET, REDEMPTION_CODE_LENGTH, normalize_redemption_code,
+    redemption_check_char, has_valid_redemption_checksum, validate_redemption_code
+)
+
+# 是否仍接受没有校验字符的旧兑换码（与新兑换码字符集、长度相同，无法区分）：
+# 默认false，校验字符不符的兑换码在本地直接拒绝；仍有未使用的旧兑换码时设为true，
+# 此时校验字符不符的兑换码照常查询数据库，直到旧兑换码全部使用或过期
+REDEMPTION_LEGACY_CODES = os.environ.get('REDEMPTION_LEGACY_CODES', 'false').lower() == 'true'
+
+# 最近查询过但不存在的兑换码（每个进程独立，布隆过滤器可能误判）：
+# 只用于对重复提交加严限流，命中时仍然查询数据库，不会据此拒绝兑换码
+failed_codes = RotatingBloomFilter(
+    capacity=int(os.environ.get('REDEMPTION_BLOOM_CAPACITY', 100000)),
+    error_rate=float(os.environ.get('REDEMPTION_BLOOM_ERROR_RATE', 1e-4)),
+    window=float(os.environ.get('REDEMPTION_BLOOM_WINDOW', 600))
+)
+
+# 过期兑换码清理任务的类型名
+EXPIRY_SWEEP_JOB_KIND = 'redemption_expiry_sweep'
+
+# PostgreSQL 列不存在的错误码：数据库尚未执行 migrations/001（expired_at 列）
+UNDEFINED_COLUMN_ERROR = '42703'
 
 def generate_redemption_code():
-    """生成随机兑换码"""
-    length = 16
-    characters = string.ascii_uppercase + string.digits
-    # 排除容易混淆的字符
-    characters = characters.replace('O', '').replace('0', '').replace('I', '').replace('L', '').replace('1', '')
-    return ''.join(secrets.choice(characters) for _ in range(length))
+    """生成随机兑换码：15位随机字符 + 1位校验字符"""
+    body = ''.join(secrets.choice(REDEMPTION_CODE_ALPHABET) for _ in range(REDEMPTION_CODE_LENGTH - 1))
+    return body + redemption_check_char(body)
+
+def check_redemption_code_format(code):
+    """
+    在查询数据库之前检查兑换码：归一化、格式、校验字符
+    返回: (success: bool, message: str, normalized_code: str or None)
+    """
+    normalized = normalize_redemption_code(code)
+    if not validate_redemption_code(normalized):
+        REDEMPTION_CODE_CHECKS.labels(result='invalid_format').inc()
+        return False, "兑换码格式不正确", None
+    if not REDEMPTION_LEGACY_CODES and not has_valid_redemption_checksum(normalized):
+        REDEMPTION_CODE_CHECKS.labels(result='bad_checksum').inc()
+        return False, "兑换码有误，请检查后重新输入", None
+    return True, "", normalized
+
+def recently_failed_code(code):
+    """
+    兑换码最近是否在本进程中查询不到（布隆过滤器，可能误判）
+    调用方据此对重复提交加严限流；不能据此判定兑换码不存在
+    """
+    if normalize_redemption_code(code) in failed_codes:
+        REDEMPTION_CODE_CHECKS.labels(result='recently_failed').inc()
+        return True
+    return False
+
+def _missing_column(result):
+    """PostgREST 错误响应是否为列不存在（未执行迁移）"""
+    return isinstance(result, dict) and UNDEFINED_COLUMN_ERROR in str(result.get('error', ''))
+
+def _find_redemption_code(supabase, code):
+    """按已归一化的兑换码查询；不存在时记入 failed_codes"""
+    success, redemption_codes = supabase._make_request('GET', 'redemption_codes', params={
+        'code': f'eq.{code}'
+    })
+    if success and not redemption_codes:
+        failed_codes.add(code)
+        REDEMPTION_CODE_CHECKS.labels(result='not_found').inc()
+    elif success:
+        REDEMPTION_CODE_CHECKS.labels(result='found').inc()
+    if not success or not redemption_codes:
+        return None
+    return RedemptionCode.from_row(redemption_codes[0])
 
 def create_redemption_code_supabase(credits_value, expires_days=None, admin_user_id=None):
     """
@@ -39,6 +108,9 @@ def create_redemption_code_supabase(credits_value, expires_days=None, admin_user
         max_attempts = 10
         for _ in range(max_attempts):
             code = generate_redemption_code()
+            # 跳过最近被猜测过的兑换码：布隆过滤器不能删除，新兑换码兑换时会被额外限流
+            if code in failed_codes:
+                continue
             # 检查兑换码是否已存在
             success, existing_codes = supabase._make_request('GET', 'redemption_codes', params={
                 'code': f'eq.{code}',
@@ -69,7 +141,7 @@ def create_redemption_code_supabase(credits_value, expires_days=None, admin_user
         success, result = supabase._make_request('POST', 'redemption_codes', data=code_data)
         
         if success:
-            return True, "兑换码创建成功", result[0] if result else code_data
+            return True, "兑换码创建成功", decode_first(RedemptionCode, result) or RedemptionCode.from_row(code_data)
         else:
             return False, f"创建兑换码失败: {result.get('message', '未知错误')}", None
         
@@ -85,42 +157,39 @@ def redeem_code_supabase(code, user_id):
     返回: (success: bool, message: str, credits_gained: int or None)
     """
     try:
+        valid, message, code = check_redemption_code_format(code)
+        if not valid:
+            return False, message, None
+
         supabase = SupabaseClient()
         
         # 查找兑换码
-        success, redemption_codes = supabase._make_request('GET', 'redemption_codes', params={
-            'code': f'eq.{code.upper()}'
-        })
-        
-        if not success or not redemption_codes:
+        redemption_code = _find_redemption_code(supabase, code)
+        if redemption_code is None:
             return False, "兑换码不存在", None
         
-        redemption_code = redemption_codes[0]
-        
         # 检查兑换码是否已被使用
-        if redemption_code.get('is_used'):
+        if redemption_code.is_used:
             return False, "兑换码已被使用", None
         
         # 检查兑换码是否已过期
-        if redemption_code.get('expires_at'):
-            expires_at = datetime.fromisoformat(redemption_code['expires_at'].replace('Z', '+00:00'))
-            if datetime.utcnow() > expires_at.replace(tzinfo=None):
-                return False, "兑换码已过期", None
+        if redemption_code.is_expired():
+            return False, "兑换码已过期", None
         
         # 查找用户
         success, users = supabase.get_user_by_id(user_id)
         if not success or not users:
             return False, "用户不存在", None
         
-        user = users[0]
-        credits_value = redemption_code['credits_value']
+        user = User.from_row(users[0])
+        credits_value = redemption_code.credits_value
         
         # 开始事务操作
         current_time = datetime.utcnow().isoformat()
         
-        # 1. 标记兑换码为已使用
-        update_code_success, _ = supabase._make_request('PATCH', f'redemption_codes', 
-            params={'code': f'eq.{code.upper()}'},
+        # 1. 标记兑换码为已使用（带 is_used=false 条件，并发兑换同一兑换码时只有一个成功）
+        update_code_success, updated_codes = supabase._make_request('PATCH', f'redemption_codes', 
+            params={'code': f'eq.{code}', 'is_used': 'eq.false'},
             data={
                 'is_used': True,
                 'used_by_user_id': user_id,
@@ -130,34 +199,37 @@ def redeem_code_supabase(code, user_id):
         
         if not update_code_success:
             return False, "兑换失败，请稍后重试", None
+        if not updated_codes:
+            return False, "兑换码已被使用", None
         
-        # 2. 更新用户积分
-        new_credits = user.get('credits', 0) + credits_value
-        update_user_success, _ = supabase.update_user(user_id, {
-            'credits': new_credits
-        })
+        # 2. 更新用户积分（与预扣/退还相同的比较并交换，不会覆盖并发的扣费）
+        update_user_success, _, new_credits = _compare_and_set_credits(
+            supabase, user_id, credits_value, expected_credits=user.credits
+        )
         
         if not update_user_success:
-            # 回滚兑换码状态
-            supabase._make_request('PATCH', f'redemption_codes', 
-                params={'code': f'eq.{code.upper()}'},
-                data={
-                    'is_used': False,
-                    'used_by_user_id': None,
-                    'used_at': None
-                }
-            )
+            # 回滚兑换码状态（补偿操作不受请求截止时间限制）
+            with deadline_scope(None):
+                supabase._make_request('PATCH', f'redemption_codes', 
+                    params={'code': f'eq.{code}', 'used_by_user_id': f'eq.{user_id}'},
+                    data={
+                        'is_used': False,
+                        'used_by_user_id': None,
+                        'used_at': None
+                    }
+                )
             return False, "积分更新失败", None
         
         # 3. 记录使用日志
-        log_data = {
-            'user_id': user_id,
-            'action_type': 'redeem_code',
-            'credits_consumed': -credits_value,  # 负数表示获得积分
-            'timestamp': current_time,
-            'request_details': f'兑换码: {code}'
-        }
-        supabase.create_usage_log(log_data)
+        log = UsageLog(
+            user_id, 'redeem_code',
+            -credits_value,  # 负数表示获得积分
+            timestamp=current_time,
+            request_details=f'兑换码: {code}'
+        )
+        supabase.create_usage_log(log.to_row())
+        invalidate_user_cache(user_id)
+        _remember_credits(user_id, new_credits)
         
         return True, f"兑换成功！获得{credits_value}积分", credits_value
         
@@ -186,7 +258,7 @@ def get_user_redemption_history_supabase(user_id):
         })
         
         if success:
-            return True, "获取成功", redeemed_codes
+            return True, "获取成功", decode_rows(RedemptionCode, redeemed_codes)
         else:
             return False, "获取兑换历史失败", None
         
@@ -200,36 +272,33 @@ def validate_redemption_code_supabase(code):
     返回: (success: bool, message: str, code_info: dict or None)
     """
     try:
+        valid, message, code = check_redemption_code_format(code)
+        if not valid:
+            return False, message, None
+
         supabase = SupabaseClient()
         
         # 查找兑换码
-        success, redemption_codes = supabase._make_request('GET', 'redemption_codes', params={
-            'code': f'eq.{code.upper()}'
-        })
-        
-        if not success or not redemption_codes:
+        redemption_code = _find_redemption_code(supabase, code)
+        if redemption_code is None:
             return False, "兑换码不存在", None
         
-        redemption_code = redemption_codes[0]
-        
         # 检查是否已被使用
-        if redemption_code.get('is_used'):
+        if redemption_code.is_used:
             return False, "兑换码已被使用", None
         
         # 检查是否已过期
-        if redemption_code.get('expires_at'):
-            expires_at = datetime.fromisoformat(redemption_code['expires_at'].replace('Z', '+00:00'))
-            if datetime.utcnow() > expires_at.replace(tzinfo=None):
-                return False, "兑换码已过期", None
+        if redemption_code.is_expired():
+            return False, "兑换码已过期", None
         
         # 返回兑换码信息
         code_info = {
-            'credits_value': redemption_code['credits_value'],
-            'expires_at': redemption_code.get('expires_at'),
+            'credits_value': redemption_code.credits_value,
+            'expires_at': redemption_code.expires_at,
             'is_valid': True
         }
         
-        return True, f"有效兑换码，价值{redemption_code['credits_value']}积分", code_info
+        return True, f"有效兑换码，价值{redemption_code.credits_value}积分", code_info
         
     except Exception as e:
         current_app.logger.error(f"验证兑换码失败: {e}")
@@ -257,14 +326,25 @@ def get_usage_statistics_supabase():
         })
         used_codes = used_codes_data[0]['count'] if used_codes_success and used_codes_data else 0
         
-        # 获取已过期的兑换码
+        # 获取已过期的兑换码：已由清理任务标记的 + 过期后尚未清理的（只扫描部分索引覆盖的少量行）
         current_time = datetime.utcnow().isoformat()
         expired_codes_success, expired_codes_data = supabase._make_request('GET', 'redemption_codes', params={
             'select': 'count',
-            'expires_at': f'lt.{current_time}',
-            'is_used': 'eq.false'
+            'is_used': 'eq.false',
+            'expired_at': 'not.is.null'
         })
         expired_codes = expired_codes_data[0]['count'] if expired_codes_success and expired_codes_data else 0
+        pending_params = {
+            'select': 'count',
+            'is_used': 'eq.false',
+            'expired_at': 'is.null',
+            'expires_at': f'lt.{current_time}'
+        }
+        if not expired_codes_success and _missing_column(expired_codes_data):
+            # 未执行 migrations/001：只按 expires_at 统计
+            del pending_params['expired_at']
+        pending_success, pending_data = supabase._make_request('GET', 'redemption_codes', params=pending_params)
+        expired_codes += pending_data[0]['count'] if pending_success and pending_data else 0
         
         # 获取已使用兑换码的积分总额
         credits_success, credits_data = supabase._make_request('GET', 'redemption_codes', params={
@@ -287,4 +367,65 @@ def get_usage_statistics_supabase():
         
     except Exception as e:
         current_app.logger.error(f"获取使用统计失败: {e}")
-        return False, "获取使用统计失败", None
\ No newline at end of file
+        return False, "获取使用统计失败", None
+
+def sweep_expired_codes(batch_size=500, max_batches=20):
+    """
+    分批标记已过期但未使用的兑换码（设置 expired_at），使其离开待清理兑换码的部分索引
+    每批只查询第 batch_size 行的 expires_at 作为上界，再按过滤条件直接更新（URL长度与批大小无关）；
+    更新带 is_used=false 条件，不会覆盖期间被兑换的兑换码
+    返回: (success: bool, message: str, marked_count: int)
+    """
+    supabase = SupabaseClient()
+    current_time = datetime.utcnow().isoformat()
+    pending = {'is_used': 'eq.false', 'expired_at': 'is.null'}
+    marked = 0
+    for _ in range(max_batches):
+        success, rows = supabase._make_request('GET', 'redemption_codes', params={
+            **pending,
+            'select': 'expires_at',
+            'expires_at': f'lt.{current_time}',
+            'order': 'expires_at',
+            'offset': str(batch_size - 1),
+            'limit': '1'
+        })
+        if not success and _missing_column(rows):
+            current_app.logger.warning("redemption_codes 缺少 expired_at 列，请执行 migrations/001_redemption_codes_expiry.sql")
+            return True, "未执行迁移，跳过过期兑换码标记", marked
+        if not success:
+            return False, "查询过期兑换码失败", marked
+        # 剩余不足一批时标记全部剩余的过期兑换码
+        last_batch = not rows
+        upper_bound = f'lt.{current_time}' if last_batch else f'lte.{rows[0]["expires_at"]}'
+
+        success, updated = supabase._make_request('PATCH', 'redemption_codes', params={
+            **pending,
+            'expires_at': upper_bound
+        }, data={'expired_at': current_time})
+        if not success:
+            return False, "标记过期兑换码失败", marked
+        marked += len(updated or [])
+        if last_batch:
+            break
+    return True, f"已标记{marked}个过期兑换码", marked
+
+
+def run_expiry_sweep(job: Job):
+    """后台清理任务的处理函数"""
+    config = current_app.config
+    success, message, marked = sweep_expired_codes(
+        batch_size=config.get('REDEMPTION_EXPIRY_SWEEP_BATCH', 500),
+        max_batches=config.get('REDEMPTION_EXPIRY_SWEEP_MAX_BATCHES', 20)
+    )
+    if not success:
+        current_app.logger.error(f"过期兑换码清理失败: {message}, 本次已标记{marked}个")
+        return False, message
+    if marked:
+        current_app.logger.info(message)
+    return True, {"marked": marked}
+
+
+def register_redemption_jobs(sweep_interval=3600, timeout=300):
+    """注册过期兑换码清理任务，每 sweep_interval 秒执行一次（0表示不执行）"""
+    job_queue.register(EXPIRY_SWEEP_JOB_KIND, run_expiry_sweep, timeout=timeout)
+    job_queue.schedule(EXPIRY_SWEEP_JOB_KIND, sweep_interval)
@@ -0,0 +1,162 @@
+# backend/utils/admission.py
+"""
+LLM接口准入控制
+- 每个用户同时进行中的请求数上限，超出立即拒绝
+- 全局（每个worker进程）LLM并发上限，超出时进入有界等待队列
+- 队列已满或等待超时时快速返回 429 和 Retry-After，而不是占住worker线程
+"""
+import math
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
+
+from utils.metrics import ADMISSION_REJECTIONS
+
+REASON_USER_LIMIT = 'user_limit'
+REASON_QUEUE_FULL = 'queue_full'
+REASON_QUEUE_TIMEOUT = 'queue_timeout'
+
+_REJECTION_MESSAGES = {
+    REASON_USER_LIMIT: "您有请求正在处理中，请等待完成后再试",
+    REASON_QUEUE_FULL: "服务繁忙，请稍后再试",
+    REASON_QUEUE_TIMEOUT: "服务繁忙，请稍后再试",
+}
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """按用户和全局限制LLM请求并发"""
+
+    def __init__(self, max_per_user: int = 2, max_concurrency: int = 64,
+                 max_queue: int = 32, queue_timeout: float = 5.0):
+        self.max_per_user = max_per_user
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._per_user: Dict[str, int] = {}
+        self._in_flight = 0
+        self._waiting = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {}
+
+    def configure(self, config) -> None:
+        """从应用配置读取限制"""
+        self.max_per_user = int(config.get('LLM_MAX_INFLIGHT_PER_USER', self.max_per_user))
+        self.max_concurrency = int(config.get('LLM_MAX_CONCURRENCY', self.max_concurrency))
+        self.max_queue = int(config.get('LLM_QUEUE_SIZE', self.max_queue))
+        self.queue_timeout = float(config.get('LLM_QUEUE_TIMEOUT', self.queue_timeout))
+
+    def _reject(self, reason: str, retry_after: float) -> AdmissionRejected:
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        ADMISSION_REJECTIONS.labels(reason=reason).inc()
+        return AdmissionRejected(reason, max(1, math.ceil(retry_after)))
+
+    def acquire(self, user_id: str) -> None:
+        """
+        申请一个LLM并发名额，失败时抛出 AdmissionRejected
+        成功后必须调用 release(user_id)
+        """
+        with self._condition:
+            if self._per_user.get(user_id, 0) >= self.max_per_user:
+                raise self._reject(REASON_USER_LIMIT, 1)
+
+            # 先占用用户名额，避免同一用户的多个请求同时排队
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            if self._in_flight >= self.max_concurrency:
+                if self._waiting >= self.max_queue:
+                    self._release_user(user_id)
+                    raise self._reject(REASON_QUEUE_FULL, self.queue_timeout)
+
+                self._waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._in_flight >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._release_user(user_id)
+                            raise self._reject(REASON_QUEUE_TIMEOUT, self.queue_timeout)
+                        self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            self._in_flight += 1
+            self.admitted += 1
+
+    def release(self, user_id: str) -> None:
+        """归还名额并唤醒一个排队中的请求"""
+        with self._condition:
+            self._in_flight -= 1
+            self._release_user(user_id)
+            self._condition.notify()
+
+    def _release_user(self, user_id: str) -> None:
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入统计信息"""
+        with self._condition:
+            return {
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'active_users': len(self._per_user),
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'max_per_user': self.max_per_user,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
+
+
+# LLM接口共用的准入控制器（每个worker进程一个）
+llm_admission = AdmissionController()
+
+
+def rejection_response(error: AdmissionRejected):
+    """429响应，带 Retry-After"""
+    response = jsonify({
+        "error": _REJECTION_MESSAGES.get(error.reason, "服务繁忙，请稍后再试"),
+        "reason": error.reason,
+        "retry_after": error.retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def admission_required(controller: Optional[AdmissionController] = None):
+    """
+    LLM接口准入控制装饰器，需放在 @jwt_required() 下方
+    未被准入时返回429，不进入视图函数
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            admission = controller or llm_admission
+            user_id = get_jwt_identity()
+            try:
+                admission.acquire(user_id)
+            except AdmissionRejected as e:
+                return rejection_response(e)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                admission.release(user_id)
+        return wrapper
+    return decorator
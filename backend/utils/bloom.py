@@ -0,0 +1,91 @@
+# backend/utils/bloom.py
+"""
+布隆过滤器
+- BloomFilter: 固定容量，按期望误判率计算位数组大小和哈希次数（双重哈希，blake2b）
+- RotatingBloomFilter: 两代过滤器轮换，记录"最近"出现过的键；当前代写满或超过时间窗口后
+  上一代被丢弃，因此键最多保留约两个时间窗口
+"""
+import hashlib
+import math
+import threading
+import time
+from typing import Any, Dict
+
+
+class BloomFilter:
+    """固定容量的布隆过滤器（只能添加，不能删除）"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 1e-4):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / self.capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def add(self, key: str) -> None:
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RotatingBloomFilter:
+    """记录最近出现过的键：当前代写满 capacity 个键或存在超过 window 秒后轮换"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 1e-4, window: float = 600):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.window = window
+        self._lock = threading.Lock()
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = None
+        self._rotated_at = time.monotonic()
+        self.rotations = 0
+
+    def _maybe_rotate(self) -> None:
+        if self._current.count >= self.capacity or time.monotonic() - self._rotated_at >= self.window:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._rotated_at = time.monotonic()
+            self.rotations += 1
+
+    def add(self, key: str) -> None:
+        with self._lock:
+            self._maybe_rotate()
+            self._current.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._maybe_rotate()
+            return key in self._current or (self._previous is not None and key in self._previous)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._current = BloomFilter(self.capacity, self.error_rate)
+            self._previous = None
+            self._rotated_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'current_items': self._current.count,
+                'previous_items': self._previous.count if self._previous is not None else 0,
+                'capacity': self.capacity,
+                'error_rate': self.error_rate,
+                'window_seconds': self.window,
+                'bits': self._current.num_bits,
+                'hashes': self._current.num_hashes,
+                'rotations': self.rotations
+            }
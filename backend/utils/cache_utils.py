@@ -8,55 +8,75 @@ import json
 import hashlib
 from functools import wraps
 from typing import Any, Dict, Optional, Callable
+from utils.metrics import record_cache_lookup, record_cache_eviction
+from utils.tracing import tracer
+
+class CacheEntry:
+    """缓存项，使用 __slots__ 避免每项一个元数据字典"""
+    __slots__ = ('value', 'created_at', 'last_accessed', 'expires_at', 'ttl')
+
+    def __init__(self, value: Any, ttl: int, current_time: float):
+        self.value = value
+        self.created_at = current_time
+        self.last_accessed = current_time
+        self.expires_at = current_time + ttl
+        self.ttl = ttl
 
 class MemoryCache:
     """简单的内存缓存实现"""
     
-    def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, name: str = 'memory'):
+        self.name = name
+        self._cache: Dict[str, CacheEntry] = {}
         self._default_ttl = 300  # 5分钟默认TTL
     
-    def _is_expired(self, cache_entry: Dict[str, Any]) -> bool:
+    def _is_expired(self, cache_entry: CacheEntry) -> bool:
         """检查缓存项是否过期"""
-        return time.time() > cache_entry['expires_at']
+        return time.time() > cache_entry.expires_at
     
     def _cleanup_expired(self):
         """清理过期的缓存项"""
         current_time = time.time()
         expired_keys = [
             key for key, entry in self._cache.items()
-            if current_time > entry['expires_at']
+            if current_time > entry.expires_at
         ]
         for key in expired_keys:
             del self._cache[key]
+        record_cache_eviction(self.name, 'expired', len(expired_keys))
     
     def get(self, key: str) -> Optional[Any]:
         """获取缓存值"""
-        if key not in self._cache:
+        with tracer.span('cache.get', cache=self.name) as span:
+            value = self._get(key)
+            if span is not None:
+                span.set_attribute('hit', value is not None)
+            return value
+    
+    def _get(self, key: str) -> Optional[Any]:
+        entry = self._cache.get(key)
+        if entry is None:
+            record_cache_lookup(self.name, False)
             return None
         
-        entry = self._cache[key]
-        if self._is_expired(entry):
+        current_time = time.time()
+        if current_time > entry.expires_at:
             del self._cache[key]
+            record_cache_lookup(self.name, False)
+            record_cache_eviction(self.name, 'expired')
             return None
         
         # 更新访问时间
-        entry['last_accessed'] = time.time()
-        return entry['value']
+        entry.last_accessed = current_time
+        record_cache_lookup(self.name, True)
+        return entry.value
     
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
         """设置缓存值"""
         if ttl is None:
             ttl = self._default_ttl
         
-        current_time = time.time()
-        self._cache[key] = {
-            'value': value,
-            'created_at': current_time,
-            'last_accessed': current_time,
-            'expires_at': current_time + ttl,
-            'ttl': ttl
-        }
+        self._cache[key] = CacheEntry(value, ttl, time.time())
         
         # 定期清理过期项
         if len(self._cache) % 100 == 0:
@@ -66,6 +86,7 @@ class MemoryCache:
         """删除缓存项"""
         if key in self._cache:
             del self._cache[key]
+            record_cache_eviction(self.name, 'invalidated')
             return True
         return False
     
@@ -79,7 +100,7 @@ class MemoryCache:
         total_items = len(self._cache)
         expired_items = sum(
             1 for entry in self._cache.values()
-            if current_time > entry['expires_at']
+            if current_time > entry.expires_at
         )
         
         return {
@@ -87,12 +108,12 @@ class MemoryCache:
             'active_items': total_items - expired_items,
             'expired_items': expired_items,
             'memory_usage_estimate': sum(
-                len(str(entry['value'])) for entry in self._cache.values()
+                len(str(entry.value)) for entry in self._cache.values()
             )
         }
 
 # 全局缓存实例
-_global_cache = MemoryCache()
+_global_cache = MemoryCache('global')
 
 def get_cache_key(*args, **kwargs) -> str:
     """生成缓存键"""
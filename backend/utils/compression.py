@@ -0,0 +1,207 @@
+# backend/utils/compression.py
+"""
+按路由配置的响应压缩
+在 Flask-Compress 的基础上支持每个路由单独的压缩策略：
+- off:     不压缩（健康检查、SSE等）
+- fast:    低压缩级别，适合只发送一次的动态内容（聊天、作文）
+- cached:  按 ETag 缓存压缩后的响应体，适合可重复的GET（统计、历史记录）
+- default: 使用全局 COMPRESS_* 配置
+并统计每次压缩消耗的CPU时间。
+"""
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from gzip import GzipFile
+from io import BytesIO
+from typing import Any, Callable, Dict
+
+from flask import current_app, g, request
+from flask_compress import Compress
+
+from utils.metrics import COMPRESSION_CPU, record_cache_lookup, record_cache_eviction
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - Flask-Compress 依赖 Brotli
+    brotli = None
+
+POLICY_DEFAULT = 'default'
+POLICY_OFF = 'off'
+POLICY_FAST = 'fast'
+POLICY_CACHED = 'cached'
+
+
+def compression_policy(policy: str):
+    """
+    设置路由压缩策略的装饰器，需直接放在 @app.route 下方
+
+    Args:
+        policy: off / fast / cached / default
+    """
+    if policy not in (POLICY_DEFAULT, POLICY_OFF, POLICY_FAST, POLICY_CACHED):
+        raise ValueError(f"未知的压缩策略: {policy}")
+
+    def decorator(func: Callable) -> Callable:
+        func.compression_policy = policy
+        return func
+    return decorator
+
+
+def _current_policy() -> str:
+    view = current_app.view_functions.get(request.endpoint) if request.endpoint else None
+    return getattr(view, 'compression_policy', POLICY_DEFAULT)
+
+
+class CompressedBodyCache:
+    """按 (ETag, 编码) 缓存压缩结果的LRU缓存"""
+
+    def __init__(self, max_items: int = 256):
+        self.max_items = max_items
+        self._items: 'OrderedDict[tuple, bytes]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            body = self._items.get(key)
+            if body is None:
+                self.misses += 1
+                record_cache_lookup('compressed_body', False)
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            record_cache_lookup('compressed_body', True)
+            return body
+
+    def set(self, key: tuple, body: bytes) -> None:
+        with self._lock:
+            self._items[key] = body
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                record_cache_eviction('compressed_body', 'lru')
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class CompressionStats:
+    """压缩CPU耗时统计（按策略汇总）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_policy: Dict[str, Dict[str, float]] = {}
+
+    def record(self, policy: str, cpu_seconds: float, bytes_in: int, bytes_out: int) -> None:
+        with self._lock:
+            entry = self._by_policy.setdefault(policy, {
+                'count': 0, 'cpu_seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0
+            })
+            entry['count'] += 1
+            entry['cpu_seconds'] += cpu_seconds
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for policy, entry in self._by_policy.items():
+                count = entry['count'] or 1
+                result[policy] = {
+                    'count': entry['count'],
+                    'cpu_seconds_total': round(entry['cpu_seconds'], 6),
+                    'cpu_ms_avg': round(entry['cpu_seconds'] / count * 1000, 3),
+                    'bytes_in': entry['bytes_in'],
+                    'bytes_out': entry['bytes_out'],
+                    'ratio': round(entry['bytes_out'] / entry['bytes_in'], 3) if entry['bytes_in'] else 0
+                }
+            return result
+
+
+class PolicyCompress(Compress):
+    """支持按路由策略、压缩体缓存和CPU计时的 Flask-Compress"""
+
+    def __init__(self, app=None):
+        self.body_cache = CompressedBodyCache()
+        self.stats = CompressionStats()
+        super().__init__(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_FAST_LEVEL', 1)
+        app.config.setdefault('COMPRESS_FAST_BR_LEVEL', 1)
+        app.config.setdefault('COMPRESS_BODY_CACHE_SIZE', 256)
+        self.body_cache.max_items = app.config['COMPRESS_BODY_CACHE_SIZE']
+        super().init_app(app)
+
+    def after_request(self, response):
+        policy = _current_policy()
+        if policy == POLICY_OFF:
+            return response
+
+        g.compression_policy = policy
+        response = super().after_request(response)
+
+        cpu_seconds = g.pop('compression_cpu_seconds', None)
+        if cpu_seconds is not None:
+            response.headers.add('Server-Timing', f'compress;dur={cpu_seconds * 1000:.2f}')
+        return response
+
+    def compress(self, app, response, algorithm):
+        policy = g.get('compression_policy', POLICY_DEFAULT)
+
+        # 可重复的GET按ETag缓存压缩结果（ETag在此时尚未追加编码后缀）
+        cache_key = None
+        if policy == POLICY_CACHED:
+            etag = response.headers.get('ETag')
+            if etag:
+                cache_key = (etag, algorithm)
+                cached = self.body_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+        data = response.get_data()
+        start = time.thread_time()
+        if policy == POLICY_FAST:
+            body = self._compress_fast(app, data, algorithm)
+        else:
+            body = super().compress(app, response, algorithm)
+        cpu_seconds = time.thread_time() - start
+
+        g.compression_cpu_seconds = cpu_seconds
+        COMPRESSION_CPU.labels(policy=policy).observe(cpu_seconds)
+        self.stats.record(policy, cpu_seconds, len(data), len(body))
+
+        if cache_key is not None:
+            self.body_cache.set(cache_key, body)
+        return body
+
+    @staticmethod
+    def _compress_fast(app, data: bytes, algorithm: str) -> bytes:
+        level = app.config['COMPRESS_FAST_LEVEL']
+        if algorithm == 'gzip':
+            buffer = BytesIO()
+            with GzipFile(mode='wb', compresslevel=level, fileobj=buffer) as gzip_file:
+                gzip_file.write(data)
+            return buffer.getvalue()
+        elif algorithm == 'deflate':
+            return zlib.compress(data, level)
+        elif algorithm == 'br':
+            return brotli.compress(data, quality=app.config['COMPRESS_FAST_BR_LEVEL'])
+        raise ValueError(f"不支持的压缩算法: {algorithm}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取压缩统计信息"""
+        return {
+            'policies': self.stats.snapshot(),
+            'body_cache': {
+                'items': len(self.body_cache),
+                'hits': self.body_cache.hits,
+                'misses': self.body_cache.misses
+            }
+        }
@@ -0,0 +1,24 @@
+# backend/utils/concurrency.py
+"""
+worker并发模型相关工具
+gunicorn 使用 gevent worker 时，CPU密集型调用（bcrypt）会阻塞整个事件循环，
+需要放到gevent的原生线程池中执行；gthread/sync worker 下直接调用。
+"""
+from typing import Any, Callable
+
+
+def gevent_active() -> bool:
+    """当前进程是否已被gevent打过猴子补丁"""
+    try:
+        from gevent import monkey
+    except ImportError:  # 可选依赖
+        return False
+    return monkey.is_module_patched('socket')
+
+
+def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """执行CPU密集型函数；gevent下在原生线程池中执行，不阻塞其他请求"""
+    if gevent_active():
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
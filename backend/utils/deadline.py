@@ -0,0 +1,108 @@
+# backend/utils/deadline.py
+"""
+请求截止时间
+每个请求在开始时获得一个 Deadline（默认 REQUEST_DEADLINE_DEFAULT 秒，
+路由可用 @request_deadline('chat') 改用 REQUEST_DEADLINE_CHAT），
+下游调用（Supabase、LLM）只使用剩余的时间预算；预算用完后不再发起新的上游调用。
+
+截止时间保存在 contextvar 中，请求线程、gevent 协程和后台任务都可以使用 deadline_scope 设置。
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Iterator, Optional
+
+from flask import current_app, g
+
+# 剩余预算低于该值（秒）时不再发起上游调用
+MIN_UPSTREAM_TIMEOUT = 0.05
+
+_current_deadline: contextvars.ContextVar = contextvars.ContextVar('current_deadline', default=None)
+
+
+class Deadline:
+    """从 start（time.perf_counter）起 budget 秒后到期"""
+    __slots__ = ('budget', 'expires_at')
+
+    def __init__(self, budget: float, start: Optional[float] = None):
+        self.budget = budget
+        self.expires_at = (start if start is not None else time.perf_counter()) + budget
+
+    def remaining(self) -> float:
+        """剩余秒数，已过期时为负数"""
+        return self.expires_at - time.perf_counter()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def __repr__(self) -> str:
+        return f'<Deadline budget={self.budget:g}s remaining={self.remaining():.3f}s>'
+
+
+def current_deadline() -> Optional[Deadline]:
+    """当前上下文的截止时间，没有设置时返回None"""
+    return _current_deadline.get()
+
+
+def set_deadline(deadline: Optional[Deadline]) -> contextvars.Token:
+    return _current_deadline.set(deadline)
+
+
+def reset_deadline(token: contextvars.Token) -> None:
+    _current_deadline.reset(token)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """在代码块内使用指定的截止时间；传入None表示不受截止时间限制（如退还预扣积分等补偿操作）"""
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """当前截止时间的剩余秒数；没有截止时间时返回None"""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def upstream_timeout(configured: float, reserve: float = 0.0) -> float:
+    """
+    本次上游调用可用的超时：配置值与剩余预算（减去 reserve）中较小的一个
+    返回值小于 MIN_UPSTREAM_TIMEOUT 时调用方应直接放弃调用
+    """
+    remaining = remaining_budget()
+    if remaining is None:
+        return configured
+    return max(0.0, min(configured, remaining - reserve))
+
+
+def start_request_deadline(config, start: float) -> None:
+    """before_request 中调用：按默认预算设置当前请求的截止时间"""
+    _current_deadline.set(Deadline(float(config.get('REQUEST_DEADLINE_DEFAULT', 10)), start))
+
+
+def clear_request_deadline() -> None:
+    """teardown_request 中调用，避免线程复用时沿用上一个请求的截止时间"""
+    _current_deadline.set(None)
+
+
+def request_deadline(route: str):
+    """
+    为路由设置单独的时间预算（配置项 REQUEST_DEADLINE_<ROUTE>），从请求开始时计算
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            budget = current_app.config.get(f'REQUEST_DEADLINE_{route.upper()}')
+            if budget is None:
+                return func(*args, **kwargs)
+            start = g.get('request_start_time')
+            with deadline_scope(Deadline(float(budget), start)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+# backend/utils/http_utils.py
+"""
+HTTP请求/响应工具
+提供ETag / If-None-Match 条件请求支持、客户端IP解析，以及请求体大小检查和JSON请求体校验
+"""
+import hashlib
+from functools import wraps
+from typing import Any, Callable, Optional, Tuple
+
+from flask import abort, current_app, g, jsonify, request, make_response
+
+# Flask-Compress 压缩后会在ETag末尾追加编码名，如 "abc:br"
+_ENCODING_SUFFIXES = (':br', ':gzip', ':deflate')
+
+
+def _normalize_etag(tag: str) -> str:
+    """去掉弱校验前缀、引号和压缩编码后缀"""
+    tag = tag.strip()
+    if tag.startswith('W/'):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    for suffix in _ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def get_client_ip() -> str:
+    """
+    获取客户端IP
+    不读取 X-Forwarded-For：其最左侧的地址由客户端控制，轮换即可绕过按IP的限流。
+    部署在反向代理之后时，由 app 中的 ProxyFix（TRUSTED_PROXY_COUNT）把可信代理追加的地址写入 remote_addr
+    """
+    return request.remote_addr
+
+
+def compute_etag(body: bytes) -> str:
+    """根据响应体计算ETag"""
+    return hashlib.md5(body).hexdigest()
+
+
+def etag_matches(etag: str) -> bool:
+    """检查请求的 If-None-Match 是否命中给定ETag"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(_normalize_etag(tag) == etag for tag in header.split(','))
+
+
+def conditional_response(max_age: int = 0):
+    """
+    为GET接口添加ETag支持的装饰器
+    仅对200响应生成ETag；客户端携带匹配的 If-None-Match 时返回304空响应。
+
+    Args:
+        max_age: 允许浏览器不经验证直接复用的秒数，0表示每次都需验证
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            response = make_response(func(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+
+            etag = compute_etag(response.get_data())
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = f'private, max-age={max_age}, must-revalidate'
+
+            if etag_matches(etag):
+                not_modified = make_response('', 304)
+                not_modified.set_etag(etag)
+                not_modified.headers['Cache-Control'] = response.headers['Cache-Control']
+                return not_modified
+
+            return response
+        return wrapper
+    return decorator
+
+
+def reject_oversized_request() -> None:
+    """
+    before_request 钩子：声明的 Content-Length 超过 MAX_CONTENT_LENGTH 时直接返回413，
+    不进入JWT校验和视图函数，也不读取请求体
+    未声明长度的分块上传由 Werkzeug 在读取时按同一上限截断（见 json_body）
+    """
+    max_length = current_app.config.get('MAX_CONTENT_LENGTH')
+    if max_length and request.content_length is not None and request.content_length > max_length:
+        abort(413)
+
+
+def json_body(validate: Optional[Callable[[dict], Tuple[bool, str, Any]]] = None):
+    """
+    解析并校验JSON请求体的装饰器，需放在 @rate_limit 上方：
+    格式错误的请求直接返回400，不占用限流额度，也不查询数据库
+    validate(data) 返回 (success, error_message, value)，通过后 value 保存在 g.request_body
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            if data is None and request.content_length is None:
+                # 分块上传被截断到 MAX_CONTENT_LENGTH 后无法解析，按请求体过大处理
+                max_length = current_app.config.get('MAX_CONTENT_LENGTH')
+                if max_length and len(request.get_data()) >= max_length:
+                    abort(413)
+            if not data or not isinstance(data, dict):
+                return jsonify({"error": "请求体不能为空，且必须是JSON格式"}), 400
+            if validate is not None:
+                valid, message, data = validate(data)
+                if not valid:
+                    return jsonify({"error": message}), 400
+            g.request_body = data
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
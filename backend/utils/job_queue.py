@@ -0,0 +1,370 @@
+# backend/utils/job_queue.py
+"""
+持久化后台任务队列
+任务保存在 SQLite 中（所有 gunicorn worker 共享同一个文件），每个 worker 进程启动
+JOB_QUEUE_WORKERS 个线程，以原子的 UPDATE ... RETURNING 领取任务，保证同一任务只被执行一次。
+
+- 处理函数签名 handler(job) -> (success, result_dict 或 错误信息)
+- 执行中的任务带租约；进程崩溃后租约过期的任务重新入队，超过 max_attempts 次则标记失败，
+  并调用注册时提供的 on_abandon(job)（如退还预扣的积分）
+- wait() 供轮询和 SSE 使用：同进程内的状态变化立即唤醒，跨进程时按 poll_interval 轮询
+- schedule() 注册周期任务：维护时若该类型没有未完成的任务且距上次创建已超过间隔则入队，
+  入队用单条 INSERT ... WHERE NOT EXISTS 完成，多个worker进程同时维护也只会创建一个
+"""
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.deadline import Deadline, deadline_scope
+from utils.json_utils import dumps, loads
+from utils.metrics import JOB_QUEUE_DEPTH, JOB_RUNS, JOB_WAIT
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_status ON jobs (user_id, status);
+"""
+
+_COLUMNS = ('id', 'kind', 'user_id', 'payload', 'status', 'result', 'error', 'attempts',
+            'created_at', 'started_at', 'finished_at')
+_SELECT = f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+
+Handler = Callable[['Job'], Tuple[bool, Any]]
+
+
+class Job:
+    """队列中的一个任务"""
+    __slots__ = _COLUMNS
+
+    def __init__(self, row: Tuple):
+        for name, value in zip(_COLUMNS, row):
+            setattr(self, name, value)
+        self.payload = loads(self.payload) if self.payload else {}
+        self.result = loads(self.result) if self.result else None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        """对外返回的任务状态（不包含payload）"""
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == STATUS_SUCCEEDED:
+            data['result'] = self.result
+        elif self.status == STATUS_FAILED:
+            data['error'] = self.error
+        return data
+
+
+class _Registration:
+    __slots__ = ('handler', 'on_abandon', 'timeout')
+
+    def __init__(self, handler: Handler, on_abandon: Optional[Callable[[Job], None]], timeout: float):
+        self.handler = handler
+        self.on_abandon = on_abandon
+        self.timeout = timeout
+
+
+class JobQueue:
+    """SQLite持久化的任务队列和进程内worker线程池"""
+
+    def __init__(self, path: Optional[str] = None, workers: int = 2, lease_seconds: float = 300,
+                 max_attempts: int = 2, retention_seconds: float = 86400, poll_interval: float = 1.0):
+        self.path = path
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, _Registration] = {}
+        self._schedules: Dict[str, float] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._db_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._app = None
+        self._last_maintenance = 0.0
+
+    def configure(self, config) -> None:
+        """从应用配置读取参数"""
+        self.path = config.get('JOB_QUEUE_PATH', self.path)
+        self.workers = int(config.get('JOB_QUEUE_WORKERS', self.workers))
+        self.lease_seconds = float(config.get('JOB_LEASE_SECONDS', self.lease_seconds))
+        self.max_attempts = int(config.get('JOB_MAX_ATTEMPTS', self.max_attempts))
+        self.retention_seconds = float(config.get('JOB_RETENTION_SECONDS', self.retention_seconds))
+
+    def register(self, kind: str, handler: Handler, on_abandon: Optional[Callable[[Job], None]] = None,
+                 timeout: float = 120) -> None:
+        """
+        注册任务处理函数
+        timeout: 处理函数内上游调用的截止时间（秒），应小于 lease_seconds
+        on_abandon: 任务因租约多次过期被放弃时调用（处理函数自己返回的失败不会调用）
+        """
+        self._handlers[kind] = _Registration(handler, on_abandon, timeout)
+
+    def schedule(self, kind: str, interval: float) -> None:
+        """每隔 interval 秒执行一次已注册的任务类型（interval <= 0 表示取消）"""
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        if interval > 0:
+            self._schedules[kind] = interval
+        else:
+            self._schedules.pop(kind, None)
+
+    # ---- 存储 ----
+
+    def _db(self) -> sqlite3.Connection:
+        """每个进程一个连接（gunicorn --preload 时不能沿用父进程的连接）"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self._db_lock:
+            return self._db().execute(sql, params).fetchall()
+
+    def _notify(self) -> None:
+        with self._changed:
+            self._changed.notify_all()
+
+    def _update_depth(self, kind: str) -> None:
+        (depth,) = self._execute('SELECT COUNT(*) FROM jobs WHERE kind = ? AND status = ?', (kind, STATUS_QUEUED))[0]
+        JOB_QUEUE_DEPTH.labels(kind=kind).set(depth)
+
+    def enqueue(self, kind: str, user_id: Optional[str], payload: Dict[str, Any],
+                result: Optional[Dict[str, Any]] = None) -> Job:
+        """
+        新建任务并返回；提供 result 时直接记录为已完成（如命中缓存），不进入队列
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未注册的任务类型: {kind}")
+        now = time.time()
+        status = STATUS_QUEUED if result is None else STATUS_SUCCEEDED
+        rows = self._execute(
+            'INSERT INTO jobs (id, kind, user_id, payload, status, result, created_at, finished_at) '
+            f'VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING {", ".join(_COLUMNS)}',
+            (uuid.uuid4().hex, kind, user_id, dumps(payload), status,
+             dumps(result) if result is not None else None, now, None if result is None else now)
+        )
+        if result is None:
+            self._update_depth(kind)
+            self._notify()
+        return Job(rows[0])
+
+    def _enqueue_scheduled(self, now: float) -> None:
+        """为到期的周期任务入队（同一类型已有排队中/执行中的任务时跳过）"""
+        for kind, interval in list(self._schedules.items()):
+            rows = self._execute(
+                'INSERT INTO jobs (id, kind, user_id, payload, status, created_at) '
+                'SELECT ?, ?, NULL, ?, ?, ? WHERE NOT EXISTS ('
+                'SELECT 1 FROM jobs WHERE kind = ? AND (status IN (?, ?) OR created_at > ?)) RETURNING id',
+                (uuid.uuid4().hex, kind, dumps({}), STATUS_QUEUED, now,
+                 kind, STATUS_QUEUED, STATUS_RUNNING, now - interval)
+            )
+            if rows:
+                self._update_depth(kind)
+                self._notify()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        rows = self._execute(f'{_SELECT} WHERE id = ?', (job_id,))
+        return Job(rows[0]) if rows else None
+
+    def count_pending(self, user_id: str, kind: Optional[str] = None) -> int:
+        """用户排队中和执行中的任务数"""
+        sql = 'SELECT COUNT(*) FROM jobs WHERE user_id = ? AND status IN (?, ?)'
+        params: Tuple = (user_id, STATUS_QUEUED, STATUS_RUNNING)
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params += (kind,)
+        return self._execute(sql, params)[0][0]
+
+    def wait(self, job_id: str, last_status: Optional[str], timeout: float) -> Optional[Job]:
+        """等待任务状态不同于 last_status（或已结束），超时返回当前状态"""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.finished or job.status != last_status or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(self.poll_interval, remaining))
+
+    def _claim(self) -> Optional[Job]:
+        now = time.time()
+        rows = self._execute(
+            'UPDATE jobs SET status = ?, started_at = ?, lease_until = ?, attempts = attempts + 1 '
+            'WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) '
+            f'RETURNING {", ".join(_COLUMNS)}',
+            (STATUS_RUNNING, now, now + self.lease_seconds, STATUS_QUEUED)
+        )
+        return Job(rows[0]) if rows else None
+
+    def _finish(self, job: Job, success: bool, result: Any) -> None:
+        if success:
+            self._execute(
+                'UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_until = NULL WHERE id = ?',
+                (STATUS_SUCCEEDED, dumps(result), time.time(), job.id)
+            )
+        else:
+            self._execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?',
+                (STATUS_FAILED, str(result), time.time(), job.id)
+            )
+        JOB_RUNS.labels(kind=job.kind, outcome='succeeded' if success else 'failed').inc()
+        self._notify()
+
+    def _maintain(self) -> None:
+        """回收租约过期的任务，清理超过保留期的已完成任务"""
+        now = time.time()
+        self._execute(
+            'UPDATE jobs SET status = ?, lease_until = NULL WHERE status = ? AND lease_until < ? AND attempts < ?',
+            (STATUS_QUEUED, STATUS_RUNNING, now, self.max_attempts)
+        )
+        abandoned = self._execute(
+            'UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_until = NULL '
+            'WHERE status = ? AND lease_until < ? '
+            f'RETURNING {", ".join(_COLUMNS)}',
+            (STATUS_FAILED, '任务执行超时', now, STATUS_RUNNING, now)
+        )
+        for row in abandoned:
+            job = Job(row)
+            JOB_RUNS.labels(kind=job.kind, outcome='abandoned').inc()
+            registration = self._handlers.get(job.kind)
+            if registration is not None and registration.on_abandon is not None:
+                self._call_in_context(registration.on_abandon, job)
+        self._execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+            (STATUS_SUCCEEDED, STATUS_FAILED, now - self.retention_seconds)
+        )
+        for kind in self._handlers:
+            self._update_depth(kind)
+        if abandoned:
+            self._notify()
+        self._enqueue_scheduled(now)
+
+    # ---- worker ----
+
+    def ensure_started(self, app=None) -> None:
+        """启动worker线程（gunicorn --preload 会在fork后丢失线程，按进程ID判断）"""
+        if self._pid == os.getpid() and self._threads:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._app = app
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._notify()
+
+    def _call_in_context(self, func: Callable, *args):
+        if self._app is None:
+            return func(*args)
+        with self._app.app_context():
+            return func(*args)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - self._last_maintenance > max(self.poll_interval, 30):
+                    self._last_maintenance = time.monotonic()
+                    self._maintain()
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"任务队列访问失败: {e}")
+                self._stop.wait(self.poll_interval)
+                continue
+
+            if job is None:
+                with self._changed:
+                    self._changed.wait(self.poll_interval)
+                continue
+            self._execute_job(job)
+
+    def _execute_job(self, job: Job) -> None:
+        JOB_WAIT.labels(kind=job.kind).observe(max(0.0, job.started_at - job.created_at))
+        self._update_depth(job.kind)
+        registration = self._handlers.get(job.kind)
+        if registration is None:
+            self._finish(job, False, f"未注册的任务类型: {job.kind}")
+            return
+        try:
+            with deadline_scope(Deadline(registration.timeout)):
+                success, result = self._call_in_context(registration.handler, job)
+        except Exception as e:
+            print(f"后台任务执行异常: {job.kind} {job.id}: {e}\n{traceback.format_exc()}")
+            success, result = False, "任务执行失败"
+        try:
+            self._finish(job, success, result)
+        except sqlite3.Error as e:
+            print(f"任务结果保存失败: {job.kind} {job.id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计信息"""
+        try:
+            rows = self._execute('SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status')
+            oldest = self._execute('SELECT MIN(created_at) FROM jobs WHERE status = ?', (STATUS_QUEUED,))[0][0]
+        except sqlite3.Error as e:
+            return {'error': str(e)}
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for kind, status, count in rows:
+            by_kind.setdefault(kind, {})[status] = count
+        return {
+            'path': self.path,
+            'workers': self.workers,
+            'running_in_process': sum(1 for thread in self._threads if thread.is_alive()),
+            'jobs': by_kind,
+            'oldest_queued_seconds': round(time.time() - oldest, 1) if oldest else 0.0
+        }
+
+
+# 全局任务队列：默认存放在 backend 目录，SQLite 连接在首次使用时才打开（由 app 按配置设置路径并启动worker）
+job_queue = JobQueue(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jobs.sqlite3'))
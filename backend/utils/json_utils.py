@@ -0,0 +1,84 @@
+# backend/utils/json_utils.py
+"""
+JSON编解码工具
+提供可插拔的JSON后端：安装了 orjson 时使用 orjson，否则回退到标准库 json。
+所有输出都不转义中文（不产生 \\uXXXX），以减小响应体积。
+"""
+import json
+import os
+from typing import Any, Callable, Optional
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+# JSON_BACKEND: auto（默认，优先orjson）/ orjson / stdlib
+_requested_backend = os.environ.get('JSON_BACKEND', 'auto').lower()
+USE_ORJSON = orjson is not None and _requested_backend in ('auto', 'orjson')
+JSON_BACKEND = 'orjson' if USE_ORJSON else 'stdlib'
+
+if _requested_backend == 'orjson' and orjson is None:
+    print("警告：JSON_BACKEND=orjson 但未安装 orjson，已回退到标准库 json")
+
+if USE_ORJSON:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        """序列化为UTF-8字节串（紧凑格式）"""
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+
+    def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+        """序列化为字符串（紧凑格式）"""
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(data: Any) -> Any:
+        """反序列化字符串或字节串"""
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+        """序列化为UTF-8字节串（紧凑格式）"""
+        return dumps(obj, default).encode('utf-8')
+
+    def dumps(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> str:
+        """序列化为字符串（紧凑格式）"""
+        if default is None:
+            return _encoder.encode(obj)
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default)
+
+    def loads(data: Any) -> Any:
+        """反序列化字符串或字节串"""
+        return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON提供者
+    使用 dumps_bytes 直接生成响应体，不转义中文，不排序键。
+    调试模式下仍使用标准库输出带缩进的JSON。
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, default=self.default)
+
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            dumps_bytes(obj, default=self.default) + b"\n", mimetype=self.mimetype
+        )
@@ -0,0 +1,157 @@
+# backend/utils/metrics.py
+"""
+Prometheus 指标
+定义路由、Supabase、LLM、bcrypt 的延迟直方图，重试、缓存、积分消耗、准入拒绝、限流、熔断等计数器，
+以及后台任务队列的深度和等待时间。
+
+在 gunicorn 多进程下运行时，设置环境变量 PROMETHEUS_MULTIPROC_DIR（start.py 会自动设置），
+/metrics 会汇总所有 worker 的数据。未安装 prometheus_client 时所有指标操作为空操作。
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # 可选依赖
+    PROMETHEUS_AVAILABLE = False
+
+
+class _NoopMetric:
+    """prometheus_client 不可用时的占位指标"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    # 面向用户的请求延迟较长（LLM调用），桶上限覆盖到60秒
+    _LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', 'HTTP请求处理耗时',
+        ['route', 'method', 'status'], buckets=_LATENCY_BUCKETS
+    )
+    SUPABASE_LATENCY = Histogram(
+        'supabase_request_duration_seconds', 'Supabase PostgREST请求耗时',
+        ['endpoint', 'method', 'outcome'], buckets=_LATENCY_BUCKETS
+    )
+    LLM_TTFB = Histogram(
+        'llm_time_to_first_byte_seconds', 'LLM请求首字节耗时',
+        ['model'], buckets=_LATENCY_BUCKETS
+    )
+    LLM_LATENCY = Histogram(
+        'llm_request_duration_seconds', 'LLM请求总耗时',
+        ['model', 'outcome'], buckets=_LATENCY_BUCKETS
+    )
+    BCRYPT_LATENCY = Histogram(
+        'bcrypt_duration_seconds', 'bcrypt哈希/校验耗时',
+        ['operation'], buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 1, 2)
+    )
+    COMPRESSION_CPU = Histogram(
+        'compression_cpu_seconds', '响应压缩CPU耗时',
+        ['policy'], buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+    )
+    UPSTREAM_RETRIES = Counter(
+        'upstream_retries_total', '上游请求重试次数', ['upstream']
+    )
+    CACHE_REQUESTS = Counter(
+        'cache_requests_total', '缓存查询次数', ['cache', 'result']
+    )
+    CACHE_EVICTIONS = Counter(
+        'cache_evictions_total', '缓存淘汰次数', ['cache', 'reason']
+    )
+    CREDITS_CONSUMED = Counter(
+        'credits_consumed_total', '消耗的积分总数', ['action_type']
+    )
+    ADMISSION_REJECTIONS = Counter(
+        'admission_rejections_total', 'LLM接口准入拒绝次数', ['reason']
+    )
+    RATE_LIMITED = Counter(
+        'rate_limited_total', '被限流的请求次数', ['policy', 'key']
+    )
+    CIRCUIT_STATE_CHANGES = Counter(
+        'circuit_breaker_transitions_total', '熔断器状态切换次数', ['upstream', 'state']
+    )
+    RESPONSE_CACHE_LOOKUPS = Counter(
+        'response_cache_lookups_total', 'LLM回复缓存查询次数（exact/similar/miss）', ['action_type', 'result']
+    )
+    LLM_HEDGE_REQUESTS = Counter(
+        'llm_hedge_requests_total', 'LLM对冲请求（sent/budget_exhausted/no_backend/no_budget_time）', ['result']
+    )
+    LLM_HEDGE_WINS = Counter(
+        'llm_hedge_wins_total', '对冲时先返回成功结果的一方（primary/hedge）', ['winner']
+    )
+    REDEMPTION_CODE_CHECKS = Counter(
+        'redemption_code_checks_total',
+        '兑换码检查结果（invalid_format/bad_checksum/recently_failed/not_found/found）', ['result']
+    )
+    # 队列保存在共享的SQLite中，各worker看到的深度相同，多进程汇总时取最大值
+    JOB_QUEUE_DEPTH = Gauge(
+        'job_queue_depth', '后台任务队列中等待执行的任务数', ['kind'], multiprocess_mode='livemax'
+    )
+    JOB_WAIT = Histogram(
+        'job_wait_seconds', '后台任务从入队到开始执行的等待时间',
+        ['kind'], buckets=_LATENCY_BUCKETS + (120, 300)
+    )
+    JOB_RUNS = Counter(
+        'jobs_total', '后台任务执行次数', ['kind', 'outcome']
+    )
+else:
+    REQUEST_LATENCY = SUPABASE_LATENCY = LLM_TTFB = LLM_LATENCY = BCRYPT_LATENCY = _NoopMetric()
+    COMPRESSION_CPU = UPSTREAM_RETRIES = CACHE_REQUESTS = CACHE_EVICTIONS = CREDITS_CONSUMED = _NoopMetric()
+    ADMISSION_REJECTIONS = RATE_LIMITED = CIRCUIT_STATE_CHANGES = RESPONSE_CACHE_LOOKUPS = _NoopMetric()
+    JOB_QUEUE_DEPTH = JOB_WAIT = JOB_RUNS = LLM_HEDGE_REQUESTS = LLM_HEDGE_WINS = _NoopMetric()
+    REDEMPTION_CODE_CHECKS = _NoopMetric()
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """记录代码块耗时的上下文管理器"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def record_cache_eviction(cache: str, reason: str, count: int = 1) -> None:
+    if count:
+        CACHE_EVICTIONS.labels(cache=cache, reason=reason).inc(count)
+
+
+def render_metrics() -> Optional[Tuple[bytes, str]]:
+    """生成Prometheus文本格式的指标，返回 (内容, Content-Type)；不可用时返回None"""
+    if not PROMETHEUS_AVAILABLE:
+        return None
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+    from prometheus_client import REGISTRY
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int) -> None:
+    """gunicorn worker 退出时清理其多进程指标文件"""
+    if PROMETHEUS_AVAILABLE and os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,235 @@
+# backend/utils/rate_limit.py
+"""
+令牌桶限流
+按路由策略对客户端IP和/或用户ID限流，在视图函数执行前拒绝请求（不做任何bcrypt或数据库操作）。
+
+策略格式（config 中的 RATE_LIMIT_<POLICY>）: "key:容量/周期秒[,key:容量/周期秒...]"
+  例如 "ip:10/60" 表示每个IP最多突发10次，每60秒补满10个令牌；key 为 ip 或 user。
+
+状态存储：
+- 配置了 RATE_LIMIT_STORAGE_URL（redis://...）且安装了 redis 时，所有worker共享令牌桶
+- 否则使用进程内存（每个worker独立计数）；Redis不可用时也临时回退到内存
+"""
+import math
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import current_app, jsonify
+from flask_jwt_extended import get_jwt_identity
+
+from utils.http_utils import get_client_ip
+from utils.metrics import RATE_LIMITED
+
+try:
+    import redis
+except ImportError:  # 可选依赖
+    redis = None
+
+KEY_IP = 'ip'
+KEY_USER = 'user'
+
+
+class BucketRule:
+    """一条令牌桶规则"""
+    __slots__ = ('key', 'capacity', 'period', 'rate')
+
+    def __init__(self, key: str, capacity: int, period: float):
+        if key not in (KEY_IP, KEY_USER):
+            raise ValueError(f"未知的限流键: {key}")
+        self.key = key
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period  # 每秒补充的令牌数
+
+
+def parse_policy(spec: str) -> List[BucketRule]:
+    """解析 "ip:10/60,user:20/60" 形式的策略"""
+    rules = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        key, _, limit = part.partition(':')
+        capacity, _, period = limit.partition('/')
+        rules.append(BucketRule(key.strip(), int(capacity), float(period)))
+    return rules
+
+
+class MemoryBucketStore:
+    """进程内令牌桶"""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, capacity: int, rate: float, now: float) -> float:
+        """取一个令牌；成功返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return wait
+
+    def _prune(self, now: float) -> None:
+        # 只保留最近活跃的一半；被删除的桶下次按满桶处理，对正常用户无影响
+        keep = sorted(self._buckets.items(), key=lambda item: item[1][1], reverse=True)
+        self._buckets = dict(keep[:self.max_keys // 2])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+# 原子地补充并取出令牌，返回 {是否允许, 需等待秒数}
+_REDIS_TOKEN_BUCKET = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return tostring(wait)
+"""
+
+
+class RedisBucketStore:
+    """Redis令牌桶（所有worker共享）"""
+
+    def __init__(self, url: str, prefix: str = 'ratelimit:'):
+        self._client = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+        self._script = self._client.register_script(_REDIS_TOKEN_BUCKET)
+        self.prefix = prefix
+
+    def consume(self, key: str, capacity: int, rate: float, now: float) -> float:
+        return float(self._script(keys=[self.prefix + key], args=[capacity, rate, now]))
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(f'{self.prefix}*'):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """按策略名检查请求是否超出限流"""
+
+    def __init__(self):
+        self.enabled = True
+        self.policies: Dict[str, List[BucketRule]] = {}
+        self.memory = MemoryBucketStore()
+        self.shared: Optional[RedisBucketStore] = None
+        self.backend = 'memory'
+        self.rejected: Dict[str, int] = {}
+        self._shared_failed_at = 0.0
+
+    def configure(self, config) -> None:
+        """从应用配置读取策略和存储"""
+        self.enabled = bool(config.get('RATE_LIMIT_ENABLED', True))
+        self.policies = {
+            name[len('RATE_LIMIT_'):].lower(): parse_policy(value)
+            for name, value in config.items()
+            if name.startswith('RATE_LIMIT_') and name not in ('RATE_LIMIT_ENABLED', 'RATE_LIMIT_STORAGE_URL')
+        }
+        url = config.get('RATE_LIMIT_STORAGE_URL')
+        if url and redis is not None:
+            self.shared = RedisBucketStore(url)
+            self.backend = 'redis'
+        elif url:
+            print("警告：未安装redis，限流状态仅在当前worker进程内生效")
+
+    def _consume(self, key: str, rule: BucketRule, now: float) -> float:
+        # Redis出错后30秒内直接使用内存，避免每个请求都等待超时
+        if self.shared is not None and now - self._shared_failed_at > 30:
+            try:
+                return self.shared.consume(key, rule.capacity, rule.rate, now)
+            except Exception as e:
+                self._shared_failed_at = now
+                print(f"限流Redis不可用，临时使用进程内存: {e}")
+        return self.memory.consume(key, rule.capacity, rule.rate, now)
+
+    def hit(self, policy: str) -> Optional[int]:
+        """
+        为当前请求消耗令牌
+        返回None表示放行，否则返回建议的 Retry-After 秒数
+        """
+        rules = self.policies.get(policy)
+        if not self.enabled or not rules:
+            return None
+
+        now = time.time()
+        wait = 0.0
+        for rule in rules:
+            identity = get_client_ip() if rule.key == KEY_IP else get_jwt_identity()
+            if not identity:
+                continue
+            bucket_key = f'{policy}:{rule.key}:{identity}'
+            rule_wait = self._consume(bucket_key, rule, now)
+            if rule_wait > 0:
+                RATE_LIMITED.labels(policy=policy, key=rule.key).inc()
+                wait = max(wait, rule_wait)
+
+        if wait > 0:
+            self.rejected[policy] = self.rejected.get(policy, 0) + 1
+            return max(1, math.ceil(wait))
+        return None
+
+    def get_stats(self) -> Dict:
+        """获取限流统计信息"""
+        return {
+            'enabled': self.enabled,
+            'backend': self.backend,
+            'policies': {
+                name: [f'{rule.key}:{rule.capacity}/{rule.period:g}' for rule in rules]
+                for name, rules in self.policies.items()
+            },
+            'rejected': dict(self.rejected)
+        }
+
+
+# 全局限流器
+rate_limiter = RateLimiter()
+
+
+def rate_limited_response(retry_after: int):
+    """429响应（带 Retry-After）"""
+    response = jsonify({
+        "error": "请求过于频繁，请稍后再试",
+        "retry_after": retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limit(policy: str):
+    """
+    限流装饰器；按用户限流的路由需放在 @jwt_required() 下方
+    超出限制时返回429和 Retry-After，不进入视图函数
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            retry_after = rate_limiter.hit(policy)
+            if retry_after is not None:
+                current_app.logger.warning(f"请求被限流: policy={policy}, ip={get_client_ip()}")
+                return rate_limited_response(retry_after)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
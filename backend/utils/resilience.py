@@ -0,0 +1,210 @@
+# backend/utils/resilience.py
+"""
+上游调用的熔断、重试和超时工具
+- CircuitBreaker: 每个上游一个熔断器（closed → open → half_open），上游故障期间请求在毫秒级失败
+- backoff_delays: 带完全随机抖动的指数退避，只用于幂等方法
+- RollingStats: 最近一段时间的延迟分位数和错误率，用于选择上游和对冲请求
+- RetryBudget: 限制额外请求（对冲）占正常请求的比例，避免上游变慢时流量翻倍
+超时按请求截止时间收紧，见 utils/deadline.py
+"""
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from utils.metrics import CIRCUIT_STATE_CHANGES
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# 可以安全重试的HTTP方法
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败 failure_threshold 次后打开；打开 recovery_timeout 秒后进入半开，
+    只放行 half_open_max_calls 个试探请求，成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._half_opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _transition(self, state: str) -> None:
+        if state != self._state:
+            print(f"熔断器 {self.name}: {self._state} -> {state}")
+            CIRCUIT_STATE_CHANGES.labels(upstream=self.name, state=state).inc()
+            self._state = state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._transition(STATE_HALF_OPEN)
+            self._half_opened_at = time.monotonic()
+            self._half_open_calls = 0
+
+    def allow(self) -> bool:
+        """是否允许发起调用；允许后必须调用 record_success 或 record_failure"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN:
+                # 试探请求没有报告结果（如未预期的异常）时，超过恢复时间后允许新的试探
+                if time.monotonic() - self._half_opened_at >= self.recovery_timeout:
+                    self._half_opened_at = time.monotonic()
+                    self._half_open_calls = 0
+                if self._half_open_calls < self.half_open_max_calls:
+                    self._half_open_calls += 1
+                    return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != STATE_CLOSED:
+                self._transition(STATE_CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == STATE_HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(STATE_OPEN)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._maybe_half_open()
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'rejected': self.rejected
+            }
+
+
+def backoff_delays(retries: int, base: float = 0.1, cap: float = 2.0) -> Iterator[float]:
+    """指数退避的完全随机抖动（AWS "full jitter"）"""
+    for attempt in range(retries):
+        yield random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RollingStats:
+    """
+    滑动窗口内的调用统计：保留最近 window 秒、最多 max_samples 个样本
+    样本为 (时间, 总耗时, 首字节耗时, 是否成功)
+    """
+
+    def __init__(self, window: float = 300.0, max_samples: int = 500):
+        self.window = window
+        self._samples: Deque[Tuple[float, float, Optional[float], bool]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool, ttfb: Optional[float] = None) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), latency, ttfb, ok))
+
+    def record_censored(self, elapsed: float, ttfb: Optional[float] = None) -> None:
+        """
+        记录被取消（对冲落败）的请求：实际耗时至少为 elapsed，首字节耗时未知时也按 elapsed 计。
+        按成功样本计入，使分位数偏保守；不记录的话慢请求总被取消，分位数会持续偏低
+        """
+        self.record(elapsed, True, ttfb if ttfb is not None else elapsed)
+
+    def _recent(self):
+        cutoff = time.monotonic() - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return list(self._samples)
+
+    @staticmethod
+    def _percentile(values, q: float) -> Optional[float]:
+        if not values:
+            return None
+        values = sorted(values)
+        return values[max(0, math.ceil(q * len(values)) - 1)]
+
+    def error_rate(self) -> float:
+        with self._lock:
+            samples = self._recent()
+        if not samples:
+            return 0.0
+        return sum(1 for sample in samples if not sample[3]) / len(samples)
+
+    def ttfb_percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """成功调用的首字节耗时分位数；样本不足时返回None"""
+        with self._lock:
+            values = [sample[2] for sample in self._recent() if sample[3] and sample[2] is not None]
+        if len(values) < min_samples:
+            return None
+        return self._percentile(values, q)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = self._recent()
+        latencies = [sample[1] for sample in samples if sample[3]]
+        ttfbs = [sample[2] for sample in samples if sample[3] and sample[2] is not None]
+
+        def ms(value):
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            'samples': len(samples),
+            'error_rate': round(sum(1 for sample in samples if not sample[3]) / len(samples), 4) if samples else 0.0,
+            'latency_p50_ms': ms(self._percentile(latencies, 0.5)),
+            'latency_p95_ms': ms(self._percentile(latencies, 0.95)),
+            'ttfb_p50_ms': ms(self._percentile(ttfbs, 0.5)),
+            'ttfb_p95_ms': ms(self._percentile(ttfbs, 0.95))
+        }
+
+
+class RetryBudget:
+    """
+    额外请求预算（令牌桶）：每个正常请求存入 ratio 个令牌，每个额外请求消耗1个，
+    令牌最多累积 burst 个。长期来看额外请求不超过正常请求的 ratio 倍。
+    """
+
+    def __init__(self, ratio: float = 0.1, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'tokens': round(self._tokens, 2), 'ratio': self.ratio, 'burst': self.burst}
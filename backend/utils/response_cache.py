@@ -0,0 +1,249 @@
+# backend/utils/response_cache.py
+"""
+LLM回复缓存（可选，RESPONSE_CACHE_ENABLED=true 时启用）
+只缓存首轮和短历史的对话：很多学生的开场白几乎一样（"我想写一篇关于夏天的作文"），
+每次都用相同的系统提示冷启动调用LLM。
+
+- 键：系统提示 + 历史 + 消息 归一化（NFKC、去空白和标点、小写）后的哈希
+- 近似匹配：同一上下文（系统提示 + 历史）内按字符 n-gram 的 Jaccard 相似度查找
+- 每个键保存多个回复变体，凑满 RESPONSE_CACHE_VARIANTS 个之前仍调用LLM，命中时随机返回一个
+- 按 action_type 统计命中率
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from utils.metrics import RESPONSE_CACHE_LOOKUPS
+
+RESULT_EXACT = 'exact'
+RESULT_SIMILAR = 'similar'
+RESULT_MISS = 'miss'
+
+_IGNORED_CHARS = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角、去掉空白和标点、转小写"""
+    return _IGNORED_CHARS.sub('', unicodedata.normalize('NFKC', text or '')).lower()
+
+
+def char_ngrams(text: str, n: int = 2) -> Set[str]:
+    """字符 n-gram 集合（文本短于n时返回整个文本）"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class NGramIndex:
+    """n-gram 倒排索引，按 Jaccard 相似度查找最接近的文本"""
+
+    def __init__(self, n: int = 2):
+        self.n = n
+        self._postings: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def add(self, key: str, text: str) -> None:
+        if key in self._grams:
+            return
+        grams = char_ngrams(text, self.n)
+        self._grams[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key: str) -> None:
+        for gram in self._grams.pop(key, ()):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def query(self, text: str, threshold: float) -> Optional[Tuple[str, float]]:
+        """返回相似度不低于 threshold 的最佳 (key, 相似度)，没有时返回None"""
+        grams = char_ngrams(text, self.n)
+        if not grams:
+            return None
+        overlap: Dict[str, int] = {}
+        for gram in grams:
+            for key in self._postings.get(gram, ()):
+                overlap[key] = overlap.get(key, 0) + 1
+
+        best = None
+        for key, shared in overlap.items():
+            score = shared / (len(grams) + len(self._grams[key]) - shared)
+            if score >= threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+
+class _ResponseEntry:
+    __slots__ = ('context', 'text', 'variants', 'expires_at')
+
+    def __init__(self, context: str, text: str, expires_at: float):
+        self.context = context
+        self.text = text
+        self.variants: List[str] = []
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """首轮/短历史对话的LLM回复缓存"""
+
+    def __init__(self):
+        self.enabled = False
+        self.ttl = 3600
+        self.max_history = 2
+        self.max_message_chars = 200
+        self.similarity = 0.85
+        self.variants = 3
+        self.max_entries = 2000
+        self._entries: 'OrderedDict[str, _ResponseEntry]' = OrderedDict()
+        self._indexes: Dict[str, NGramIndex] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def configure(self, config) -> None:
+        """从应用配置读取参数"""
+        self.enabled = bool(config.get('RESPONSE_CACHE_ENABLED', False))
+        self.ttl = int(config.get('RESPONSE_CACHE_TTL', self.ttl))
+        self.max_history = int(config.get('RESPONSE_CACHE_MAX_HISTORY', self.max_history))
+        self.max_message_chars = int(config.get('RESPONSE_CACHE_MAX_MESSAGE_CHARS', self.max_message_chars))
+        self.similarity = float(config.get('RESPONSE_CACHE_SIMILARITY', self.similarity))
+        self.variants = max(1, int(config.get('RESPONSE_CACHE_VARIANTS', self.variants)))
+        self.max_entries = int(config.get('RESPONSE_CACHE_MAX_ENTRIES', self.max_entries))
+
+    def eligible(self, history: List[Dict[str, Any]], message: str) -> bool:
+        """只缓存首轮和短历史的对话"""
+        return self.enabled and len(history) <= self.max_history and len(message) <= self.max_message_chars
+
+    @staticmethod
+    def context_key(system_prompt: str, history: List[Dict[str, Any]]) -> str:
+        parts = [normalize_text(system_prompt)]
+        for msg in history:
+            parts.append(f"{msg.get('role')}:{normalize_text(str(msg.get('content', '')))}")
+        return _digest(*parts)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        index = self._indexes.get(entry.context)
+        if index is not None:
+            index.remove(key)
+            if not len(index):
+                del self._indexes[entry.context]
+
+    def _find(self, context: str, text: str, now: float) -> Tuple[Optional[str], str]:
+        """先精确匹配，再在同一上下文内近似匹配；返回 (键, 匹配类型)"""
+        key = _digest(context, text)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > now:
+            return key, RESULT_EXACT
+
+        index = self._indexes.get(context)
+        match = index.query(text, self.similarity) if index is not None else None
+        if match is not None:
+            similar = self._entries.get(match[0])
+            if similar is not None and similar.expires_at > now:
+                return match[0], RESULT_SIMILAR
+            self._remove(match[0])
+        return None, RESULT_MISS
+
+    def lookup(self, action_type: str, system_prompt: str, history: List[Dict[str, Any]],
+               message: str) -> Tuple[Optional[str], str]:
+        """
+        查找缓存的回复
+        返回 (回复, 匹配类型)；变体未凑满时回复为None，调用方应调用LLM后 store
+        """
+        context = self.context_key(system_prompt, history)
+        text = normalize_text(message)
+        with self._lock:
+            key, result = self._find(context, text, time.time())
+            entry = self._entries.get(key) if key is not None else None
+            if entry is None or len(entry.variants) < self.variants:
+                result = RESULT_MISS
+                reply = None
+            else:
+                self._entries.move_to_end(key)
+                reply = random.choice(entry.variants)
+            self._record(action_type, result)
+        return reply, result
+
+    def store(self, system_prompt: str, history: List[Dict[str, Any]], message: str, reply: str) -> None:
+        """保存一个回复变体"""
+        context = self.context_key(system_prompt, history)
+        text = normalize_text(message)
+        key = _digest(context, text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                self._remove(key)
+                entry = _ResponseEntry(context, text, now + self.ttl)
+                self._entries[key] = entry
+                self._indexes.setdefault(context, NGramIndex()).add(key, text)
+            if len(entry.variants) < self.variants and reply not in entry.variants:
+                entry.variants.append(reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def get_or_call(self, action_type: str, system_prompt: str, history: List[Dict[str, Any]], message: str,
+                    call: Callable[[], Tuple[bool, str]]) -> Tuple[bool, str, bool]:
+        """
+        命中缓存时直接返回，否则调用 call() 并缓存成功的回复
+        返回 (success, 回复或错误信息, 是否来自缓存)
+        """
+        if not self.eligible(history, message):
+            success, content = call()
+            return success, content, False
+
+        reply, _ = self.lookup(action_type, system_prompt, history, message)
+        if reply is not None:
+            return True, reply, True
+
+        success, content = call()
+        if success:
+            self.store(system_prompt, history, message, content)
+        return success, content, False
+
+    def _record(self, action_type: str, result: str) -> None:
+        stats = self._stats.setdefault(action_type, {RESULT_EXACT: 0, RESULT_SIMILAR: 0, RESULT_MISS: 0})
+        stats[result] += 1
+        RESPONSE_CACHE_LOOKUPS.labels(action_type=action_type, result=result).inc()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._indexes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（按 action_type 的命中率）"""
+        with self._lock:
+            by_action = {}
+            for action_type, stats in self._stats.items():
+                total = sum(stats.values())
+                hits = stats[RESULT_EXACT] + stats[RESULT_SIMILAR]
+                by_action[action_type] = dict(stats, hit_rate=round(hits / total, 4) if total else 0.0)
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'contexts': len(self._indexes),
+                'by_action': by_action
+            }
+
+
+# 全局LLM回复缓存（每个worker进程一个）
+response_cache = ResponseCache()
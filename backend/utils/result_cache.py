@@ -0,0 +1,173 @@
+# backend/utils/result_cache.py
+"""
+按内容寻址的结果缓存
+键由调用方根据输入内容计算（如对话历史 + 系统提示 + 模型的哈希），相同输入直接返回已生成的结果。
+- 进程内 LRU 保存最近使用的结果，命中时不访问磁盘
+- SQLite 持久化，重启和多个worker进程之间共享；超过 max_entries 时按最近访问时间淘汰
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from utils.json_utils import dumps, loads
+from utils.metrics import record_cache_lookup, record_cache_eviction
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_accessed ON results (last_accessed);
+"""
+
+
+class ResultCache:
+    """内存LRU + SQLite持久化的结果缓存"""
+
+    def __init__(self, name: str, path: Optional[str] = None, max_entries: int = 5000,
+                 memory_entries: int = 256):
+        self.name = name
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.enabled = True
+        self._memory: 'OrderedDict[str, Any]' = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, enabled: bool = True, path: Optional[str] = None, max_entries: Optional[int] = None) -> None:
+        with self._lock:
+            self.enabled = enabled
+            if path is not None and path != self.path:
+                self.path = path
+                self._close()
+            if max_entries is not None:
+                self.max_entries = max_entries
+
+    def _close(self) -> None:
+        if self._conn is not None and self._conn_pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        """每个进程一个连接（gunicorn --preload 时不能沿用父进程的连接）"""
+        if not self.path:
+            return None
+        if self._conn is None or self._conn_pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(_SCHEMA)
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存结果，没有时返回None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+            else:
+                value = self._get_persistent(key)
+                if value is not None:
+                    self._remember(key, value)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        record_cache_lookup(self.name, value is not None)
+        return value
+
+    def _get_persistent(self, key: str) -> Optional[Any]:
+        try:
+            db = self._db()
+            if db is None:
+                return None
+            row = db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE results SET last_accessed = ? WHERE key = ?', (time.time(), key))
+            return loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"结果缓存读取失败（{self.name}）: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """保存结果；持久化失败时只保留在内存中"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remember(key, value)
+            try:
+                db = self._db()
+                if db is None:
+                    return
+                now = time.time()
+                db.execute(
+                    'INSERT OR REPLACE INTO results (key, value, created_at, last_accessed) VALUES (?, ?, ?, ?)',
+                    (key, dumps(value), now, now)
+                )
+                self._evict(db)
+            except sqlite3.Error as e:
+                print(f"结果缓存写入失败（{self.name}）: {e}")
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        (count,) = db.execute('SELECT COUNT(*) FROM results').fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            db.execute(
+                'DELETE FROM results WHERE key IN '
+                '(SELECT key FROM results ORDER BY last_accessed LIMIT ?)',
+                (overflow,)
+            )
+            record_cache_eviction(self.name, 'lru', overflow)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+            try:
+                db = self._db()
+                if db is not None:
+                    db.execute('DELETE FROM results WHERE key = ?', (key,))
+            except sqlite3.Error as e:
+                print(f"结果缓存删除失败（{self.name}）: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            stored = None
+            try:
+                db = self._db()
+                if db is not None:
+                    (stored,) = db.execute('SELECT COUNT(*) FROM results').fetchone()
+            except sqlite3.Error:
+                pass
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'path': self.path,
+                'memory_items': len(self._memory),
+                'stored_items': stored,
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
@@ -0,0 +1,254 @@
+# backend/utils/tracing.py
+"""
+轻量级请求链路追踪
+每个请求分配一个 trace ID，Supabase 请求、LLM 调用、bcrypt 和缓存查询记录为子 span。
+追踪结果由后台线程导出，不阻塞请求：
+- file: 每个 trace 一行JSON，写入本地文件（默认）
+- otlp: 以 OTLP/HTTP JSON 格式发送到本地收集器
+
+支持采样率（TRACE_SAMPLE_RATE）和只记录慢请求（TRACE_SLOW_MS）。
+"""
+import contextvars
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from utils.json_utils import dumps
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+def _new_id(num_bytes: int) -> str:
+    return os.urandom(num_bytes).hex()
+
+
+class Span:
+    """一个计时区间"""
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'attributes',
+                 'start_ns', '_start_perf', 'duration_ms', 'error')
+
+    def __init__(self, trace: 'Trace', name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self._start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self) -> None:
+        self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round(self.duration_ms or 0, 3),
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+
+class Trace:
+    """一次请求的所有 span"""
+    __slots__ = ('trace_id', 'spans', 'root')
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+
+
+class Tracer:
+    """采样、span管理和异步导出"""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.slow_ms = 0.0
+        self.exporter = 'file'
+        self.file_path = 'traces.jsonl'
+        self.otlp_endpoint = 'http://localhost:4318/v1/traces'
+        self.service_name = 'little-writers-backend'
+        self._queue: 'queue.Queue[Trace]' = queue.Queue(maxsize=1000)
+        self._worker: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def configure(self, config) -> None:
+        """从应用配置读取追踪设置"""
+        self.enabled = bool(config.get('TRACE_ENABLED', False))
+        self.sample_rate = float(config.get('TRACE_SAMPLE_RATE', 1.0))
+        self.slow_ms = float(config.get('TRACE_SLOW_MS', 0))
+        self.exporter = config.get('TRACE_EXPORTER', 'file')
+        self.file_path = config.get('TRACE_FILE', 'traces.jsonl')
+        self.otlp_endpoint = config.get('TRACE_OTLP_ENDPOINT', self.otlp_endpoint)
+
+    # ----- span 管理 -----
+
+    def start_trace(self, name: str, trace_id: Optional[str] = None, **attributes) -> Optional[Trace]:
+        """开始一个新的 trace（未启用或未被采样时返回None）"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            _current_trace.set(None)
+            _current_span.set(None)
+            return None
+
+        trace = Trace(trace_id or _new_id(16))
+        root = Span(trace, name, None, attributes)
+        trace.root = root
+        trace.spans.append(root)
+        _current_trace.set(trace)
+        _current_span.set(root)
+        return trace
+
+    def finish_trace(self, **attributes) -> None:
+        """结束当前 trace，满足慢请求条件时提交导出"""
+        trace = _current_trace.get()
+        _current_trace.set(None)
+        _current_span.set(None)
+        if trace is None or trace.root is None:
+            return
+
+        trace.root.attributes.update(attributes)
+        trace.root.finish()
+        if self.slow_ms and trace.root.duration_ms < self.slow_ms:
+            return
+        self._submit(trace)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """在当前 trace 中记录一个子 span；没有活动 trace 时不做任何事"""
+        trace = _current_trace.get()
+        if trace is None:
+            yield None
+            return
+
+        parent = _current_span.get()
+        span = Span(trace, name, parent.span_id if parent else None, attributes)
+        trace.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.finish()
+            _current_span.reset(token)
+
+    def current_trace_id(self) -> Optional[str]:
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    # ----- 导出 -----
+
+    def _submit(self, trace: Trace) -> None:
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+                return
+            self._pid = os.getpid()
+            self._worker = threading.Thread(target=self._export_loop, name='trace-exporter', daemon=True)
+            self._worker.start()
+
+    def _export_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if self.exporter == 'otlp':
+                    self._export_otlp(batch)
+                else:
+                    self._export_file(batch)
+            except Exception as e:
+                print(f"追踪数据导出失败: {e}")
+
+    def _export_file(self, batch: List[Trace]) -> None:
+        lines = []
+        for trace in batch:
+            lines.append(dumps({
+                'trace_id': trace.trace_id,
+                'service': self.service_name,
+                'pid': os.getpid(),
+                'spans': [span.to_dict() for span in trace.spans]
+            }))
+        with open(self.file_path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _export_otlp(self, batch: List[Trace]) -> None:
+        import requests
+
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {'key': key, 'value': {'boolValue': value}}
+            if isinstance(value, int):
+                return {'key': key, 'value': {'intValue': str(value)}}
+            if isinstance(value, float):
+                return {'key': key, 'value': {'doubleValue': value}}
+            return {'key': key, 'value': {'stringValue': str(value)}}
+
+        spans = []
+        for trace in batch:
+            for span in trace.spans:
+                end_ns = span.start_ns + int((span.duration_ms or 0) * 1e6)
+                otlp_span = {
+                    'traceId': trace.trace_id,
+                    'spanId': span.span_id,
+                    'name': span.name,
+                    'kind': 2 if span.parent_id is None else 3,  # SERVER / CLIENT
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(end_ns),
+                    'attributes': [attribute(k, v) for k, v in span.attributes.items() if v is not None],
+                    'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+                }
+                if span.parent_id:
+                    otlp_span['parentSpanId'] = span.parent_id
+                spans.append(otlp_span)
+
+        payload = {'resourceSpans': [{
+            'resource': {'attributes': [attribute('service.name', self.service_name)]},
+            'scopeSpans': [{'scope': {'name': 'little-writers.tracing'}, 'spans': spans}]
+        }]}
+        requests.post(
+            self.otlp_endpoint, data=dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, timeout=5
+        )
+
+
+# 全局追踪器
+tracer = Tracer()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[str]:
+    """从W3C traceparent请求头中取出 trace ID"""
+    if not header:
+        return None
+    parts = header.split('-')
+    if len(parts) == 4 and len(parts[1]) == 32:
+        return parts[1]
+    return None
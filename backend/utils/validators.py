@@ -46,13 +46,132 @@ def validate_credits_amount(amount):
     except (ValueError, TypeError):
         return False
 
+# 兑换码字符集：大写字母和数字，排除容易混淆的 O 0 I L 1（共31个字符，31为质数）
+REDEMPTION_CODE_ALPHABET = 'ABCDEFGHJKMNPQRSTUVWXYZ23456789'
+REDEMPTION_CODE_LENGTH = 16
+_REDEMPTION_CODE_VALUES = {char: index for index, char in enumerate(REDEMPTION_CODE_ALPHABET)}
+_REDEMPTION_CODE_SEPARATORS = str.maketrans('', '', '- \t')
+
+def normalize_redemption_code(code):
+    """统一兑换码格式：去掉分隔符（-、空格）并转为大写；不是字符串时返回空字符串"""
+    if not isinstance(code, str):
+        return ''
+    return code.translate(_REDEMPTION_CODE_SEPARATORS).upper()
+
+def redemption_check_char(body):
+    """
+    兑换码校验字符：按位置加权（权重 1, 2, 3...）求和后对31取模
+    31为质数，任意单个字符输错或相邻两个字符颠倒都会改变校验字符
+    """
+    total = sum((index + 1) * _REDEMPTION_CODE_VALUES[char] for index, char in enumerate(body))
+    return REDEMPTION_CODE_ALPHABET[total % len(REDEMPTION_CODE_ALPHABET)]
+
+def has_valid_redemption_checksum(code):
+    """检查已归一化的兑换码最后一位是否为正确的校验字符"""
+    return redemption_check_char(code[:-1]) == code[-1]
+
 def validate_redemption_code(code):
-    """验证兑换码格式"""
-    if not code:
-        return False
-    # 兑换码应该是16位字符，只包含大写字母和数字
-    code = code.replace('-', '').replace(' ', '').upper()
-    if len(code) != 16:
+    """验证兑换码格式（16位，只包含兑换码字符集中的字符），允许带分隔符和小写"""
+    code = normalize_redemption_code(code)
+    if len(code) != REDEMPTION_CODE_LENGTH:
         return False
-    pattern = r'^[A-Z0-9]{16}$'
-    return re.match(pattern, code) is not None
\ No newline at end of file
+    return all(char in _REDEMPTION_CODE_VALUES for char in code)
+
+
+class HistoryValidator:
+    """
+    对话历史校验（/api/chat、/api/complete_essay、/api/essay_jobs 共用）
+    从最新的消息向前单次遍历，检查角色、每条消息长度、总长度和消息条数；
+    遍历只做判断，发现不合法的消息时再逐条检查一次给出具体的错误信息。
+    超出条数或总长度时按配置截掉最早的消息（trim）或拒绝（reject）。
+    不复制消息，只有截断时返回原列表的切片。
+    """
+
+    def __init__(self, allowed_roles=('user', 'assistant'), max_messages=200,
+                 max_message_chars=4000, max_total_chars=60000, overflow='trim'):
+        self.allowed_roles = frozenset(allowed_roles)
+        self.max_messages = max_messages
+        self.max_message_chars = max_message_chars
+        self.max_total_chars = max_total_chars
+        self.trim = overflow == 'trim'
+
+    def configure(self, config):
+        """从应用配置读取参数"""
+        roles = config.get('HISTORY_ALLOWED_ROLES')
+        if roles:
+            self.allowed_roles = frozenset(role.strip() for role in roles.split(',') if role.strip())
+        self.max_messages = int(config.get('HISTORY_MAX_MESSAGES', self.max_messages))
+        self.max_message_chars = int(config.get('HISTORY_MAX_MESSAGE_CHARS', self.max_message_chars))
+        self.max_total_chars = int(config.get('HISTORY_MAX_TOTAL_CHARS', self.max_total_chars))
+        self.trim = config.get('HISTORY_OVERFLOW', 'trim') == 'trim'
+
+    def _scan(self, history, stop):
+        """
+        从最新的消息向前检查到 stop（只做判断的紧凑循环）
+        返回保留部分的起始位置（大于 stop 表示超出总长度）；遇到不合法的消息返回None
+        """
+        roles = self.allowed_roles
+        max_message_chars = self.max_message_chars
+        remaining = self.max_total_chars
+        start = len(history)
+        try:
+            for msg in reversed(history if stop == 0 else history[stop:]):
+                content = msg["content"]
+                if type(content) is not str or msg["role"] not in roles:
+                    return None
+                size = len(content)
+                if size > max_message_chars:
+                    return None
+                remaining -= size
+                if remaining < 0:
+                    return start
+                start -= 1
+        except (KeyError, TypeError):
+            # 不是字典、缺少字段或角色不可哈希
+            return None
+        return start
+
+    def _first_error(self, history, stop):
+        """逐条检查，返回从最新的消息向前遇到的第一个错误"""
+        for index in range(len(history) - 1, stop - 1, -1):
+            msg = history[index]
+            if type(msg) is not dict:
+                return "历史记录中的每条消息都必须包含 'role' 和 'content' 字段"
+            role = msg.get("role")
+            if type(role) is not str or role not in self.allowed_roles:
+                return f"历史记录第 {index + 1} 条消息的角色无效"
+            content = msg.get("content")
+            if type(content) is not str:
+                return "历史记录中的每条消息都必须包含 'role' 和 'content' 字段"
+            if len(content) > self.max_message_chars:
+                return f"历史记录第 {index + 1} 条消息过长"
+        return "历史记录中的每条消息都必须包含 'role' 和 'content' 字段"
+
+    def validate(self, history):
+        """
+        校验对话历史
+        返回: (success, error_message, history) —— 成功时 history 为原列表或截掉最早消息后的切片
+        """
+        if type(history) is not list:
+            return False, "'history' 字段必须是一个列表", None
+
+        count = len(history)
+        if count > self.max_messages and not self.trim:
+            return False, f"对话历史最多 {self.max_messages} 条消息", None
+
+        stop = max(0, count - self.max_messages)
+        start = self._scan(history, stop)
+        if start is None:
+            return False, self._first_error(history, stop), None
+        if start > stop and not self.trim:
+            return False, "对话历史过长", None
+
+        if start == 0:
+            return True, "", history
+        # 截断后从用户消息开始，避免以助手回复开头
+        while start < count and history[start]["role"] != "user":
+            start += 1
+        return True, "", history[start:]
+
+
+history_validator = HistoryValidator()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+前端静态资源构建脚本
+将 frontend/ 下每个页面引用的本地 JS / CSS 合并、压缩，按内容哈希命名，
+改写HTML中的引用，并为文本资源生成 .br / .gz 预压缩文件。
+压缩使用可选依赖 rjsmin / rcssmin（pip install rjsmin rcssmin），未安装时只合并不压缩。
+
+输出目录为 frontend/dist，可直接作为静态站点发布目录：
+    python build_frontend.py
+"""
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，缺失时只生成 .gz
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # 可选依赖，缺失时JS不压缩，只合并
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:  # 可选依赖，缺失时CSS不压缩，只合并
+    rcssmin = None
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(ROOT_DIR, 'frontend')
+DIST_DIR = os.path.join(SRC_DIR, 'dist')
+
+# 需要生成预压缩文件的扩展名
+COMPRESSIBLE_EXTENSIONS = ('.html', '.js', '.css', '.svg')
+# 小于该字节数的文件不生成预压缩文件
+MIN_COMPRESS_SIZE = 256
+
+# 连续的本地脚本标签（中间允许空白和HTML注释）
+LOCAL_SCRIPT_RE = re.compile(r'<script src="(js/[^"]+\.js)"></script>')
+LOCAL_STYLE_RE = re.compile(r'<link rel="stylesheet" href="(css/[^"]+\.css)">')
+GAP_RE = re.compile(r'^(?:\s|<!--.*?-->)*$', re.S)
+
+
+def print_separator(title):
+    """打印分隔符"""
+    print("\n" + "=" * 60)
+    print(f" {title} ")
+    print("=" * 60)
+
+
+# ---------------------------------------------------------------------------
+# 压缩
+# ---------------------------------------------------------------------------
+
+def minify_js(src):
+    """用 rjsmin 压缩JS（删除注释和多余空白）；未安装时原样返回"""
+    if rjsmin is None:
+        return src.rstrip() + '\n'
+    return rjsmin.jsmin(src).strip() + '\n'
+
+
+def minify_css(src):
+    """用 rcssmin 压缩CSS；未安装时原样返回"""
+    if rcssmin is None:
+        return src.rstrip() + '\n'
+    return rcssmin.cssmin(src).strip() + '\n'
+
+
+# ---------------------------------------------------------------------------
+# 打包
+# ---------------------------------------------------------------------------
+
+def content_hash(data):
+    """内容哈希（用于文件名）"""
+    return hashlib.sha256(data).hexdigest()[:10]
+
+
+def read_text(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        return f.read()
+
+
+def write_bytes(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+class Bundler:
+    """按引用顺序合并资源，相同的文件组合只生成一次"""
+
+    def __init__(self):
+        self.bundles = {}  # (kind, 文件元组) -> 输出相对路径
+
+    def bundle(self, kind, sources):
+        key = (kind, tuple(sources))
+        if key in self.bundles:
+            return self.bundles[key]
+
+        if kind == 'js':
+            # 经典脚本共享全局作用域，按顺序拼接即可；分号防止相邻文件粘连
+            body = ';\n'.join(minify_js(read_text(os.path.join(SRC_DIR, s))) for s in sources)
+        else:
+            body = ''.join(minify_css(read_text(os.path.join(SRC_DIR, s))) for s in sources)
+
+        data = body.encode('utf-8')
+        name = os.path.splitext(os.path.basename(sources[-1]))[0]
+        rel_path = f'{kind}/{name}.bundle.{content_hash(data)}.min.{kind}'
+        write_bytes(os.path.join(DIST_DIR, rel_path), data)
+
+        original = sum(os.path.getsize(os.path.join(SRC_DIR, s)) for s in sources)
+        print(f"  {rel_path}: {len(sources)} 个文件, {original} -> {len(data)} 字节")
+
+        self.bundles[key] = rel_path
+        return rel_path
+
+
+def _group_consecutive(html, pattern):
+    """找出HTML中连续出现的资源引用组，返回 [(start, end, [路径...]), ...]"""
+    groups = []
+    current = None
+    for match in pattern.finditer(html):
+        if current and GAP_RE.match(html[current[1]:match.start()]):
+            current[1] = match.end()
+            current[2].append(match.group(1))
+        else:
+            current = [match.start(), match.end(), [match.group(1)]]
+            groups.append(current)
+    return groups
+
+
+def rewrite_html(html, bundler):
+    """把连续的本地 <script>/<link> 引用替换为单个打包文件引用"""
+    replacements = []
+    for kind, pattern, template in (
+        ('css', LOCAL_STYLE_RE, '<link rel="stylesheet" href="{}">'),
+        ('js', LOCAL_SCRIPT_RE, '<script src="{}"></script>'),
+    ):
+        for start, end, sources in _group_consecutive(html, pattern):
+            replacements.append((start, end, template.format(bundler.bundle(kind, sources))))
+
+    for start, end, tag in sorted(replacements, reverse=True):
+        html = html[:start] + tag + html[end:]
+    return html
+
+
+def precompress(path):
+    """为文本资源生成 .gz 和 .br 预压缩文件"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+
+    write_bytes(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_bytes(path + '.br', brotli.compress(data, quality=11))
+
+
+def build():
+    print_separator("构建前端静态资源")
+
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    os.makedirs(DIST_DIR)
+
+    # 静态资源（图片等）原样复制
+    assets_dir = os.path.join(SRC_DIR, 'assets')
+    if os.path.isdir(assets_dir):
+        shutil.copytree(assets_dir, os.path.join(DIST_DIR, 'assets'))
+
+    bundler = Bundler()
+    for name in sorted(os.listdir(SRC_DIR)):
+        if not name.endswith('.html'):
+            continue
+        print(f"\n📄 {name}")
+        html = rewrite_html(read_text(os.path.join(SRC_DIR, name)), bundler)
+        write_bytes(os.path.join(DIST_DIR, name), html.encode('utf-8'))
+
+    # 生成预压缩文件
+    count = 0
+    for dirpath, _, filenames in os.walk(DIST_DIR):
+        for filename in filenames:
+            if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+                precompress(os.path.join(dirpath, filename))
+                count += 1
+
+    print(f"\n✅ 构建完成: {len(bundler.bundles)} 个打包文件, {count} 个文件已预压缩"
+          f"{'' if brotli else '（未安装 brotli，仅生成 .gz）'}")
+    if rjsmin is None or rcssmin is None:
+        print("   ⚠️ 未安装 rjsmin / rcssmin，对应资源只合并未压缩")
+    print(f"   输出目录: {DIST_DIR}")
+
+
+if __name__ == '__main__':
+    try:
+        build()
+    except OSError as e:
+        print(f"❌ 构建失败: {e}")
+        sys.exit(1)
@@ -32,6 +32,12 @@ const CONFIG = {
             MAX_ATTEMPTS: 3,
             BASE_DELAY: 1000,
             MAX_DELAY: 10000
+        },
+
+        // 作文后台任务：提交后长轮询任务状态
+        ESSAY_JOB: {
+            POLL_WAIT_SECONDS: 20,     // 每次轮询在服务端最多等待的秒数
+            MAX_WAIT: 3 * 60 * 1000    // 3分钟仍未完成则提示稍后再试
         }
     },
     
@@ -47,7 +53,8 @@ const CONFIG = {
             '/api/redeem',
             '/api/user/credits',
             '/api/chat',
-            '/api/complete_essay'
+            '/api/complete_essay',
+            '/api/essay_jobs'
         ]
     },
     
@@ -72,6 +79,7 @@ CONFIG.API.ENDPOINTS = {
     REGISTER: `${CONFIG.API.BASE_URL}/register`,
     CHAT: `${CONFIG.API.BASE_URL}/chat`,
     COMPLETE_ESSAY: `${CONFIG.API.BASE_URL}/complete_essay`,
+    ESSAY_JOBS: `${CONFIG.API.BASE_URL}/essay_jobs`,
     USER_PROFILE: `${CONFIG.API.BASE_URL}/user/profile`,
     USER_CREDITS: `${CONFIG.API.BASE_URL}/user/credits`,
     DATABASE_STATUS: `${CONFIG.API.BASE_URL}/database/status`,
@@ -24,7 +24,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // 使用统一配置
     const API_BASE_URL = CONFIG.API.BASE_URL;
     const CHAT_API_URL = CONFIG.API.ENDPOINTS.CHAT;
-    const COMPLETE_ESSAY_API_URL = CONFIG.API.ENDPOINTS.COMPLETE_ESSAY;
+    const ESSAY_JOBS_API_URL = CONFIG.API.ENDPOINTS.ESSAY_JOBS;
     const USER_PROFILE_URL = CONFIG.API.ENDPOINTS.USER_PROFILE;
 
     let conversationHistory = [];
@@ -952,6 +952,43 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
+    async function readErrorMessage(response, fallback) {
+        const errorData = await response.json().catch(() => ({ error: `请求失败，状态码: ${response.status}` }));
+        return errorData.error || fallback;
+    }
+
+    // 作文由后台任务队列生成：提交任务后长轮询任务状态，直到成功或失败
+    async function requestCompletedEssay(token) {
+        const headers = { 'Authorization': `Bearer ${token}` };
+        const response = await fetch(ESSAY_JOBS_API_URL, {
+            method: 'POST',
+            headers: { ...headers, 'Content-Type': 'application/json' },
+            body: JSON.stringify({ history: conversationHistory }),
+        });
+        if (!response.ok) {
+            throw new Error(await readErrorMessage(response, `AI生成作文失败，状态: ${response.status}`));
+        }
+
+        let job = await response.json();
+        const { POLL_WAIT_SECONDS, MAX_WAIT } = CONFIG.API.ESSAY_JOB;
+        const deadline = Date.now() + MAX_WAIT;
+        while (job.status !== 'succeeded' && job.status !== 'failed') {
+            if (Date.now() > deadline) {
+                throw new Error('作文生成时间较长，请稍后再试');
+            }
+            const pollResponse = await fetch(`${ESSAY_JOBS_API_URL}/${job.job_id}?wait=${POLL_WAIT_SECONDS}`, { headers });
+            if (!pollResponse.ok) {
+                throw new Error(await readErrorMessage(pollResponse, `查询作文进度失败，状态: ${pollResponse.status}`));
+            }
+            job = await pollResponse.json();
+        }
+
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'AI生成作文失败');
+        }
+        return job.result || {};
+    }
+
     async function handleCompleteEssay() {
         console.log("当前对话历史 (点击完成作文时):", JSON.stringify(conversationHistory));
         if (conversationHistory.length === 0 || !conversationHistory.some(msg => msg.role === 'user')) {
@@ -965,20 +1002,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             const token = getAuthToken();
-            const response = await fetch(COMPLETE_ESSAY_API_URL, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Authorization': `Bearer ${token}`
-                },
-                body: JSON.stringify({ history: conversationHistory }),
-            });
-
-            if (!response.ok) {
-                const errorData = await response.json().catch(() => ({ error: `请求失败，状态码: ${response.status}` }));
-                throw new Error(errorData.error || `AI生成作文失败，状态: ${response.status}`);
-            }
-            const data = await response.json();
+            const data = await requestCompletedEssay(token);
             if (data.completed_essay) {
                 const { title, body } = extractTitleAndBody(data.completed_essay);
                 if(modalTitleElement) modalTitleElement.textContent = title; // 设置模态框标题
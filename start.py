@@ -6,6 +6,33 @@
 import os
 import sys
 
+def prepare_metrics_dir():
+    """创建并清空Prometheus多进程指标目录（需在gunicorn启动前设置环境变量）"""
+    import shutil
+    import tempfile
+    metrics_dir = os.environ.setdefault(
+        'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'little-writers-metrics')
+    )
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+def worker_args():
+    """
+    gunicorn worker类型参数（WORKER_CLASS）
+    - gthread（默认）: 每个worker用线程池处理请求，LLM调用期间只占用一个线程
+    - gevent:  协程worker，需要安装gevent；不能使用 --preload（需在导入应用前打猴子补丁）
+    - sync:    旧的同步worker，每个worker同时只能处理一个请求
+    """
+    worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+    args = ['--worker-class', worker_class]
+    if worker_class == 'gthread':
+        args += ['--threads', str(os.environ.get('GUNICORN_THREADS', 100))]
+    elif worker_class == 'gevent':
+        args += ['--worker-connections', str(os.environ.get('WORKER_CONNECTIONS', 500))]
+    if worker_class != 'gevent':
+        args.append('--preload')
+    return args
+
 def main():
     # 添加backend目录到Python路径
     backend_dir = os.path.join(os.path.dirname(__file__), 'backend')
@@ -33,6 +60,9 @@ def main():
         # 生产环境：使用gunicorn
         print("🚀 启动生产服务器 (Gunicorn)")
         import subprocess
+        
+        # Prometheus多进程模式：各worker把指标写入共享目录，/metrics汇总
+        prepare_metrics_dir()
         cmd = [
             'gunicorn',
             '--bind', f'0.0.0.0:{port}',
@@ -41,7 +71,7 @@ def main():
             '--keep-alive', str(os.environ.get('KEEP_ALIVE', 2)),
             '--max-requests', str(os.environ.get('MAX_REQUESTS', 1000)),
             '--max-requests-jitter', str(os.environ.get('MAX_REQUESTS_JITTER', 100)),
-            '--preload',
+            *worker_args(),
             '--access-logfile', '-',
             '--error-logfile', '-',
             'app:app'